@@ -0,0 +1,338 @@
+# backend/admission.py
+"""
+Rate limiting and admission control for expensive endpoints.
+
+Each endpoint class (upload, quiz, rag) has a Policy with two limits:
+
+- a per-user token bucket: `burst` requests at once, refilled at `per_minute` requests per
+  minute. A user over the limit gets 429 with Retry-After set to when the next token arrives.
+- a global concurrency limit: at most `concurrency` requests of the class run at a time; up
+  to `max_queue` more wait (for at most `queue_timeout` seconds) for a slot, and requests
+  beyond that get 429 with Retry-After estimated from the recent request duration.
+
+The state lives in a LocalBackend (per process) or, for deployments with several processes
+or nodes, in a MongoBackend shared through MongoDB (ADMISSION_BACKEND=mongo). When the shared
+backend is unreachable, the controller falls back to the local one rather than rejecting
+requests.
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from observability import Counter, Histogram, get_logger, register
+
+logger = get_logger("admission")
+
+ADMISSION_TOTAL = register(Counter(
+    "noteverse_admission_total", "Admission decisions by endpoint class and outcome.", ["endpoint_class", "outcome"]
+))
+ADMISSION_WAIT_SECONDS = register(Histogram(
+    "noteverse_admission_wait_seconds", "Time admitted requests waited for a concurrency slot.", ["endpoint_class"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+))
+
+SLOT_LEASE_SECONDS = 900 # A shared slot held longer than this (crashed process) is reclaimed
+SLOT_POLL_SECONDS = 0.25
+MAX_LOCAL_BUCKETS = 100000
+
+
+@dataclass(frozen=True)
+class Policy:
+    per_minute: float # Token bucket refill rate per user
+    burst: int # Token bucket capacity per user
+    concurrency: int # Requests of the class running at once
+    max_queue: int # Requests of the class waiting for a slot
+    queue_timeout: float = 30.0 # Seconds a request waits for a slot
+
+    @property
+    def rate(self):
+        return self.per_minute / 60.0
+
+
+DEFAULT_POLICIES = {
+    "upload": Policy(per_minute=6, burst=20, concurrency=4, max_queue=16),
+    "quiz": Policy(per_minute=3, burst=5, concurrency=4, max_queue=8),
+    "rag": Policy(per_minute=20, burst=10, concurrency=8, max_queue=32),
+}
+
+
+def policies_from_env(defaults=DEFAULT_POLICIES):
+    """
+    Overrides per class from RATE_LIMIT_<CLASS>_PER_MINUTE, RATE_LIMIT_<CLASS>_BURST,
+    CONCURRENCY_<CLASS>, QUEUE_<CLASS> and ADMISSION_QUEUE_TIMEOUT.
+    """
+    policies = {}
+    for name, policy in defaults.items():
+        prefix = name.upper()
+        policies[name] = replace(
+            policy,
+            per_minute=float(os.getenv(f"RATE_LIMIT_{prefix}_PER_MINUTE", policy.per_minute)),
+            burst=int(os.getenv(f"RATE_LIMIT_{prefix}_BURST", policy.burst)),
+            concurrency=int(os.getenv(f"CONCURRENCY_{prefix}", policy.concurrency)),
+            max_queue=int(os.getenv(f"QUEUE_{prefix}", policy.max_queue)),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", policy.queue_timeout))
+        )
+    return policies
+
+
+class Rejected(Exception):
+    """A request was not admitted; retry_after is in seconds."""
+
+    def __init__(self, message, retry_after, outcome):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.outcome = outcome
+
+
+# --- Backends ---
+
+class LocalBackend:
+    """Token buckets and concurrency slots of this process."""
+
+    def __init__(self):
+        self._buckets = {} # key -> [tokens, updated_at]
+        self._bucket_lock = threading.Lock()
+        self._slots = {} # endpoint class -> [running, waiting]
+        self._slot_condition = threading.Condition()
+
+    def take(self, key, policy, cost=1.0):
+        """Takes `cost` tokens from the bucket. Returns (allowed, seconds until enough tokens)."""
+        now = time.monotonic()
+        with self._bucket_lock:
+            tokens, updated_at = self._buckets.get(key, (policy.burst, now))
+            tokens = min(policy.burst, tokens + (now - updated_at) * policy.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = [tokens, now]
+            if len(self._buckets) > MAX_LOCAL_BUCKETS:
+                self._evict_idle(now)
+        return allowed, 0.0 if allowed else (cost - tokens) / policy.rate
+
+    def _evict_idle(self, now):
+        # Buckets idle for an hour have refilled under any sensible policy
+        for key in [key for key, (_, updated_at) in self._buckets.items() if now - updated_at > 3600]:
+            del self._buckets[key]
+
+    def acquire(self, name, policy):
+        """Waits for a slot of the class. Returns a release token, or None if the wait timed out."""
+        with self._slot_condition:
+            state = self._slots.setdefault(name, [0, 0])
+            if state[0] >= policy.concurrency and state[1] >= policy.max_queue:
+                raise Rejected("Too many requests are waiting.", None, "queue_full")
+            state[1] += 1
+            try:
+                deadline = time.monotonic() + policy.queue_timeout
+                while state[0] >= policy.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._slot_condition.wait(remaining)
+                state[0] += 1
+            finally:
+                state[1] -= 1
+        return name
+
+    def release(self, name, token):
+        with self._slot_condition:
+            self._slots[name][0] -= 1
+            self._slot_condition.notify()
+
+    def waiting(self, name):
+        with self._slot_condition:
+            return self._slots.get(name, [0, 0])[1]
+
+
+class MongoBackend:
+    """
+    Token buckets and concurrency slots shared by every process through MongoDB.
+    A bucket is refilled and debited by one atomic pipeline update; a concurrency slot is one
+    document per slot, claimed with find_one_and_update and leased so a crashed process does
+    not hold it forever.
+    """
+
+    def __init__(self, db, slot_lease_seconds=SLOT_LEASE_SECONDS):
+        self.buckets = db.rate_limits
+        self.slots = db.admission_slots
+        self.slot_lease_seconds = slot_lease_seconds
+        self._local_waiting = {} # Queue depth is enforced per process
+        self._lock = threading.Lock()
+        self._initialized = set()
+
+    def ensure_indexes(self):
+        self.buckets.create_index("expires_at", expireAfterSeconds=0)
+
+    def take(self, key, policy, cost=1.0):
+        now = time.time()
+        # Idle buckets expire once they would be full again
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=policy.burst / policy.rate + 60)
+        refilled = {"$min": [policy.burst, {"$add": [
+            {"$ifNull": ["$tokens", policy.burst]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, policy.rate]}
+        ]}]}
+        bucket = self.buckets.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now, "expires_at": expires_at}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (cost - bucket["tokens"]) / policy.rate
+
+    def _ensure_slots(self, name, policy):
+        if (name, policy.concurrency) in self._initialized:
+            return
+        for i in range(policy.concurrency):
+            try:
+                self.slots.update_one({"_id": f"{name}:{i}"}, {"$setOnInsert": {"holder": None, "expires_at": 0}},
+                                      upsert=True)
+            except DuplicateKeyError: # Created concurrently by another process
+                pass
+        self._initialized.add((name, policy.concurrency))
+
+    def acquire(self, name, policy):
+        self._ensure_slots(name, policy)
+        with self._lock:
+            if self._local_waiting.get(name, 0) >= policy.max_queue:
+                raise Rejected("Too many requests are waiting.", None, "queue_full")
+            self._local_waiting[name] = self._local_waiting.get(name, 0) + 1
+        try:
+            token = uuid.uuid4().hex
+            slot_ids = [f"{name}:{i}" for i in range(policy.concurrency)]
+            deadline = time.monotonic() + policy.queue_timeout
+            delay = SLOT_POLL_SECONDS / 4
+            while True:
+                now = time.time()
+                slot = self.slots.find_one_and_update(
+                    {"_id": {"$in": slot_ids}, "$or": [{"holder": None}, {"expires_at": {"$lt": now}}]},
+                    {"$set": {"holder": token, "expires_at": now + self.slot_lease_seconds}}
+                )
+                if slot is not None:
+                    return (slot["_id"], token)
+                if time.monotonic() + delay > deadline:
+                    return None
+                time.sleep(delay)
+                delay = min(SLOT_POLL_SECONDS, delay * 2)
+        finally:
+            with self._lock:
+                self._local_waiting[name] -= 1
+
+    def release(self, name, token):
+        slot_id, holder = token
+        self.slots.update_one({"_id": slot_id, "holder": holder}, {"$set": {"holder": None, "expires_at": 0}})
+
+    def waiting(self, name):
+        with self._lock:
+            return self._local_waiting.get(name, 0)
+
+
+# --- Controller ---
+
+class AdmissionController:
+    """Applies the policies of the endpoint classes with a backend; see limit()."""
+
+    def __init__(self, policies, backend=None, enabled=True):
+        self.policies = dict(policies)
+        self.local = LocalBackend()
+        self.backend = backend or self.local
+        self.enabled = enabled
+        self._durations = {} # endpoint class -> moving average of request seconds
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args):
+        # A shared backend that is down must not take the endpoints down with it
+        if self.backend is not self.local:
+            try:
+                return getattr(self.backend, method)(*args)
+            except Rejected:
+                raise
+            except Exception as e:
+                logger.warning("Shared admission backend failed (%s); using local limits.", e)
+        return getattr(self.local, method)(*args)
+
+    def _estimated_wait(self, name, policy):
+        with self._lock:
+            duration = self._durations.get(name, 5.0)
+        queued = self._call("waiting", name) + 1
+        return duration * queued / max(1, policy.concurrency)
+
+    def _record_duration(self, name, seconds):
+        with self._lock:
+            previous = self._durations.get(name)
+            self._durations[name] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def admit(self, name, user_id, cost=1.0):
+        """
+        Applies the rate limit and waits for a concurrency slot. Returns a release token
+        (pass it to release()) or raises Rejected.
+        """
+        policy = self.policies[name]
+        allowed, retry_after = self._call("take", f"{name}:{user_id}", policy, cost)
+        if not allowed:
+            ADMISSION_TOTAL.inc(name, "rate_limited")
+            raise Rejected("Rate limit exceeded. Please slow down.", retry_after, "rate_limited")
+        started = time.perf_counter()
+        try:
+            token = self._call("acquire", name, policy)
+        except Rejected as e:
+            e.retry_after = self._estimated_wait(name, policy)
+            ADMISSION_TOTAL.inc(name, e.outcome)
+            raise
+        if token is None:
+            ADMISSION_TOTAL.inc(name, "queue_timeout")
+            raise Rejected("The server is busy. Please try again shortly.", self._estimated_wait(name, policy),
+                           "queue_timeout")
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, name)
+        ADMISSION_TOTAL.inc(name, "admitted")
+        return token
+
+    def release(self, name, token, seconds=None):
+        if seconds is not None:
+            self._record_duration(name, seconds)
+        # Tokens of the shared backend are tuples, local ones are the class name
+        backend = self.local if isinstance(token, str) else self.backend
+        try:
+            backend.release(name, token)
+        except Exception as e:
+            logger.warning("Could not release %s admission slot: %s", name, e)
+
+    def limit(self, name, user_id=None, cost=None):
+        """
+        Route decorator (below @verify_firebase_token): admits the request for the endpoint
+        class `name` or answers 429 with Retry-After. user_id and cost are callables of no
+        arguments, by default the authenticated user's uid and 1.
+        """
+        from flask import jsonify, request
+
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                uid = user_id() if user_id else request.current_user.get('uid')
+                try:
+                    token = self.admit(name, uid, cost() if cost else 1.0)
+                except Rejected as e:
+                    retry_after = max(1, math.ceil(e.retry_after or 1))
+                    logger.info("Rejected %s request of user %s (%s); retry after %ds.", name, uid, e.outcome, retry_after)
+                    return jsonify({"message": str(e), "retry_after": retry_after}), 429, {"Retry-After": str(retry_after)}
+                started = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.release(name, token, time.perf_counter() - started)
+            return decorated_function
+        return decorator
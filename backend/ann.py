@@ -0,0 +1,183 @@
+# backend/ann.py
+"""
+Approximate nearest-neighbour settings and quantized embedding storage.
+
+- HNSW parameters (M, construction ef, search ef) for ChromaDB collections, configurable
+  through environment variables and recorded with the active collection. ChromaDB fixes them
+  when a collection is created, so CHROMA_HNSW_* only affect the default collection the API
+  creates on first start and the collections reindex.py builds; an existing collection keeps
+  its parameters until it is re-indexed.
+- float16 / int8 quantization of chunk embeddings, with exact brute-force search over them
+  (bench_ann.py's recall reference), and QuantizedSearch, the API's opt-in search mode
+  (ANN_QUANTIZATION=int8|float16): an exact scan of a quantized in-memory copy of the user's
+  embeddings picks candidates, and their float32 embeddings from ChromaDB decide the top k.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ChromaDB's own defaults, used when nothing is configured
+HNSW_DEFAULTS = {
+    "hnsw_m": 16,
+    "hnsw_construction_ef": 100,
+    "hnsw_search_ef": 10
+}
+QUANTIZATION_MODES = ("float32", "float16", "int8")
+RESCORE_FACTOR = 4 # Quantized candidates rescored in float32 per result
+SNAPSHOT_MAX_USERS = 256
+SNAPSHOT_TTL_SECONDS = 300 # Picks up chunks written by other API processes
+
+
+def hnsw_settings_from_env(base=None):
+    """
+    HNSW settings for newly created collections: CHROMA_HNSW_M / _EF_CONSTRUCTION / _EF_SEARCH
+    where set, the values of `base` (or ChromaDB's defaults) otherwise.
+    """
+    base = base or HNSW_DEFAULTS
+    return {
+        "hnsw_m": int(os.getenv("CHROMA_HNSW_M", base["hnsw_m"])),
+        "hnsw_construction_ef": int(os.getenv("CHROMA_HNSW_EF_CONSTRUCTION", base["hnsw_construction_ef"])),
+        "hnsw_search_ef": int(os.getenv("CHROMA_HNSW_EF_SEARCH", base["hnsw_search_ef"]))
+    }
+
+
+def hnsw_collection_metadata(settings):
+    """Collection metadata understood by ChromaDB. Only applied when the collection is created."""
+    return {
+        "hnsw:M": int(settings.get("hnsw_m", HNSW_DEFAULTS["hnsw_m"])),
+        "hnsw:construction_ef": int(settings.get("hnsw_construction_ef", HNSW_DEFAULTS["hnsw_construction_ef"])),
+        "hnsw:search_ef": int(settings.get("hnsw_search_ef", HNSW_DEFAULTS["hnsw_search_ef"]))
+    }
+
+
+def quantize(vectors, mode):
+    """
+    Quantizes an (n, d) float matrix.
+    Returns (codes, scales); scales is None except for int8, which uses a symmetric per-vector scale.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "float32":
+        return vectors, None
+    if mode == "float16":
+        return vectors.astype(np.float16), None
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization mode '{mode}'. Use one of {QUANTIZATION_MODES}.")
+
+
+def dequantize(codes, scales):
+    """Inverse of quantize()."""
+    vectors = codes.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+
+def exact_search(vectors, query, k):
+    """Exact top-k by squared L2 distance (ChromaDB's default space). Returns row indices."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    distances = np.einsum('ij,ij->i', vectors, vectors) - 2.0 * (vectors @ query)
+    k = min(k, len(distances))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top])]
+
+
+class QuantizedSnapshot:
+    """Quantized in-memory copy of chunk embeddings."""
+
+    def __init__(self, ids, user_ids, codes, scales, mode):
+        self.ids = np.asarray(ids)
+        self.user_ids = np.asarray(user_ids)
+        self.codes = codes
+        self.scales = scales
+        self.mode = mode
+
+    @classmethod
+    def from_vectors(cls, ids, user_ids, vectors, mode):
+        codes, scales = quantize(vectors, mode)
+        return cls(ids, user_ids, codes, scales, mode)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def search(self, query, k, user_id=None):
+        """Exact search over the (dequantized) snapshot, optionally restricted to one user."""
+        rows = np.arange(len(self.ids)) if user_id is None else np.flatnonzero(self.user_ids == user_id)
+        if len(rows) == 0:
+            return []
+        scales = self.scales[rows] if self.scales is not None else None
+        top = exact_search(dequantize(self.codes[rows], scales), query, k)
+        return [str(self.ids[rows[i]]) for i in top]
+
+
+class QuantizedSearch:
+    """
+    Searches a user's chunks over a quantized copy of their embeddings, rescored in float32.
+
+    Copies are loaded from the ChromaDB collection on a user's first search, kept for the
+    max_users most recent users, and reloaded after ttl seconds or once invalidate() reports
+    that the user's chunks changed in this process.
+    """
+
+    def __init__(self, collection, mode, rescore_factor=RESCORE_FACTOR, max_users=SNAPSHOT_MAX_USERS,
+                 ttl=SNAPSHOT_TTL_SECONDS):
+        if mode not in QUANTIZATION_MODES[1:]:
+            raise ValueError(f"Unknown quantization mode '{mode}'. Use one of {QUANTIZATION_MODES[1:]}.")
+        self.collection = collection
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+        self.max_users = max_users
+        self.ttl = ttl
+        self._snapshots = OrderedDict() # user_id -> (snapshot, loaded_at)
+        self._generations = {} # user_id -> invalidations so far, so a load racing a write is not kept
+        self._lock = threading.Lock()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._snapshots.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def _snapshot(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._snapshots.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._snapshots.move_to_end(user_id)
+                return entry[0]
+            generation = self._generations.get(user_id, 0)
+        stored = self.collection.get(where={"user_id": user_id}, include=["embeddings"])
+        if stored["ids"]:
+            snapshot = QuantizedSnapshot.from_vectors(stored["ids"], [user_id] * len(stored["ids"]),
+                                                      np.asarray(stored["embeddings"], dtype=np.float32), self.mode)
+        else:
+            snapshot = QuantizedSnapshot([], [], np.zeros((0, 0), dtype=np.float32), None, self.mode)
+        with self._lock:
+            if self._generations.get(user_id, 0) == generation:
+                self._snapshots[user_id] = (snapshot, now)
+                self._snapshots.move_to_end(user_id)
+                while len(self._snapshots) > self.max_users:
+                    self._snapshots.popitem(last=False)
+        return snapshot
+
+    def search(self, query_vector, k, user_id):
+        """The top k chunks of a user as (chunk id, document, metadata) tuples, nearest first."""
+        snapshot = self._snapshot(user_id)
+        if len(snapshot.ids) == 0:
+            return []
+        candidates = snapshot.search(query_vector, k * self.rescore_factor)
+        # Chunks deleted since the copy was loaded are simply missing here
+        stored = self.collection.get(ids=candidates, include=["embeddings", "documents", "metadatas"])
+        if not stored["ids"]:
+            return []
+        top = exact_search(np.asarray(stored["embeddings"], dtype=np.float32), query_vector, k)
+        return [(stored["ids"][i], stored["documents"][i], stored["metadatas"][i]) for i in top]
@@ -7,76 +7,119 @@ from flask_cors import CORS
 from functools import wraps
 from werkzeug.utils import secure_filename
 import json
-# Metrics and comparison imports
-import Levenshtein
-import string
+import base64
+import contextvars
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Image processing and OCR imports
 import cv2
 import numpy as np
 import easyocr
-from pdf2image import convert_from_path
 from PIL import Image # Used by pdf2image to return images
 
 import fitz # PyMuPDF for PDF handling (used in is_digital_pdf and extract_text_from_pdf)
 # Database imports
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
 
 # Firebase Admin SDK imports
 import firebase_admin
 from firebase_admin import credentials, auth
 
-from openai import OpenAI # For LLM post-processing
-from keybert import KeyBERT # For keyword extraction
-
-# New import for YouTube Data API
-from googleapiclient.discovery import build
 
 # New imports for RAG (LangChain, ChromaDB, Sentence Transformers)
-from langchain.text_splitter import RecursiveCharacterTextSplitter # <--- CORRECTED: This is the correct import path
-from langchain.schema import Document
-
 from langchain_chroma import Chroma
+from langchain.schema import Document
 from langchain_huggingface import HuggingFaceEmbeddings as SentenceTransformerEmbeddings
+from onnx_embeddings import OnnxEmbeddings, default_model_dir, load_encoder
+from sentence_transformers import CrossEncoder # Optional re-ranker for RAG context
+
+import pipeline # Extraction stages shared with the offline evaluator (evaluate.py)
+import quiz_generation
+from keywords import KeywordService
+from uploads import ResumableUploads, UploadError, hash_file, receive_stream
+from jobs import JobQueue, job_status
+from revision import RevisionStore, grade_answers
+import related_notes
+from related_notes import BackgroundUpdater, RelatedNotesStore
+import topic_clusters
+from topic_clusters import TopicStore
+from note_bodies import NoteBodyStore, inline_text, note_preview, summary_fields
+from serialization import FastJSONProvider, init_compression
+import upstreams
+from upstreams import CircuitBreaker, RetryPolicy, TTLCache, UpstreamUnavailable
+from model_router import (
+    BudgetExceeded, ModelRouter, UsageStore, prices_from_env, question_complexity, routes_from_env
+)
+from admission import AdmissionController, MongoBackend, policies_from_env
+from storage import LocalStorage, original_key, storage_from_env, thumbnail_key
+from rag_context import build_context, count_tokens
+from note_index import (
+    build_chunk_documents, sync_notes_chunks, delete_note_chunks, fit_max_seq_length, load_active_collection,
+    load_chunk_length_function, page_offsets_for, PAGE_SEPARATOR
+)
+from ann import QuantizedSearch, hnsw_collection_metadata
+import observability
+from observability import current_trace_id, logger, span
 
 
 # --- Load Environment Variables ---
 # This must be at the very top to ensure env vars are loaded before app initialization needs them
 load_dotenv()
-print("Environment variables loaded. FLASK_ENV is:", os.getenv("FLASK_ENV"))
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
+# --- Logging, Trace Ids and Metrics ---
+# LOG_LEVEL (default INFO), LOG_FORMAT (json|text) and METRICS_ENABLED come from .env
+observability.configure(app)
+logger.info("Environment variables loaded. FLASK_ENV is: %s", os.getenv("FLASK_ENV"))
+
+# --- JSON Serialization and Response Compression ---
+# jsonify serializes ObjectId/datetime/numpy values itself (with orjson when installed).
+# JSON/text responses of at least COMPRESS_MIN_BYTES are sent brotli- or gzip-compressed
+# when the client accepts it (COMPRESSION_ENABLED=false turns this off, e.g. behind a proxy
+# that compresses).
+app.json = FastJSONProvider(app)
+if os.getenv("COMPRESSION_ENABLED", "true").lower() not in ("0", "false", "no"):
+    init_compression(app, min_bytes=int(os.getenv("COMPRESS_MIN_BYTES", 1024)))
+
 # Enable CORS for all origins during development.
 # In production, restrict this to your frontend's domain for security.
-CORS(app)
+CORS(app, expose_headers=["Location", "Upload-Offset", "Upload-Length", "Tus-Resumable", "X-Trace-Id", "Retry-After"])
 
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a_super_secret_key_for_dev') # Add a secret key for session management (Flask security)
 
 
-# --- Ground Truth Folder Configuration ---
-GROUND_TRUTH_FOLDER = os.path.join(app.root_path, 'Ground_Truth')
-if not os.path.exists(GROUND_TRUTH_FOLDER):
-    print("Warning: Ground truth folder not found. Evaluation metrics will be skipped.")
-
-# --- Results Folder Configuration (NEW) ---
-RESULTS_FOLDER = os.path.join(app.root_path, 'Evaluation_Results')
-if not os.path.exists(RESULTS_FOLDER):
-    os.makedirs(RESULTS_FOLDER)
-    print("Created results folder at: " + RESULTS_FOLDER)
-
-
-
 # --- Upload Folder Configuration ---
 # Define an absolute path to store uploaded notes
-UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(app.root_path, 'uploads'))
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER) # Create the uploads directory if it doesn't exist
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # Limit uploads to 16MB (e.g., for large PDFs)
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # Limit each request body to 16MB (e.g., for large PDFs)
+# Uploads are streamed to disk in chunks. Files larger than one request body go through the
+# resumable /api/uploads endpoints, in chunks of up to MAX_CONTENT_LENGTH each.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 512 * 1024 * 1024))
+UPLOAD_IN_MEMORY_LIMIT = int(os.getenv("UPLOAD_IN_MEMORY_LIMIT", 8 * 1024 * 1024)) # Smaller files are processed in memory
+resumable_uploads = ResumableUploads(
+    UPLOAD_FOLDER, max_bytes=MAX_UPLOAD_BYTES,
+    ttl_seconds=int(os.getenv("RESUMABLE_UPLOAD_TTL_SECONDS", 24 * 3600))
+)
+# Uploads are received into a staging directory and moved to object storage once processed
+STAGING_FOLDER = os.path.join(UPLOAD_FOLDER, ".staging")
+os.makedirs(STAGING_FOLDER, exist_ok=True)
+
+# --- Object Storage Initialization ---
+try:
+    object_storage = storage_from_env(UPLOAD_FOLDER)
+except Exception:
+    logger.exception("Could not initialize object storage")
+    logger.warning("Falling back to local storage in '%s'.", UPLOAD_FOLDER)
+    object_storage = LocalStorage(UPLOAD_FOLDER)
 
 # --- OCR Reader Initialization (EasyOCR) ---
 # Initialize EasyOCR reader once globally for efficiency
@@ -84,12 +127,12 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # Limit uploads to 16MB (e.g
 # Use gpu=True if you have an NVIDIA GPU and CUDA/cuDNN set up, otherwise gpu=False.
 try:
     reader = easyocr.Reader(['en', 'hi'], gpu=True) # Example languages: English and Hindi
-    print("EasyOCR reader initialized successfully (GPU enabled).")
-except Exception as e:
-    print(f"Error initializing EasyOCR reader with GPU: {e}")
-    print("Falling back to CPU mode for EasyOCR.")
+    logger.info("EasyOCR reader initialized successfully (GPU enabled).")
+except Exception:
+    logger.exception("Could not initialize EasyOCR reader with GPU")
+    logger.warning("Falling back to CPU mode for EasyOCR.")
     reader = easyocr.Reader(['en', 'hi'], gpu=False) # Fallback to CPU mode
-    print("EasyOCR reader initialized successfully (CPU mode).")
+    logger.info("EasyOCR reader initialized successfully (CPU mode).")
 
 # --- MongoDB Connection ---
 mongo_uri = os.getenv("MONGO_URI")
@@ -98,7 +141,7 @@ mongo_db_name = os.getenv("MONGO_DB_NAME", "NoteVerseDB") # Default name if not
 mongo_client = None
 db = None
 if not mongo_uri:
-    print("Error: MONGO_URI is not set in .env. MongoDB connection will not be established.")
+    logger.error("MONGO_URI is not set in .env. MongoDB connection will not be established.")
 else:
     try:
         mongo_client = MongoClient(mongo_uri)
@@ -106,41 +149,222 @@ else:
         # The ping command is cheap and does not require auth.
         # It's a good way to check if the server is alive.
         mongo_client.admin.command('ping')
-        print(f"MongoDB connected to database: '{mongo_db_name}'")
-    except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
-        print("Please check your MONGO_URI and network access settings.")
+        logger.info("MongoDB connected to database: '%s'", mongo_db_name)
+        # Lets release_stored_upload() find other notes sharing a stored file or thumbnail
+        db.notes.create_index("storage_key", sparse=True)
+        db.notes.create_index("thumbnail_key", sparse=True)
+        # Lets batch uploads find notes the user already uploaded
+        db.notes.create_index([("user_id", 1), ("content_sha256", 1)])
+    except Exception:
+        logger.exception("Could not connect to MongoDB")
+        logger.error("Please check your MONGO_URI and network access settings.")
         mongo_client = None
         db = None
 
 
+# --- Note Text Storage ---
+# Full note texts live compressed in `note_bodies`, outside the note documents that listings scan
+NOTE_BODY_CODEC = os.getenv("NOTE_BODY_CODEC") # zstd (default when installed) or zlib
+NOTE_BODY_INLINE_MAX_BYTES = int(os.getenv("NOTE_BODY_INLINE_MAX_BYTES", str(1024 * 1024)))
+note_bodies = None
+if db is not None:
+    try:
+        note_bodies = NoteBodyStore(db, codec=NOTE_BODY_CODEC, inline_max_bytes=NOTE_BODY_INLINE_MAX_BYTES)
+        logger.info("Note body store initialized (%s).", note_bodies.codec)
+    except Exception:
+        logger.exception("Could not initialize the note body store")
+        logger.warning("Note texts will be stored inline in the note documents.")
+        note_bodies = None
+
+
+def note_text(note, raw=False):
+    """The text of a note document (raw=True: the OCR text before clean-up)."""
+    if note_bodies is not None:
+        return note_bodies.get(note, raw)
+    return inline_text(note, raw)
+
+
+def note_text_fields(text, raw_text):
+    """Text fields of a note document: a preview, plus the full texts while the body store is unavailable."""
+    fields = summary_fields(text)
+    if note_bodies is None:
+        fields.update(extracted_text=text, raw_ocr_text=raw_text)
+    return fields
+
+
+# --- Quiz Attempts and Revision Scheduling ---
+revision_store = None
+if db is not None:
+    try:
+        revision_store = RevisionStore(db)
+        revision_store.ensure_indexes()
+    except Exception:
+        logger.exception("Could not initialize the revision scheduler")
+        revision_store = None
+
+
+# --- Related Notes ---
+# Each note's top-k most similar notes, kept on the note document and updated in the
+# background whenever notes are added, edited or deleted (see related_notes.py)
+related_store = None
+related_updates = None
+if db is not None:
+    try:
+        related_store = RelatedNotesStore(
+            db, k=int(os.getenv("RELATED_NOTES_K", related_notes.RELATED_K)),
+            min_score=float(os.getenv("RELATED_NOTES_MIN_SCORE", related_notes.MIN_SCORE))
+        )
+        related_store.ensure_indexes()
+        related_updates = BackgroundUpdater(related_store, "related-notes")
+    except Exception:
+        logger.exception("Could not initialize related notes")
+        related_store = None
+        related_updates = None
+
+
+# --- Topic Clustering ---
+# Notes grouped into per-user topics (integer topic_id on each note) by incremental
+# mini-batch k-means over the note vectors, updated in the background (see topic_clusters.py)
+topic_store = None
+topic_updates = None
+if db is not None:
+    try:
+        topic_store = TopicStore(
+            db, max_topics=int(os.getenv("TOPIC_MAX_PER_USER", topic_clusters.MAX_TOPICS)),
+            new_topic_similarity=float(os.getenv("TOPIC_NEW_SIMILARITY", topic_clusters.NEW_TOPIC_SIMILARITY))
+        )
+        topic_store.ensure_indexes()
+        topic_updates = BackgroundUpdater(topic_store, "topics")
+    except Exception:
+        logger.exception("Could not initialize topic clustering")
+        topic_store = None
+        topic_updates = None
+
+
+# --- Ingestion Job Queue ---
+# With INGEST_MODE=queue, uploads are stored and handed to worker.py processes (on any node)
+# through MongoDB instead of being processed inside the web request (INGEST_MODE=inline).
+INGEST_MODE = os.getenv("INGEST_MODE", "inline").lower()
+ingest_jobs = None
+if db is not None:
+    try:
+        ingest_jobs = JobQueue(
+            db.ingest_jobs,
+            lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", 300)),
+            max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+        )
+        ingest_jobs.ensure_indexes()
+    except Exception:
+        logger.exception("Could not initialize the ingestion job queue")
+        ingest_jobs = None
+if INGEST_MODE == "queue" and ingest_jobs is None:
+    logger.warning("INGEST_MODE=queue needs MongoDB. Uploads will be processed inline.")
+QUEUE_UPLOADS = INGEST_MODE == "queue" and ingest_jobs is not None
+# Files of a batch (or of a worker's batch of jobs) sent to the vision model at the same time
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", 4))
+# Limits of /api/upload-notes, which accepts many files in one request
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", 50))
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_BYTES", 256 * 1024 * 1024))
+
+
+# --- Rate Limiting and Admission Control ---
+# Per-user token buckets and per-endpoint-class concurrency limits for the expensive endpoints
+# (see admission.py for the RATE_LIMIT_*/CONCURRENCY_*/QUEUE_* settings). ADMISSION_BACKEND=mongo
+# shares the limits between all API processes; the default (local) applies them per process.
+admission_backend = None
+if os.getenv("ADMISSION_BACKEND", "local").lower() == "mongo":
+    if db is None:
+        logger.warning("ADMISSION_BACKEND=mongo needs MongoDB. Limits will be applied per process.")
+    else:
+        try:
+            admission_backend = MongoBackend(db)
+            admission_backend.ensure_indexes()
+        except Exception:
+            logger.exception("Could not initialize the shared admission backend")
+            admission_backend = None
+admission = AdmissionController(
+    policies_from_env(), backend=admission_backend,
+    enabled=os.getenv("ADMISSION_ENABLED", "true").lower() not in ("0", "false", "no")
+)
+
+
+# --- Outbound Clients (OpenAI, YouTube) ---
+# Timeouts, pooled connections, jittered retries and circuit breakers (see upstreams.py)
+UPSTREAM_RETRY = RetryPolicy(
+    attempts=int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "3")),
+    base_delay=float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5")),
+    max_delay=float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "8"))
+)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+def upstream_unavailable_response(error, action):
+    """503 with Retry-After for a call refused because its upstream's circuit breaker is open."""
+    response = jsonify({"message": f"{action} is temporarily unavailable: {error}", "retry_after": int(error.retry_after) + 1})
+    response.headers["Retry-After"] = str(int(error.retry_after) + 1)
+    return response, 503
+
+
 # --- OpenAI Client Initialization ---
 openai_api_key = os.getenv("OPENAI_API_KEY")
 openai_client = None
 if not openai_api_key:
-    print("Warning: OPENAI_API_KEY is not set in .env. LLM post-processing will be skipped.")
+    logger.warning("OPENAI_API_KEY is not set in .env. LLM post-processing will be skipped.")
 else:
     try:
-        openai_client = OpenAI(api_key=openai_api_key)
-        print("OpenAI client initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing OpenAI client: {e}")
+        openai_client = upstreams.openai_client(
+            openai_api_key, base_url=os.getenv("OPENAI_BASE_URL") or None,
+            timeout=float(os.getenv("OPENAI_TIMEOUT", str(upstreams.OPENAI_TIMEOUT))),
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", str(upstreams.OPENAI_MAX_CONNECTIONS))),
+            retry=UPSTREAM_RETRY,
+            breaker=CircuitBreaker("openai", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        )
+        logger.info("OpenAI client initialized successfully.")
+    except Exception:
+        logger.exception("Could not initialize OpenAI client")
         openai_client = None
 
 
-# --- KeyBERT Model Initialization ---
-keybert_model = None
+# --- Model Routing and LLM Usage Accounting ---
+# Models per task and tier come from MODEL_ROUTES (see model_router.py); every call's tokens,
+# latency and cost are recorded in Mongo and counted against the user's daily token budget.
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0")) # 0: unlimited
+llm_usage = None
+if db is not None:
+    try:
+        llm_usage = UsageStore(db)
+        llm_usage.ensure_indexes()
+    except Exception:
+        logger.exception("Could not initialize LLM usage accounting")
+        llm_usage = None
+model_router = ModelRouter(
+    routes_from_env(), prices_from_env(), usage=llm_usage, daily_token_budget=USER_DAILY_TOKEN_BUDGET,
+    economy_fraction=float(os.getenv("BUDGET_ECONOMY_FRACTION", "0.8"))
+)
+
+
+def budget_exceeded_response(error):
+    """429 with Retry-After (the next UTC day) for a user whose daily token budget is spent."""
+    response = jsonify({"message": str(error), "retry_after": int(error.retry_after) + 1})
+    response.headers["Retry-After"] = str(int(error.retry_after) + 1)
+    return response, 429
+
+
+# --- Keyword Service Initialization ---
+keyword_service = None
 try:
     # 'paraphrase-multilingual-MiniLM-L12-v2' is a good model for multilingual text embeddings.
     # It allows KeyBERT to semantically understand text in multiple languages,
     # which helps even if your final output is English, as it understands the original input.
-    model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
-    keybert_model = KeyBERT(model=model_name)
-    print(f"KeyBERT model '{model_name}' initialized successfully.")
-except Exception as e:
-    print(f"Error initializing KeyBERT model: {e}")
-    print("Keyword extraction will be skipped.")
-    keybert_model = None
+    # With KEYWORD_WORKERS > 0 the model runs in worker processes instead of the request threads.
+    keyword_service = KeywordService.from_env()
+    logger.info("Keyword service '%s' initialized successfully (%s worker processes).",
+                keyword_service.model_name, keyword_service.workers or 'no')
+except Exception:
+    logger.exception("Could not initialize keyword service")
+    logger.warning("Keyword extraction will be skipped.")
+    keyword_service = None
 
 
 # --- YouTube Data API Service Initialization ---
@@ -148,65 +372,177 @@ youtube_service = None
 youtube_api_key = os.getenv("YOUTUBE_API_KEY")
 
 if not youtube_api_key:
-    print("Warning: YOUTUBE_API_KEY is not set in .env. YouTube resource linking will be skipped.")
+    logger.warning("YOUTUBE_API_KEY is not set in .env. YouTube resource linking will be skipped.")
 else:
     try:
-        # 'youtube' is the API name, 'v3' is the version
-        youtube_service = build('youtube', 'v3', developerKey=youtube_api_key) 
-        print("YouTube Data API service initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing YouTube Data API service: {e}")
+        youtube_service = upstreams.YouTubeClient(
+            youtube_api_key, api_endpoint=os.getenv("YOUTUBE_API_ENDPOINT") or None,
+            timeout=float(os.getenv("YOUTUBE_TIMEOUT", str(upstreams.YOUTUBE_TIMEOUT))),
+            retry=UPSTREAM_RETRY,
+            breaker=CircuitBreaker("youtube", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS),
+            cache=TTLCache(ttl=float(os.getenv("YOUTUBE_CACHE_SECONDS", str(upstreams.YOUTUBE_CACHE_SECONDS))))
+        )
+        logger.info("YouTube Data API service initialized successfully.")
+    except Exception:
+        logger.exception("Could not initialize YouTube Data API service")
         youtube_service = None
 
 
 # --- RAG: Embedding Model and Vector Store Initialization ---
 embedding_function = None
 vectorstore = None
-chroma_db_path = os.path.join(app.root_path, "chroma_db") # Local directory for ChromaDB
+chroma_db_path = os.getenv("CHROMA_DB_PATH", os.path.join(app.root_path, "chroma_db")) # Local directory for ChromaDB
+
+# Collection, embedding model and chunking parameters currently in use.
+# reindex.py builds a new collection and switches this pointer when migrating models.
+active_collection = load_active_collection(chroma_db_path)
+
+# EMBEDDING_BACKEND=onnx runs the model exported by onnx_embeddings.py (int8 unless
+# ONNX_QUANTIZED=false or the int8 model failed its check) instead of PyTorch.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() == "true"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0)) # 0: ONNX Runtime's default
+
+
+def load_embedding_function(settings):
+    """
+    The embedding function of a collection's model, on ONNX Runtime if configured and
+    available, with an input window that fits the collection's chunks.
+    """
+    model_name = settings["embedding_model_name"]
+    if EMBEDDING_BACKEND == "onnx":
+        try:
+            encoder = load_encoder(os.getenv("ONNX_MODEL_DIR") or default_model_dir(model_name), model_name=model_name,
+                                   quantized=ONNX_QUANTIZED, threads=ONNX_THREADS)
+            logger.info("Embedding model '%s' runs on ONNX Runtime (%s).", model_name, encoder.model_file)
+            return OnnxEmbeddings(fit_max_seq_length(encoder, settings))
+        except Exception:
+            logger.exception("Could not load the ONNX model for '%s'. Using PyTorch.", model_name)
+    embeddings = SentenceTransformerEmbeddings(model_name=model_name)
+    fit_max_seq_length(embeddings._client, settings)
+    return embeddings
+
 
 try:
     # Initialize embedding model (multilingual for better semantic understanding of diverse notes)
-    embedding_model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-    embedding_function = SentenceTransformerEmbeddings(model_name=embedding_model_name)
-    print(f"Embedding model '{embedding_model_name}' initialized successfully.")
+    embedding_model_name = active_collection["embedding_model_name"]
+    embedding_function = load_embedding_function(active_collection)
+    logger.info("Embedding model '%s' initialized successfully.", embedding_model_name)
+
+    # Chunks are sized in the collection's unit: the embedding model's own tokens, or characters
+    # for collections built before that
+    try:
+        chunk_length_function = load_chunk_length_function(active_collection)
+    except Exception:
+        logger.exception("Could not load tokenizer for '%s'. Estimating tokens from characters.", embedding_model_name)
+        chunk_length_function = lambda text: max(1, len(text) // 4)
 
     # Initialize ChromaDB vectorstore
     # If the directory doesn't exist, ChromaDB will create it.
     # This will load existing data or create an empty database.
+    # HNSW parameters (CHROMA_HNSW_M / _EF_CONSTRUCTION / _EF_SEARCH) apply when the collection is created.
     vectorstore = Chroma(
+        collection_name=active_collection["collection_name"],
         persist_directory=chroma_db_path,
-        embedding_function=embedding_function
+        embedding_function=embedding_function,
+        collection_metadata=hnsw_collection_metadata(active_collection)
         # Chroma 0.4.x+ automatically persists, no need for explicit .persist() here
     )
-    print(f"ChromaDB vectorstore initialized at: {chroma_db_path}")
+    logger.info("ChromaDB vectorstore initialized at: %s (collection '%s')",
+                chroma_db_path, active_collection['collection_name'])
 
-except Exception as e:
-    print(f"Error initializing RAG components (Embedding Model/ChromaDB): {e}")
-    print("RAG functionality will be skipped.")
+except Exception:
+    logger.exception("Could not initialize RAG components (Embedding Model/ChromaDB)")
+    logger.warning("RAG functionality will be skipped.")
     embedding_function = None
     vectorstore = None
 
+# --- Vision Preprocessing Settings ---
+# Pages are deskewed, cropped, converted to grayscale and downscaled to the vision model's
+# effective resolution before upload (VISION_PREPROCESS=false sends the full-size pages).
+VISION_PREPROCESS = pipeline.preprocess_options_from_env()
+
+# --- Quiz Generation Settings ---
+# QUIZ_MODE=auto sends notes up to QUIZ_SINGLE_PROMPT_TOKENS in one prompt and generates
+# questions for longer notes per section of their chunks, QUIZ_MAP_WORKERS sections at a time.
+QUIZ_MODE = os.getenv("QUIZ_MODE", "auto").lower()
+QUIZ_SINGLE_PROMPT_TOKENS = int(os.getenv("QUIZ_SINGLE_PROMPT_TOKENS", 3000))
+QUIZ_MAP_WORKERS = int(os.getenv("QUIZ_MAP_WORKERS", quiz_generation.MAP_WORKERS))
+QUIZ_QUESTION_COUNT = int(os.getenv("QUIZ_QUESTION_COUNT", 5))
+
+# --- RAG: Context Assembly Settings ---
+# How many chunks to pull from ChromaDB before deduplication/merging, and how many
+# tokens of note text the final prompt context may use.
+RAG_CANDIDATE_K = int(os.getenv("RAG_CANDIDATE_K", 8))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", 1500))
+
+# Optional quantized search (ANN_QUANTIZATION=int8 or float16): a user's chunks are searched over
+# an in-memory quantized copy of their embeddings, rescored with the float32 ones (see ann.py).
+quantized_search = None
+ANN_QUANTIZATION = os.getenv("ANN_QUANTIZATION", "").lower()
+if ANN_QUANTIZATION and vectorstore:
+    try:
+        quantized_search = QuantizedSearch(
+            vectorstore._collection, ANN_QUANTIZATION,
+            rescore_factor=int(os.getenv("ANN_RESCORE_FACTOR", "4")),
+            ttl=float(os.getenv("ANN_SNAPSHOT_TTL_SECONDS", "300"))
+        )
+        logger.info("Note searches use %s quantized embeddings.", ANN_QUANTIZATION)
+    except Exception:
+        logger.exception("Could not set up quantized search. Searching ChromaDB directly.")
+        quantized_search = None
+
+
+def search_user_chunks(query, k, user_uid):
+    """vectorstore.similarity_search within a user's chunks, over the quantized copy when configured."""
+    if quantized_search is not None:
+        try:
+            return [Document(page_content=text or "", metadata=metadata or {}) for _, text, metadata in
+                    quantized_search.search(np.asarray(embedding_function.embed_query(query), dtype=np.float32), k, user_uid)]
+        except Exception:
+            logger.exception("Quantized search failed. Searching ChromaDB directly.")
+    return vectorstore.similarity_search(query=query, k=k, filter={"user_id": user_uid})
+
+
+def chunks_changed(user_uid):
+    """Drops the user's quantized copy after their chunks were written or deleted."""
+    if quantized_search is not None:
+        quantized_search.invalidate(user_uid)
+
+# Optional local cross-encoder for re-ranking retrieved chunks,
+# e.g. RAG_RERANK_MODEL=cross-encoder/ms-marco-MiniLM-L-6-v2. Disabled when unset.
+rerank_model = None
+rerank_model_name = os.getenv("RAG_RERANK_MODEL")
+if rerank_model_name:
+    try:
+        rerank_model = CrossEncoder(rerank_model_name)
+        logger.info("RAG re-ranker '%s' initialized successfully.", rerank_model_name)
+    except Exception:
+        logger.exception("Could not initialize RAG re-ranker '%s'", rerank_model_name)
+        logger.warning("RAG context will use vector similarity order only.")
+        rerank_model = None
+
 # --- Firebase Admin SDK Initialization ---
 SERVICE_ACCOUNT_KEY_PATH = os.getenv("FIREBASE_SERVICE_ACCOUNT_KEY_PATH")
 
 if not SERVICE_ACCOUNT_KEY_PATH:
-    print("Error: FIREBASE_SERVICE_ACCOUNT_KEY_PATH is not set in .env")
-    print("Please ensure your .env file has: FIREBASE_SERVICE_ACCOUNT_KEY_PATH=./serviceAccountKey.json")
+    logger.error("FIREBASE_SERVICE_ACCOUNT_KEY_PATH is not set in .env")
+    logger.error("Please ensure your .env file has: FIREBASE_SERVICE_ACCOUNT_KEY_PATH=./serviceAccountKey.json")
     exit(1) # Exit if the path is not set, as authentication won't work
 
 # Check if the service account key file actually exists
 if not os.path.exists(SERVICE_ACCOUNT_KEY_PATH):
-    print(f"Error: Firebase service account key file not found at {SERVICE_ACCOUNT_KEY_PATH}")
-    print("Please download 'serviceAccountKey.json' from Firebase Console and place it in the backend directory.")
+    logger.error("Firebase service account key file not found at %s", SERVICE_ACCOUNT_KEY_PATH)
+    logger.error("Please download 'serviceAccountKey.json' from Firebase Console and place it in the backend directory.")
     exit(1) # Exit if the key file is missing
 
 try:
     cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH)
     firebase_admin.initialize_app(cred)
-    print("Firebase Admin SDK initialized successfully.")
-except Exception as e:
-    print(f"Error initializing Firebase Admin SDK: {e}")
-    print("Please check your serviceAccountKey.json file for errors or corruption.")
+    logger.info("Firebase Admin SDK initialized successfully.")
+except Exception:
+    logger.exception("Could not initialize Firebase Admin SDK")
+    logger.error("Please check your serviceAccountKey.json file for errors or corruption.")
     exit(1)
 
 # --- Decorator for Protected Routes ---
@@ -228,10 +564,11 @@ def verify_firebase_token(f):
 
         try:
             # Verify the ID token using Firebase Admin SDK
-            decoded_token = auth.verify_id_token(id_token)
+            with span("token_verification"):
+                decoded_token = auth.verify_id_token(id_token)
             # Add the decoded token (which contains user UID, email, etc.) to the request context
             request.current_user = decoded_token
-            print(f"Token verified for user: {decoded_token.get('email', 'N/A')} (UID: {decoded_token.get('uid')})")
+            logger.debug("Token verified for user: %s (UID: %s)", decoded_token.get('email', 'N/A'), decoded_token.get('uid'))
         except Exception as e:
             # Catch various errors: expired token, invalid token, etc.
             return jsonify({"message": f"Invalid or expired token: {e}"}), 403 # Forbidden
@@ -257,77 +594,161 @@ def verify_firebase_token(f):
 #             text += page.get_text()
 #     return text
 
-#  helper function to your app.py file to convert image data into a Base64 string
-import base64
+def extract_keywords(text, doc_embedding=None):
+    """
+    Extracts topic keywords from note text. doc_embedding (the mean of the note's chunk vectors)
+    is used as the document embedding when it comes from the keyword model. Returns an empty
+    list on failure.
+    """
+    return extract_keywords_batch([text], [doc_embedding])[0]
+
+
+def extract_keywords_batch(texts, doc_embeddings=None):
+    """extract_keywords() for several notes in one KeyBERT batch. Returns one list per text."""
+    doc_embeddings = list(doc_embeddings) if doc_embeddings is not None else [None] * len(texts)
+    extracted_keywords = [[] for _ in texts] # Empty lists for skipped texts and on failure
+    batch = [i for i, text in enumerate(texts) if len(text.strip()) > 50] # Only if text is significant
+    if keyword_service and batch:
+        logger.debug("Attempting keyword extraction for %d text(s)...", len(batch))
+        if not keyword_service.uses_model(active_collection["embedding_model_name"]):
+            doc_embeddings = [None] * len(texts) # Chunk vectors come from a different model
+        try:
+            with span("keybert"):
+                keywords = keyword_service.extract_batch([texts[i] for i in batch], [doc_embeddings[i] for i in batch])
+            for i, note_keywords in zip(batch, keywords):
+                extracted_keywords[i] = note_keywords
+            logger.debug("Extracted keywords: %s", keywords)
+        except Exception:
+            logger.exception("Keyword extraction failed. Keywords will be empty.")
+    elif not keyword_service:
+        logger.warning("Keyword service not initialized. Skipping keyword extraction.")
+    if keyword_service and len(batch) < len(texts):
+        logger.warning("Final text too short for keyword extraction. Skipping keyword extraction.")
+    return extracted_keywords
+
+
+def index_note_text(note_id, user_uid, original_filename, upload_date, text, page_offsets=None):
+    """
+    Chunks note text along its pages and headings and syncs the embeddings into ChromaDB
+    under deterministic chunk ids. Only chunks whose content changed are re-embedded.
+    Returns (number of chunks indexed, mean chunk embedding or None).
+    """
+    return index_notes_text(user_uid, [(note_id, original_filename, upload_date, text, page_offsets)])[0]
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
 
-def get_ground_truth(original_filename):
+def index_notes_text(user_uid, notes):
     """
-    Retrieves ground truth text and keywords for a given filename.
-    Assumes files are named: <filename>_text.txt and <filename>_keywords.txt
+    index_note_text() for several notes of a user, given as (note_id, original_filename,
+    upload_date, text, page_offsets) tuples, with one embedding call for the new chunks of all
+    of them. Returns one (chunk count, mean embedding) per note.
     """
-    base_name = os.path.splitext(original_filename)[0]
-    
-    text_path = os.path.join(GROUND_TRUTH_FOLDER, f"{base_name}_text.txt")
-    keywords_path = os.path.join(GROUND_TRUTH_FOLDER, f"{base_name}_keywords.txt")
+    chunked = []
+    with span("chunking"):
+        for note_id, original_filename, upload_date, text, page_offsets in notes:
+            ids, documents = build_chunk_documents(note_id, text, {
+                "user_id": user_uid,
+                "original_filename": original_filename,
+                "upload_date": upload_date
+            }, chunk_size=active_collection["chunk_size"], chunk_overlap=active_collection["chunk_overlap"],
+                page_offsets=page_offsets, length_function=chunk_length_function)
+            chunked.append((note_id, ids, documents))
+    results = []
+    synced = sync_notes_chunks(vectorstore, chunked)
+    chunks_changed(user_uid)
+    for (note_id, ids, _), stats in zip(chunked, synced):
+        logger.info("ChromaDB sync for note %s: %d embedded, %d reused, %d unchanged, %d deleted.",
+                    note_id, stats['embedded'], stats['reused'], stats['unchanged'], stats['deleted'])
+        results.append((len(ids), stats["mean_embedding"]))
+    return results
+
+
+def note_chunks(note):
+    """
+    The chunks of a note as indexed in ChromaDB, and their mean embedding (None if some chunk
+    is not indexed). Notes that are not indexed are chunked the same way on the fly.
+    """
+    note_id = str(note["_id"])
+    if vectorstore is not None:
+        try:
+            stored = vectorstore.get(where={"note_id": note_id}, include=["documents", "metadatas", "embeddings"])
+            if stored.get("ids"):
+                docs = [Document(page_content=text or "", metadata=metadata or {})
+                        for text, metadata in zip(stored["documents"], stored["metadatas"])]
+                embeddings = stored.get("embeddings")
+                mean_embedding = None
+                if embeddings is not None and len(embeddings) == len(docs):
+                    mean_embedding = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+                return docs, mean_embedding
+        except Exception as e:
+            logger.warning("Could not read the chunks of note %s from ChromaDB: %s", note_id, e)
+    _, docs = build_chunk_documents(
+        note_id, note_text(note), {}, chunk_size=active_collection["chunk_size"],
+        chunk_overlap=active_collection["chunk_overlap"], page_offsets=note.get("page_offsets"),
+        length_function=chunk_length_function if embedding_function is not None else count_tokens
+    )
+    return docs, None
 
-    ground_truth_text = ""
-    ground_truth_keywords = []
 
-    try:
-        with open(text_path, 'r', encoding='utf-8') as f:
-            ground_truth_text = f.read().strip()
-        
-        with open(keywords_path, 'r', encoding='utf-8') as f:
-            # --- UPDATED CODE FOR KEYWORDS ---
-            keyword_line = f.read().strip()
-            # Split by comma and strip whitespace from each keyword
-            ground_truth_keywords = [k.strip() for k in keyword_line.split(',')]
-            # --- END UPDATED CODE ---
-    except FileNotFoundError:
-        print(f"Ground truth files for {original_filename} not found.")
-    
-    return ground_truth_text, ground_truth_keywords
+def new_upload_path(filename):
+    """Returns (unique_filename, file_path) under which an upload is staged while it is processed."""
+    # A random name never collides, even for concurrent uploads of the same file
+    unique_filename = f"{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}"
+    return unique_filename, os.path.join(STAGING_FOLDER, unique_filename)
+
 
-def calculate_ocr_accuracy(ground_truth_text, extracted_text):
-    """Calculates character-level accuracy using Levenshtein distance."""
-    if not ground_truth_text:
+def store_thumbnail(file_path, content_sha256, file_data=None):
+    """Generates and stores the thumbnail of an upload. Returns its key, or None on failure."""
+    preview_key = thumbnail_key(content_sha256)
+    try:
+        if not object_storage.exists(preview_key):
+            with span("thumbnail"):
+                thumbnail = pipeline.make_thumbnail(file_path, data=file_data)
+            object_storage.put_bytes(thumbnail, preview_key, content_type="image/jpeg")
+        return preview_key
+    except Exception as e:
+        logger.warning("Thumbnail generation failed for %s: %s", content_sha256, e)
         return None
-    
-    distance = Levenshtein.distance(ground_truth_text, extracted_text)
-    accuracy = (1.0 - (distance / len(ground_truth_text))) * 100
-    
-    return accuracy
 
-def calculate_keyword_metrics(ground_truth_keywords, extracted_keywords):
-    """Calculates precision, recall, and F1-score for keywords, ignoring punctuation."""
-    if not ground_truth_keywords:
-        print("DEBUG: Ground truth keywords list is empty.")
-        return None, None, None
-    
-    # Create a translator to remove all punctuation
-    translator = str.maketrans('', '', string.punctuation)
-    
-    # Clean and convert to lowercase sets, removing punctuation
-    ground_truth_set = set(k.lower().translate(translator) for k in ground_truth_keywords)
-    extracted_set = set(k.lower().translate(translator) for k in extracted_keywords)
-    
-    # --- ADD THESE DEBUG PRINT STATEMENTS ---
-    print(f"DEBUG: Ground Truth Set: {ground_truth_set}")
-    print(f"DEBUG: Extracted Set: {extracted_set}")
-    print(f"DEBUG: Intersection: {ground_truth_set.intersection(extracted_set)}")
-    # --- END DEBUG PRINTS ---
 
-    true_positives = len(ground_truth_set.intersection(extracted_set))
-    
-    precision = true_positives / len(extracted_set) if extracted_set else 0
-    recall = true_positives / len(ground_truth_set) if ground_truth_set else 0
-    f1_score = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+def store_original(file_path, file_extension, content_sha256, file_data=None):
+    """
+    Moves a staged upload into object storage under its content hash, or writes file_data
+    there for a small upload that was only kept in memory. Returns its key.
+    """
+    key = original_key(content_sha256, file_extension)
+    with span("storage_put"):
+        if file_data is not None and not os.path.exists(file_path):
+            if object_storage.exists(key):
+                return key # Same content already stored
+            return object_storage.put_bytes(file_data, key)
+        return object_storage.put_file(file_path, key)
+
+
+def remove_staged(file_path):
+    """Removes a staged upload; small uploads kept in memory never had a file."""
+    if os.path.exists(file_path):
+        os.remove(file_path)
 
-    return precision, recall, f1_score
+
+def release_stored_upload(storage_key, preview_key=None, exclude_note_id=None):
+    """
+    Deletes a stored original and its thumbnail, each unless another note still references it.
+    The thumbnail key only depends on the content, so the same file uploaded with another
+    extension shares the thumbnail but not the original. Originals also stay while a queued,
+    dead-lettered or failed ingestion job needs them.
+    """
+    for key, field in ((storage_key, "storage_key"), (preview_key, "thumbnail_key")):
+        if not key:
+            continue
+        if db is not None:
+            query = {field: key}
+            if exclude_note_id is not None:
+                query["_id"] = {"$ne": exclude_note_id}
+            if db.notes.count_documents(query, limit=1):
+                continue # Same content uploaded as another note
+            if field == "storage_key" and ingest_jobs is not None and ingest_jobs.references_storage(key):
+                continue # Same content waiting in the queue (or to be requeued)
+        object_storage.delete(key)
 
 
 # --- API Routes ---
@@ -350,6 +771,14 @@ def get_status():
         "server_time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()) # Actual server time
     })
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Prometheus scrape endpoint: per-stage and per-endpoint latency histograms (unprotected,
+    restrict access at the proxy in production).
+    """
+    return observability.render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route("/api/protected-data", methods=["GET"])
 @verify_firebase_token # Apply the decorator to protect this route
 def protected_data():
@@ -369,6 +798,7 @@ def protected_data():
 
 @app.route("/api/upload-note", methods=["POST"])
 @verify_firebase_token # Protect this route: only authenticated users can upload
+@admission.limit("upload")
 def upload_note():
     if 'noteImage' not in request.files:
         return jsonify({"message": "No file part in the request"}), 400
@@ -383,17 +813,10 @@ def upload_note():
 
     filename = secure_filename(file.filename)
     file_extension = os.path.splitext(filename)[1].lower()
-    # Create a unique filename to prevent overwrites and provide traceability
-    unique_filename = f"{os.path.splitext(filename)[0]}_{int(time.time())}{file_extension}"
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+    unique_filename, file_path = new_upload_path(filename)
 
-    # Save the original file temporarily for processing (or if PDF)
-    try:
-        file.save(file_path)
-        print(f"Original file '{unique_filename}' saved to {file_path}")
-    except Exception as e:
-        print(f"Error saving original file: {e}")
-        return jsonify({"message": f"Failed to save uploaded file: {e}"}), 500
+    if file_extension not in pipeline.SUPPORTED_EXTENSIONS:
+        return jsonify({"message": f"Unsupported file type: {file_extension}. Only JPG, PNG, and PDF are supported."}), 400
 
 
     # extracted_text = ""
@@ -506,72 +929,176 @@ def upload_note():
     #         full_text_content.append(f"--- Page {i+1} (OCR Failed) ---\n")
     #         # Continue processing other pages even if one fails
 
+    try:
+        with span("upload_receive"):
+            received = receive_stream(file.stream, file_path, file_extension, max_bytes=MAX_UPLOAD_BYTES,
+                                      in_memory_limit=UPLOAD_IN_MEMORY_LIMIT)
+        logger.debug("Original file '%s' received %s (%d bytes, sha256 %s)", unique_filename,
+                     "in memory" if received["data"] is not None else f"at {file_path}", received["size"], received["sha256"])
+    except UploadError as e:
+        return jsonify({"message": str(e)}), e.status
+    except Exception as e:
+        logger.exception("Could not save original file")
+        return jsonify({"message": f"Failed to save uploaded file: {e}"}), 500
+
+    body, status = process_upload(request.current_user.get('uid'), filename, file_path, received)
+    return jsonify(body), status
+
+
+def process_upload(user_uid, filename, file_path, received):
+    """
+    Processes a received upload inline, or with INGEST_MODE=queue stores it and queues an
+    ingestion job for worker.py (202 with the job id). Returns (response_body, http_status).
+    """
+    if not QUEUE_UPLOADS:
+        return ingest_note(user_uid, filename, file_path, file_data=received["data"],
+                           content_sha256=received["sha256"], file_size=received["size"])
+    storage_key = None
+    try:
+        storage_key = store_original(file_path, os.path.splitext(filename)[1].lower(), received["sha256"], received["data"])
+        job_id = ingest_jobs.enqueue("ingest_note", user_uid, {
+            "filename": filename,
+            "storage_key": storage_key,
+            "content_sha256": received["sha256"],
+            "file_size": received["size"]
+        }, trace_id=current_trace_id())
+    except Exception as e:
+        logger.exception("Could not queue upload '%s'", filename)
+        remove_staged(file_path)
+        if storage_key:
+            release_stored_upload(storage_key)
+        return {"message": f"Failed to queue uploaded file for processing: {e}"}, 500
+    logger.info("Upload '%s' queued as job %s.", filename, job_id)
+    return {
+        "message": f"File '{filename}' uploaded and queued for processing.",
+        "job_id": str(job_id),
+        "status_url": f"/api/jobs/{job_id}"
+    }, 202
+
+
+def ingest_note(user_uid, filename, file_path, file_data=None, content_sha256=None, file_size=None,
+                storage_key=None, note_id=None):
+    """
+    Runs an upload through text extraction, indexing, keyword extraction and storage.
+    file_data, when given, holds the file's bytes so small uploads are processed in memory
+    without reading file_path back. Once the text is extracted, the staged file moves to object
+    storage under its content hash; the staged file is removed when processing fails.
+
+    Queued ingestion (worker.py) passes the storage_key of an original that is already stored;
+    it is then never moved or deleted here, so a failed job can be retried. note_id makes the
+    note's id deterministic for retries. Returns (response_body, http_status).
+    """
+    return ingest_notes(user_uid, [{
+        "filename": filename,
+        "file_path": file_path,
+        "file_data": file_data,
+        "content_sha256": content_sha256,
+        "file_size": file_size,
+        "storage_key": storage_key,
+        "note_id": note_id
+    }])[0]
+
+
+def extract_upload(upload):
+    """
+    Text extraction stage of ingest_notes() for one upload: vision transcription, thumbnail,
+    and moving an owned staged file to object storage. Adds extracted_text, final_text,
+    page_offsets, thumbnail_key and storage_key to the upload dict and returns None, or returns
+    the (response_body, http_status) of a failed upload.
+    """
+    filename, file_path, file_data = upload["filename"], upload["file_path"], upload.get("file_data")
+    file_extension = os.path.splitext(filename)[1].lower()
+    owns_file = upload["owns_file"]
+    storage_key = upload.get("storage_key")
+
     # --- NEW: Combination 2 (LLM Only) ---
     extracted_text = ""
     base64_images = []
     
-    # Handle PDF to Image Conversion and Base64 Encoding
-    if file_extension == '.pdf':
-        print("PDF detected, converting to images for LLM vision processing.")
-        try:
-            poppler_path = os.getenv("POPPLER_PATH")
-            if poppler_path and not os.path.exists(poppler_path):
-                poppler_path = None
-            
-            pdf_pages = convert_from_path(file_path, dpi=300, poppler_path=poppler_path)
-            
-            # Save each page to a temporary file, encode it, and then delete the file
-            for i, page_img in enumerate(pdf_pages):
-                temp_img_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_page_{int(time.time())}_{i}.jpg")
-                page_img.save(temp_img_path, 'JPEG')
-                base64_images.append(encode_image(temp_img_path))
-                os.remove(temp_img_path)
-            print(f"Converted {len(base64_images)} PDF page(s) to Base64 for LLM.")
-        except Exception as e:
-            os.remove(file_path)
-            print(f"Error converting PDF to images: {e}")
-            return jsonify({"message": f"Failed to convert PDF to images for LLM: {e}"}), 500
-    
-    # Handle direct Image Files (JPG, PNG)
-    elif file_extension in ['.jpg', '.jpeg', '.png']:
-        print(f"Image file detected, encoding for LLM vision processing.")
-        base64_images.append(encode_image(file_path))
-    else:
-        os.remove(file_path)
-        return jsonify({"message": f"Unsupported file type: {file_extension}. Only JPG, PNG, and PDF are supported."}), 400
+    # Convert PDF pages / image files to Base64 for LLM vision processing
+    if file_extension not in pipeline.SUPPORTED_EXTENSIONS:
+        if owns_file:
+            remove_staged(file_path)
+        return {"message": f"Unsupported file type: {file_extension}. Only JPG, PNG, and PDF are supported."}, 400
+    logger.debug("%s file detected, encoding for LLM vision processing.", file_extension)
+    try:
+        if VISION_PREPROCESS:
+            base64_images = pipeline.file_to_vision_pages(file_path, VISION_PREPROCESS, data=file_data)
+        else:
+            base64_images = pipeline.file_to_base64_images(file_path, data=file_data)
+        logger.debug("Encoded %d page(s) to Base64 for LLM (%d bytes).", len(base64_images),
+                     pipeline.payload_bytes(base64_images))
+    except Exception as e:
+        if owns_file:
+            remove_staged(file_path)
+        logger.exception("Could not convert file to images")
+        return {"message": f"Failed to convert file to images for LLM: {e}"}, 500
 
     # Process each Base64 encoded image with LLM Vision API
     full_text_content = []
+    page_offsets = None
     if openai_client and base64_images:
-        print("Attempting LLM-based text extraction...")
+        logger.debug("Attempting LLM-based text extraction...")
+        # Typed PDF pages and scanned/handwritten pages can go to different models
+        try:
+            text_layers = pipeline.pdf_text_layer_pages(file_path, data=file_data) or []
+        except Exception as e:
+            logger.warning("Could not read the PDF text layer: %s", e)
+            text_layers = []
+        tiers = ["typed" if i < len(text_layers) and text_layers[i] else "handwritten" for i in range(len(base64_images))]
         try:
-            for b64_image in base64_images:
-                llm_response = openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Extract all text from this image as accurately as possible. Pay close attention to handwritten content and formatting. Do not add any new information."},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}}
-                        ]
-                    }],
-                    temperature=0.1,
-                    max_tokens=4000
+            page_routes = model_router.route_many("vision", tiers, upload.get("user_uid"))
+        except BudgetExceeded as e:
+            if owns_file:
+                remove_staged(file_path)
+            return {"message": str(e), "retry_after": int(e.retry_after) + 1}, 429
+        try:
+            full_text_content = [None] * len(base64_images)
+            for route in dict.fromkeys(page_routes):
+                indexes = [i for i, page_route in enumerate(page_routes) if page_route == route]
+                texts = pipeline.extract_text_with_vision(
+                    model_router.client(openai_client, route, upload.get("user_uid")),
+                    [base64_images[i] for i in indexes], model=route.model
                 )
-                full_text_content.append(llm_response.choices[0].message.content.strip())
-            
-            extracted_text = "\n\n".join(full_text_content)
+                for i, text in zip(indexes, texts):
+                    full_text_content[i] = text
+            extracted_text = PAGE_SEPARATOR.join(full_text_content)
             final_text_for_db = extracted_text
-            print("LLM-based text extraction successful.")
+            page_offsets = page_offsets_for(full_text_content) # Keeps page boundaries for chunking
+            logger.info("LLM-based text extraction successful.")
+        except UpstreamUnavailable as e:
+            # Saving the note without its text would be worse than failing: the upload (or its job) is retried later
+            if owns_file:
+                remove_staged(file_path)
+            return {"message": f"Text extraction is temporarily unavailable: {e}", "retry_after": int(e.retry_after) + 1}, 503
         except Exception as llm_error:
-            print(f"Error during LLM text extraction: {llm_error}. Skipping LLM process.")
+            if upstreams.openai_transient(llm_error):
+                # Retries used up while the breaker is still closed: the same outcome as an open breaker
+                logger.warning("LLM text extraction failed after retries: %s", llm_error)
+                if owns_file:
+                    remove_staged(file_path)
+                retry_after = max(upstreams.retry_after_seconds(llm_error), 1.0)
+                return {"message": f"Text extraction is temporarily unavailable: {llm_error}",
+                        "retry_after": int(retry_after) + 1}, 503
+            logger.exception("LLM text extraction failed. Skipping LLM process.")
             extracted_text = ""
             final_text_for_db = ""
+            page_offsets = None
     else:
-        print("OpenAI client not initialized or no valid images to process. Skipping LLM text extraction.")
+        logger.warning("OpenAI client not initialized or no valid images to process. Skipping LLM text extraction.")
         extracted_text = ""
         final_text_for_db = ""
     # --- END Combination 2 ---     
+
+    # --- Object Storage: original + thumbnail (content-addressed) ---
+    preview_key = store_thumbnail(file_path, upload["content_sha256"], file_data)
+    if owns_file:
+        try:
+            storage_key = store_original(file_path, file_extension, upload["content_sha256"], file_data)
+        except Exception as e:
+            logger.exception("Could not store uploaded file")
+            remove_staged(file_path)
+            return {"message": f"Failed to store uploaded file: {e}"}, 500
     
 
     # extracted_text = "\n\n".join(full_text_content) # Combine text from all pages
@@ -609,180 +1136,607 @@ def upload_note():
     # else:
     #     print("Extracted text too short for LLM post-processing. Skipping.")
 
+    upload.update(extracted_text=extracted_text, final_text=final_text_for_db, page_offsets=page_offsets,
+                  thumbnail_key=preview_key, storage_key=storage_key)
+    return None
 
-    # --- Keyword Extraction with KeyBERT ---
-    extracted_keywords = [] # Initialize as empty list
-    if keybert_model and len(final_text_for_db.strip()) > 50: # Only if model loaded & text is significant
-        print("Attempting keyword extraction...")
-        try:
-            # docs: The text to extract keywords from
-            # keyphrase_ngram_range: Extract single words (1,1) or up to 2-word phrases (1,2)
-            # top_n: Number of keywords to extract
-            # diversity: Higher diversity means less similar keywords are chosen (0 to 1)
-            keywords_with_scores = keybert_model.extract_keywords(
-                docs=final_text_for_db,
-                keyphrase_ngram_range=(1, 1),
-                # We are NOT using stop_words='english' here.
-                # This is because the multilingual model's embeddings are robust,
-                # and the LLM cleaning handles basic words.
-                # If you find too many common words, you can re-add `stop_words='english'`
-                # or custom English stop words.
-                top_n= 7, # Extract top 10 keywords/phrases
-                diversity=0.7 # Encourage a good variety of keywords
-            )
-            # Extract just the keyword string, discarding the score for storage
-            extracted_keywords = [keyword for keyword, _ in keywords_with_scores]
-            print(f"Extracted keywords: {extracted_keywords}")
-        except Exception as kw_error:
-            print(f"Error during keyword extraction: {kw_error}. Keywords will be empty.")
-    elif not keybert_model:
-        print("KeyBERT model not initialized. Skipping keyword extraction.")
+
+def ingest_notes(user_uid, uploads):
+    """
+    Runs uploads of a user through ingest_note()'s stages, each stage as one batch over all
+    uploads: vision transcription runs INGEST_EXTRACT_WORKERS files at a time, the new chunks of
+    all notes are embedded in one call, keywords are extracted in one KeyBERT batch, and the
+    notes are inserted with one insert_many.
+
+    Each upload is a dict with filename and file_path, and optionally file_data, content_sha256,
+    file_size, storage_key and note_id (see ingest_note()). Returns one (response_body,
+    http_status) per upload, in order.
+    """
+    results = [None] * len(uploads)
+    for upload in uploads:
+        upload["owns_file"] = upload.get("storage_key") is None
+        upload["user_uid"] = user_uid
+        if upload.get("content_sha256") is None:
+            upload["content_sha256"] = hash_file(upload["file_path"])
+
+    # --- Text Extraction (LLM vision), concurrently across files ---
+    if len(uploads) > 1 and INGEST_EXTRACT_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=min(INGEST_EXTRACT_WORKERS, len(uploads))) as executor:
+            # Each file runs in a copy of the request context, so its logs keep the trace id
+            futures = [executor.submit(contextvars.copy_context().run, extract_upload, upload) for upload in uploads]
+            failures = [future.result() for future in futures]
     else:
-        print("Final text too short for keyword extraction. Skipping keyword extraction.")
-
-
-    # Initialize note_document structure (partially for now)
-    temp_note_id = ObjectId() # Generate an ID upfront for use in chunks
-    note_document = {
-        "_id": temp_note_id, # Assign the generated ID
-        "user_id": request.current_user.get('uid'),
-        "original_filename": filename,
-        "stored_file_path": file_path,
-        "extracted_text": final_text_for_db,
-        "raw_ocr_text": extracted_text,
-        "upload_date": time.time(),
+        failures = [extract_upload(upload) for upload in uploads]
+    extracted = []
+    for i, failure in enumerate(failures):
+        if failure is not None:
+            results[i] = failure
+        else:
+            extracted.append(i)
+
+    # Generate the ids upfront for use in chunks
+    for i in extracted:
+        uploads[i]["note_id"] = ObjectId(uploads[i]["note_id"]) if uploads[i].get("note_id") else ObjectId()
+
+    # Accuracy evaluation against Ground_Truth runs offline (evaluate.py), not on production uploads.
+
+    # --- RAG: Text Chunking and Vector Storage (one embedding call for all notes) ---
+    upload_date = time.time()
+    rag_chunks_added = {i: 0 for i in extracted}
+    note_embeddings = {i: None for i in extracted}
+    indexable = [i for i in extracted if len(uploads[i]["final_text"].strip()) > 100] # Only if text is significant
+    if vectorstore and indexable:
+        logger.debug("Attempting to chunk text and store embeddings in ChromaDB for %d note(s)...", len(indexable))
+        try:
+            indexed = index_notes_text(user_uid, [
+                (uploads[i]["note_id"], uploads[i]["filename"], upload_date, uploads[i]["final_text"],
+                 uploads[i]["page_offsets"])
+                for i in indexable
+            ])
+            for i, (chunk_count, note_embedding) in zip(indexable, indexed):
+                rag_chunks_added[i], note_embeddings[i] = chunk_count, note_embedding
+                if not chunk_count:
+                    logger.warning("No chunks generated for RAG due to text content.")
+        except Exception:
+            logger.exception("RAG text chunking or vector storage failed. RAG functionality might be limited.")
+    elif not vectorstore: # Only print this warning if it's the specific initialization failure
+        logger.warning("Vectorstore not available. Skipping RAG text chunking and storage.") # Adjusted message
+    if vectorstore and len(indexable) < len(extracted): # Text too short
+        logger.warning("Final text too short for RAG chunking and storage. Skipping.")
+
+    def discard_chunks(indexes):
+        # Chunks are written before the note documents: a note that is not saved must not stay searchable
+        for i in indexes:
+            if vectorstore and i in indexable:
+                try:
+                    delete_note_chunks(vectorstore, str(uploads[i]["note_id"]))
+                    chunks_changed(user_uid)
+                except Exception:
+                    logger.exception("Could not remove the chunks of unsaved note %s", uploads[i]["note_id"])
+
+    # --- Keyword Extraction (one batch; reuses the chunk embeddings as document embeddings) ---
+    try:
+        extracted_keywords = dict(zip(extracted, extract_keywords_batch(
+            [uploads[i]["final_text"] for i in extracted], [note_embeddings[i] for i in extracted]
+        )))
+    except Exception:
+        discard_chunks(extracted)
+        raise
+
+    def text_preview(text):
+        return text[:500] + "..." if len(text) > 500 else text
+
+    def release(upload):
+        if upload["owns_file"]:
+            release_stored_upload(upload["storage_key"], upload["thumbnail_key"])
+
+    # --- MongoDB Storage (Final Save) ---
+    if db is None: # MongoDB not connected
+        logger.warning("MongoDB not connected. Skipping database storage.")
+        for i in extracted:
+            release(uploads[i])
+            results[i] = {
+                "message": f"File '{uploads[i]['filename']}' uploaded and processed, but database connection not available.",
+                "filename": os.path.basename(uploads[i]["file_path"]),
+                "extracted_text_preview": text_preview(uploads[i]["final_text"]),
+                "user_uid": user_uid,
+                "keywords": extracted_keywords[i],
+                "rag_chunks_added": rag_chunks_added[i]
+            }, 200
+        return results
+
+    note_documents = [{
+        "_id": uploads[i]["note_id"],
+        "user_id": user_uid,
+        "original_filename": uploads[i]["filename"],
+        "storage_key": uploads[i]["storage_key"],
+        "thumbnail_key": uploads[i]["thumbnail_key"],
+        **note_text_fields(uploads[i]["final_text"], uploads[i]["extracted_text"]),
+        "upload_date": upload_date,
         "tags": [],
-        "topics": extracted_keywords, # Correctly use extracted_keywords
-        "resource_links": []
+        "topics": extracted_keywords[i],
+        "resource_links": [],
+        "page_offsets": uploads[i]["page_offsets"],
+        "chunk_count": rag_chunks_added[i],
+        "content_sha256": uploads[i]["content_sha256"],
+        "file_size": uploads[i].get("file_size")
+    } for i in extracted]
+    insert_errors = {}
+    duplicates = set() # Positions whose note id is already saved (a retried job): its body and chunks are that note's
+    if note_documents and note_bodies is not None:
+        # Bodies first: a note document never exists without its text
+        try:
+            with span("note_bodies"):
+                note_bodies.put_many([(uploads[i]["note_id"], user_uid, uploads[i]["final_text"], uploads[i]["extracted_text"])
+                                      for i in extracted])
+        except Exception as body_error:
+            insert_errors = {position: str(body_error) for position in range(len(note_documents))}
+    if note_documents and not insert_errors:
+        try:
+            with span("mongo_insert"):
+                db.notes.insert_many(note_documents, ordered=False)
+        except BulkWriteError as bulk_error:
+            for write_error in bulk_error.details.get("writeErrors", []):
+                insert_errors[write_error["index"]] = write_error.get("errmsg", "write error")
+                if write_error.get("code") == 11000:
+                    duplicates.add(write_error["index"])
+        except Exception as db_error:
+            insert_errors = {position: str(db_error) for position in range(len(note_documents))}
+    unsaved = [position for position in insert_errors if position not in duplicates]
+    if unsaved and note_bodies is not None:
+        try:
+            note_bodies.delete_many([note_documents[position]["_id"] for position in unsaved])
+        except Exception as cleanup_error:
+            logger.warning("Could not remove the bodies of unsaved notes: %s", cleanup_error)
+    discard_chunks([extracted[position] for position in unsaved])
+    for position, i in enumerate(extracted):
+        upload = uploads[i]
+        if position in insert_errors:
+            logger.error("Could not save note to MongoDB: %s", insert_errors[position])
+            release(upload)
+            results[i] = {"message": f"File uploaded and processed, but failed to save to database: {insert_errors[position]}"}, 500
+            continue
+        logger.info("Note saved to MongoDB with ID: %s", upload['note_id'])
+        results[i] = {
+            "message": f"File '{upload['filename']}' uploaded, processed, and saved to database!",
+            "note_id": str(upload["note_id"]),
+            "extracted_text_preview": text_preview(upload["final_text"]),
+            "user_uid": user_uid,
+            "keywords": extracted_keywords[i],
+            "rag_chunks_added": rag_chunks_added[i]
+        }, 200
+
+    # --- Related Notes and Topics (background; only notes indexed in ChromaDB have a vector) ---
+    embedded = [i for position, i in enumerate(extracted) if position not in insert_errors and note_embeddings[i] is not None]
+    if embedded:
+        embedding_model_name = active_collection["embedding_model_name"]
+        if related_updates is not None:
+            related_updates.submit("add", user_uid, embedding_model_name, [
+                (uploads[i]["note_id"], uploads[i]["filename"], note_embeddings[i]) for i in embedded
+            ])
+        if topic_updates is not None:
+            topic_updates.submit("assign", user_uid, embedding_model_name, [
+                (uploads[i]["note_id"], note_embeddings[i], extracted_keywords[i]) for i in embedded
+            ])
+    return results
+
+
+# --- Batch Uploads ---
+@app.before_request
+def allow_large_batch_uploads():
+    # A batch carries many files in one body; raise the request size limit before the form is parsed
+    if request.endpoint == "upload_notes_batch":
+        request.max_content_length = BATCH_UPLOAD_MAX_BYTES
+
+
+def batch_upload_cost():
+    """Rate limit tokens for a batch: one per file, capped at the burst so a full batch can pass."""
+    return min(max(1, len(request.files.getlist('noteImages'))), admission.policies["upload"].burst)
+
+
+@app.route("/api/upload-notes", methods=["POST"])
+@verify_firebase_token # Protect this route: only authenticated users can upload
+@admission.limit("upload", cost=batch_upload_cost)
+def upload_notes_batch():
+    """
+    Uploads many files in one request (form field 'noteImages', repeated). Each file is
+    validated and hashed while streamed; files with the same content as an earlier file of the
+    batch or an existing note of the user are not processed again. The rest are processed as
+    one batch (see ingest_notes()), or queued as one job each with INGEST_MODE=queue.
+    Returns a result per file, in request order.
+    """
+    files = [file for file in request.files.getlist('noteImages') if file and file.filename]
+    if not files:
+        return jsonify({"message": "No files in the request (expected 'noteImages')."}), 400
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        return jsonify({"message": f"Too many files: at most {BATCH_UPLOAD_MAX_FILES} per batch."}), 400
+    user_uid = request.current_user.get('uid')
+
+    results = [None] * len(files)
+    received_uploads = {} # sha256 -> index of the first file with that content
+    for index, file in enumerate(files):
+        filename = secure_filename(file.filename)
+        file_extension = os.path.splitext(filename)[1].lower()
+        results[index] = {"filename": filename}
+        if file_extension not in pipeline.SUPPORTED_EXTENSIONS:
+            results[index].update(status="failed", message=f"Unsupported file type: {file_extension}. Only JPG, PNG, and PDF are supported.")
+            continue
+        _, file_path = new_upload_path(filename)
+        try:
+            with span("upload_receive"):
+                received = receive_stream(file.stream, file_path, file_extension, max_bytes=MAX_UPLOAD_BYTES,
+                                          in_memory_limit=UPLOAD_IN_MEMORY_LIMIT)
+        except UploadError as e:
+            results[index].update(status="failed", message=str(e))
+            continue
+        except Exception as e:
+            logger.exception("Could not save original file")
+            results[index].update(status="failed", message=f"Failed to save uploaded file: {e}")
+            continue
+        if received["sha256"] in received_uploads:
+            remove_staged(file_path)
+            results[index].update(status="duplicate", duplicate_of=files[received_uploads[received["sha256"]]].filename)
+            continue
+        received_uploads[received["sha256"]] = index
+        results[index]["received"] = dict(received, filename=filename)
+
+    # Files the user already has as notes are not processed again
+    if db is not None and received_uploads:
+        existing = db.notes.find(
+            {"user_id": user_uid, "content_sha256": {"$in": list(received_uploads)}},
+            {"_id": 1, "content_sha256": 1}
+        )
+        for note in existing:
+            index = received_uploads.pop(note["content_sha256"], None)
+            if index is not None:
+                remove_staged(results[index].pop("received")["path"])
+                results[index].update(status="duplicate", note_id=str(note["_id"]))
+
+    pending = sorted(received_uploads.values())
+    if QUEUE_UPLOADS:
+        for index in pending:
+            received = results[index].pop("received")
+            body, status = process_upload(user_uid, received["filename"], received["path"], received)
+            results[index].update(body, status="queued" if status == 202 else "failed")
+    elif pending:
+        uploads = []
+        for index in pending:
+            received = results[index].pop("received")
+            uploads.append({
+                "filename": received["filename"],
+                "file_path": received["path"],
+                "file_data": received["data"],
+                "content_sha256": received["sha256"],
+                "file_size": received["size"]
+            })
+        for index, (body, status) in zip(pending, ingest_notes(user_uid, uploads)):
+            results[index].update(body, status="processed" if status < 400 else "failed")
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info("Batch upload of %s file(s) by user %s: %s.", len(files), user_uid, counts)
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    return jsonify({"message": f"Batch of {len(files)} file(s): {summary}.", "results": results}), 200
+
+
+# --- Resumable Uploads (tus-like) ---
+# POST   /api/uploads                Upload-Length + Upload-Metadata headers (or JSON) -> 201 + Location
+# HEAD   /api/uploads/<id>           -> Upload-Offset / Upload-Length of the partial upload
+# PATCH  /api/uploads/<id>           Upload-Offset header + application/offset+octet-stream body -> 204
+# POST   /api/uploads/<id>/complete  -> processes the file, same response as /api/upload-note
+# DELETE /api/uploads/<id>           -> 204, discards the partial upload
+TUS_VERSION = "1.0.0"
+
+
+def _tus_metadata(header):
+    """Parses a tus Upload-Metadata header ("key base64value,key2 base64value")."""
+    metadata = {}
+    for pair in (header or "").split(","):
+        parts = pair.strip().split(" ", 1)
+        if not parts[0]:
+            continue
+        try:
+            metadata[parts[0]] = base64.b64decode(parts[1]).decode('utf-8') if len(parts) > 1 else ""
+        except (ValueError, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for '{parts[0]}'.", 400)
+    return metadata
+
+
+def _upload_length(value):
+    """The declared length of a resumable upload (header string or JSON number), or None if it is not an integer."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _upload_headers(session):
+    return {
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["length"]),
+        "Tus-Resumable": TUS_VERSION,
+        "Cache-Control": "no-store"
     }
 
-    # --- NEW: Evaluation Metrics Calculation and Logging ---
-    print("\n--- Starting Automated Performance Evaluation ---")
-    ground_truth_text, ground_truth_keywords = get_ground_truth(filename)
-    results_filename = f"{os.path.splitext(filename)[0]}_results.txt"
-    results_path = os.path.join(RESULTS_FOLDER, results_filename)
-    
-    Experimentation_number = "2" # Manually change this for each test (e.g., "1", "2", "3", "4")
-    
-    if ground_truth_text:
-        # Calculate OCR Accuracy
-        accuracy = calculate_ocr_accuracy(ground_truth_text, final_text_for_db)
-        print(f"OCR Accuracy: {accuracy:.2f}%")
-        
-        # Calculate Keyword Metrics
-        if ground_truth_keywords:
-            precision, recall, f1score = calculate_keyword_metrics(ground_truth_keywords, extracted_keywords)
-            print(f"Keyword Precision: {precision:.2f}")
-            print(f"Keyword Recall: {recall:.2f}")
-            print(f"Keyword F1-Score: {f1score:.2f}")
+
+@app.route("/api/uploads", methods=["POST"])
+@verify_firebase_token
+def create_upload():
+    try:
+        if request.headers.get("Upload-Length"):
+            length = _upload_length(request.headers["Upload-Length"])
+            filename = _tus_metadata(request.headers.get("Upload-Metadata")).get("filename", "")
         else:
-            print("Ground truth keywords not available. Skipping keyword evaluation.")
-    else:
-        print("Ground truth text not available. Skipping OCR and keyword evaluation.")
-
-    with open(results_path, 'w') as f:
-        f.write(f"Combination: {Experimentation_number}\n")
-        f.write(f"Filename: {filename}\n")
-        f.write(f"OCR Accuracy: {accuracy:.2f}%\n")
-        f.write(f"Keyword Precision: {precision:.2f}\n")
-        f.write(f"Keyword Recall: {recall:.2f}\n")
-        f.write(f"Keyword F1-Score: {f1score:.2f}\n")
-    
-    print(f"Results saved to: {results_path}")
+            data = request.get_json(silent=True) or {}
+            length = _upload_length(data.get("length"))
+            filename = data.get("filename") or ""
+        if length is None:
+            return jsonify({"message": "The upload length must be an integer number of bytes."}), 400
+        filename = secure_filename(filename) if isinstance(filename, str) else ""
+        if not filename:
+            return jsonify({"message": "A filename is required."}), 400
+        resumable_uploads.expire_stale()
+        session = resumable_uploads.create(request.current_user.get('uid'), filename, length)
+    except UploadError as e:
+        return jsonify({"message": str(e)}), e.status
+    logger.info("Resumable upload %s started: '%s', %s bytes.", session['upload_id'], filename, length)
+    headers = _upload_headers(session)
+    headers["Location"] = f"/api/uploads/{session['upload_id']}"
+    return jsonify({"upload_id": session["upload_id"], "offset": 0, "length": length}), 201, headers
+
+
+@app.route("/api/uploads/<string:upload_id>", methods=["HEAD"])
+@verify_firebase_token
+def get_upload_offset(upload_id):
+    try:
+        session = resumable_uploads.get(upload_id, request.current_user.get('uid'))
+    except UploadError as e:
+        return "", e.status, {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store"}
+    return "", 200, _upload_headers(session)
+
+
+@app.route("/api/uploads/<string:upload_id>", methods=["PATCH"])
+@verify_firebase_token
+def append_upload(upload_id):
+    if request.mimetype != "application/offset+octet-stream":
+        return jsonify({"message": "Content-Type must be application/offset+octet-stream."}), 415
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return jsonify({"message": "Upload-Offset header is required."}), 400
+    user_uid = request.current_user.get('uid')
+    try:
+        with span("upload_receive"):
+            new_offset = resumable_uploads.append(upload_id, user_uid, offset, request.stream)
+    except UploadError as e:
+        return jsonify({"message": str(e)}), e.status
+    return "", 204, {"Upload-Offset": str(new_offset), "Tus-Resumable": TUS_VERSION}
+
 
-    print("--- Performance Evaluation Complete ---\n")
+@app.route("/api/uploads/<string:upload_id>/complete", methods=["POST"])
+@verify_firebase_token
+@admission.limit("upload")
+def complete_upload(upload_id):
+    user_uid = request.current_user.get('uid')
+    try:
+        session = resumable_uploads.get(upload_id, user_uid)
+        _, file_path = new_upload_path(session["filename"])
+        received = resumable_uploads.complete(upload_id, user_uid, file_path, in_memory_limit=UPLOAD_IN_MEMORY_LIMIT)
+    except UploadError as e:
+        return jsonify({"message": str(e)}), e.status
+    logger.info("Resumable upload %s completed: %s bytes, sha256 %s.", upload_id, received['size'], received['sha256'])
+    body, status = process_upload(user_uid, received["filename"], file_path, received)
+    return jsonify(body), status
 
 
+@app.route("/api/uploads/<string:upload_id>", methods=["DELETE"])
+@verify_firebase_token
+def abort_upload(upload_id):
+    try:
+        resumable_uploads.abort(upload_id, request.current_user.get('uid'))
+    except UploadError as e:
+        return jsonify({"message": str(e)}), e.status
+    return "", 204, {"Tus-Resumable": TUS_VERSION}
 
-    # --- RAG: Text Chunking and Vector Storage ---
-    chunks_to_add = [] # Initialize here to ensure it always exists for the final return
-    if vectorstore and len(final_text_for_db.strip()) > 100: # Only if vectorstore loaded and text is significant
-        print("Attempting to chunk text and store embeddings in ChromaDB...")
-        try:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len
-            )
 
-            chunks = text_splitter.split_text(final_text_for_db)
-
-            for i, chunk_content in enumerate(chunks):
-                chunk_metadata = {
-                    "user_id": request.current_user.get('uid'),
-                    "note_id": str(temp_note_id), # Use the generated note ID
-                    "original_filename": filename,
-                    "upload_date": time.time(),
-                    "chunk_index": i,
-                    "chunk_id": f"{str(temp_note_id)}_chunk_{i}"
-                }
-                chunks_to_add.append(Document(page_content=chunk_content, metadata=chunk_metadata))
-
-            if chunks_to_add:
-                vectorstore.add_documents(chunks_to_add)
-                # vectorstore.persist() # Deprecated: Chroma 0.4.x+ auto-persists. Remove this line.
-                print(f"Added {len(chunks_to_add)} chunks to ChromaDB for note {unique_filename}.")
+@app.route("/api/jobs/<string:job_id>", methods=["GET"])
+@verify_firebase_token
+def get_job(job_id):
+    if ingest_jobs is None:
+        return jsonify({"message": "Database not connected. Cannot retrieve job."}), 500
+    try:
+        job = ingest_jobs.get(job_id, user_id=request.current_user.get('uid'))
+    except Exception:
+        job = None # Malformed id
+    if not job:
+        return jsonify({"message": "Job not found or you don't have access."}), 404
+    return jsonify(job_status(job)), 200
+
+
+@app.route("/api/notes/<string:note_id>", methods=["PUT"])
+@verify_firebase_token # Only the owner can edit a note
+def update_note(note_id):
+    if db is None:
+        return jsonify({"message": "Database not connected. Cannot update note."}), 500
+
+    data = request.get_json() or {}
+    new_text = data.get('extracted_text')
+    new_pages = data.get('pages') # Optional: the edited text page by page, keeps page numbers for RAG
+    new_filename = data.get('original_filename')
+    if new_pages is not None:
+        if not isinstance(new_pages, list) or not all(isinstance(page, str) for page in new_pages):
+            return jsonify({"message": "'pages' must be a list of strings."}), 400
+        new_text = PAGE_SEPARATOR.join(new_pages)
+    if new_text is None and new_filename is None:
+        return jsonify({"message": "Provide 'extracted_text' (or 'pages') and/or 'original_filename' to update."}), 400
+
+    user_uid = request.current_user.get('uid')
+    try:
+        note = db.notes.find_one({"_id": ObjectId(note_id), "user_id": user_uid})
+        if not note:
+            return jsonify({"message": "Note not found or you don't have access."}), 404
+
+        updates = {}
+        text = note_text(note)
+        page_offsets = note.get('page_offsets')
+        text_changed = new_text is not None and new_text != text
+        if text_changed:
+            text = new_text
+            # Page boundaries are only known when the client sends the text page by page
+            page_offsets = page_offsets_for(new_pages) if new_pages is not None else None
+            updates.update(note_text_fields(text, note_text(note, raw=True)))
+            updates["page_offsets"] = page_offsets
+        if new_filename:
+            updates["original_filename"] = new_filename
+        if not updates:
+            return jsonify({"message": "Note unchanged.", "note_id": note_id}), 200
+
+        # ChromaDB is synced first: if it fails the Mongo document still describes what is indexed,
+        # and repeating the request converges both stores.
+        chunk_count = note.get('chunk_count', 0)
+        note_embedding = None
+        if vectorstore:
+            if len(text.strip()) > 100:
+                chunk_count, note_embedding = index_note_text(
+                    note_id, user_uid, updates.get("original_filename", note.get('original_filename')),
+                    note.get('upload_date'), text, page_offsets
+                )
             else:
-                print("No chunks generated for RAG due to text content.")
+                delete_note_chunks(vectorstore, note_id)
+                chunks_changed(user_uid)
+                chunk_count = 0
+            updates["chunk_count"] = chunk_count
+        else:
+            logger.warning("Vectorstore not available. Note text updated without re-indexing.")
+        update = {"$set": updates}
+        if text_changed:
+            updates["topics"] = extract_keywords(text, note_embedding)
+            if note_bodies is not None:
+                # The OCR text stays what it was; notes stored before the body store move into it
+                note_bodies.put(note["_id"], user_uid, text, note_text(note, raw=True))
+                if "extracted_text" in note:
+                    update["$unset"] = {"extracted_text": "", "raw_ocr_text": ""}
+
+        leaves_topic = (topic_updates is not None and text_changed and note_embedding is None and vectorstore
+                        and not chunk_count and note.get("topic_id") is not None)
+        if leaves_topic:
+            # Unset now, not by the background update: a delete meanwhile must not remove the note from its topic again
+            update.setdefault("$unset", {})["topic_id"] = ""
+
+        updates["updated_date"] = time.time()
+        db.notes.update_one({"_id": ObjectId(note_id), "user_id": user_uid}, update)
+        logger.info("Note %s updated for user %s: %s", note_id, user_uid, sorted(updates.keys()))
+
+        if related_updates is not None:
+            embedding_model_name = active_collection["embedding_model_name"]
+            if note_embedding is not None:
+                related_updates.submit("add", user_uid, embedding_model_name, [
+                    (note["_id"], updates.get("original_filename", note.get('original_filename')), note_embedding)
+                ])
+            elif text_changed and vectorstore and not chunk_count:
+                related_updates.submit("remove", user_uid, embedding_model_name, note["_id"])
+            if new_filename:
+                related_updates.submit("rename", note["_id"], new_filename)
+        if topic_updates is not None and text_changed:
+            # The note leaves its topic with the keywords it was counted with
+            embedding_model_name = active_collection["embedding_model_name"]
+            previous = {note["_id"]: (note["topic_id"], note.get('topics', []))} if note.get("topic_id") is not None else {}
+            if note_embedding is not None:
+                topic_updates.submit("assign", user_uid, embedding_model_name,
+                                     [(note["_id"], note_embedding, updates["topics"])], previous)
+            elif leaves_topic:
+                topic_updates.submit("remove", user_uid, embedding_model_name, note["_id"], note["topic_id"],
+                                     note.get('topics', []))
 
-        except Exception as rag_error:
-            print(f"Error during RAG text chunking or vector storage: {rag_error}. RAG functionality might be limited.")
-    elif not vectorstore: # Only print this warning if it's the specific initialization failure
-        print("Vectorstore not available. Skipping RAG text chunking and storage.") # Adjusted message
-    else: # Text too short
-        print("Final text too short for RAG chunking and storage. Skipping.")
+        return jsonify({
+            "message": "Note updated successfully.",
+            "note_id": note_id,
+            "keywords": updates.get("topics", note.get('topics', [])),
+            "rag_chunks": chunk_count
+        }), 200
 
-    # --- MongoDB Storage (Final Save) ---
-    if db is not None:
-        try:
-            notes_collection = db.notes
-            note_document = {
-                "_id": temp_note_id, # Ensure _id is set from the start
-                "user_id": request.current_user.get('uid'),
-                "original_filename": filename,
-                "stored_file_path": file_path,
-                "extracted_text": final_text_for_db,
-                "raw_ocr_text": extracted_text,
-                "upload_date": time.time(),
-                "tags": [],
-                "topics": extracted_keywords,
-                "resource_links": []
-            }
-            result = notes_collection.insert_one(note_document)
-            print(f"Note saved to MongoDB with ID: {result.inserted_id}")
-            return jsonify({
-                "message": f"File '{filename}' uploaded, processed, and saved to database!",
-                "note_id": str(result.inserted_id),
-                "extracted_text_preview": final_text_for_db[:500] + "..." if len(final_text_for_db) > 500 else final_text_for_db,
-                "user_uid": request.current_user.get('uid'),
-                "keywords": extracted_keywords,
-                "rag_chunks_added": len(chunks_to_add) if 'chunks_to_add' in locals() else 0 # Ensure this is safe
-            }), 200
-        except Exception as db_error:
-            print(f"Error saving note to MongoDB: {db_error}")
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            return jsonify({"message": f"File uploaded and processed, but failed to save to database: {db_error}"}), 500
-    else: # MongoDB not connected
-        print("MongoDB not connected. Skipping database storage.")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    except Exception as e:
+        logger.exception("Could not update note %s for user %s", note_id, user_uid)
+        return jsonify({"message": f"Failed to update note: {str(e)}"}), 500
+
+
+@app.route("/api/notes/<string:note_id>", methods=["DELETE"])
+@verify_firebase_token # Only the owner can delete a note
+def delete_note(note_id):
+    if db is None:
+        return jsonify({"message": "Database not connected. Cannot delete note."}), 500
+
+    user_uid = request.current_user.get('uid')
+    try:
+        note = db.notes.find_one({"_id": ObjectId(note_id), "user_id": user_uid})
+        if not note:
+            return jsonify({"message": "Note not found or you don't have access."}), 404
+
+        # Remove the chunks first so a failure never leaves searchable chunks for a deleted note
+        chunks_deleted = delete_note_chunks(vectorstore, note_id) if vectorstore else 0
+        chunks_changed(user_uid)
+
+        db.notes.delete_one({"_id": ObjectId(note_id), "user_id": user_uid})
+        if note_bodies is not None:
+            note_bodies.delete(note["_id"])
+        quizzes_deleted = db.quizzes.delete_many({"note_id": ObjectId(note_id), "user_id": user_uid}).deleted_count
+        if revision_store:
+            revision_store.forget_note(user_uid, ObjectId(note_id))
+        if related_updates is not None:
+            related_updates.submit("remove", user_uid, active_collection["embedding_model_name"], note["_id"])
+        if topic_updates is not None and note.get("topic_id") is not None:
+            topic_updates.submit("remove", user_uid, active_collection["embedding_model_name"], note["_id"],
+                                 note["topic_id"], note.get('topics', []))
+
+        # The note is already deleted, so only other notes with the same content keep the file alive
+        release_stored_upload(note.get('storage_key'), note.get('thumbnail_key'))
+        stored_file_path = note.get('stored_file_path') # Notes uploaded before object storage
+        if stored_file_path and os.path.exists(stored_file_path):
+            os.remove(stored_file_path)
+
+        logger.info("Deleted note %s for user %s (%d chunks, %d quizzes).",
+                    note_id, user_uid, chunks_deleted, quizzes_deleted)
         return jsonify({
-            "message": f"File '{filename}' uploaded and processed, but database connection not available.",
-            "filename": unique_filename,
-            "extracted_text_preview": final_text_for_db[:500] + "..." if len(final_text_for_db) > 500 else final_text_for_db,
-            "user_uid": request.current_user.get('uid'),
-            "keywords": extracted_keywords,
-            "rag_chunks_added": len(chunks_to_add) if 'chunks_to_add' in locals() else 0
+            "message": "Note deleted successfully.",
+            "note_id": note_id,
+            "rag_chunks_deleted": chunks_deleted,
+            "quizzes_deleted": quizzes_deleted
         }), 200
-    
-    # Ensure a return is always hit if previous paths don't return
-    return jsonify({"message": "File upload failed due to unhandled error."}), 500
-    
 
+    except Exception as e:
+        logger.exception("Could not delete note %s for user %s", note_id, user_uid)
+        return jsonify({"message": f"Failed to delete note: {str(e)}"}), 500
 
 
 
+@app.route("/api/notes/<string:note_id>/thumbnail", methods=["GET"])
+@verify_firebase_token
+def get_note_thumbnail(note_id):
+    if db is None:
+        return jsonify({"message": "Database not connected. Cannot retrieve thumbnail."}), 500
+
+    user_uid = request.current_user.get('uid')
+    try:
+        note = db.notes.find_one({"_id": ObjectId(note_id), "user_id": user_uid}, {"thumbnail_key": 1})
+        if not note:
+            return jsonify({"message": "Note not found or you don't have access."}), 404
+        preview_key = note.get('thumbnail_key')
+        if not preview_key:
+            return jsonify({"message": "No thumbnail available for this note."}), 404
+
+        # Thumbnails are content-addressed, so the key doubles as a strong ETag
+        etag = f'"{os.path.basename(preview_key)}"'
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+        if request.headers.get("If-None-Match") == etag:
+            return "", 304, headers
+        return object_storage.get_bytes(preview_key), 200, dict(headers, **{"Content-Type": "image/jpeg"})
+    except Exception as e:
+        logger.exception("Could not retrieve thumbnail for note %s", note_id)
+        return jsonify({"message": f"Failed to retrieve thumbnail: {str(e)}"}), 500
+
+
 @app.route("/api/notes/<string:note_id>/resources", methods=["GET"])
 @verify_firebase_token # Ensure only authenticated users can fetch resources
 def get_note_resources(note_id):
@@ -812,15 +1766,14 @@ def get_note_resources(note_id):
         if not query_string:
             return jsonify({"message": "Empty query for Youtube."}), 400
 
-        print(f"Searching YouTube for: '{query_string}'")
-        search_request = youtube_service.search().list(
-            q=query_string,
-            part='snippet',  # Request snippet details (title, description, thumbnails)
-            type='video',    # Only search for videos
-            maxResults=5,    # Get top 5 relevant videos
-            relevanceLanguage='en' # Optional: Focus search on English videos
-        )
-        search_response = search_request.execute()
+        logger.debug("Searching YouTube for: '%s'", query_string)
+        try:
+            # Top 5 English videos; served from the cache when fresh, or stale when YouTube is failing
+            search_response, source = youtube_service.search_videos(query_string, max_results=5, language='en')
+        except UpstreamUnavailable as e:
+            # Degrade to no videos rather than an error: the note itself is still usable
+            return jsonify({"note_id": note_id, "keywords": keywords, "videos": [], "degraded": True,
+                            "message": str(e)}), 200
 
         # 4. Process YouTube results
         videos = []
@@ -842,15 +1795,40 @@ def get_note_resources(note_id):
         return jsonify({
             "note_id": note_id,
             "keywords": keywords,
-            "videos": videos
+            "videos": videos,
+            "degraded": source == "stale"
         }), 200
 
     except Exception as e:
-        print(f"Error fetching resources for note {note_id}: {e}")
+        logger.exception("Could not fetch resources for note %s", note_id)
         return jsonify({"message": f"Failed to fetch resources: {str(e)}"}), 500
 
 
 
+@app.route("/api/notes/<string:note_id>/related", methods=["GET"])
+@verify_firebase_token
+def get_related_notes(note_id):
+    if related_store is None:
+        return jsonify({"message": "Database not connected. Cannot fetch related notes."}), 500
+
+    user_uid = request.current_user.get('uid')
+    try:
+        # Precomputed on upload: one read of the note document, no similarity search
+        found = related_store.related(ObjectId(note_id), user_uid)
+        if found is None:
+            return jsonify({"message": "Note not found or you don't have access."}), 404
+        entries, updated_at = found
+        return jsonify({
+            "note_id": note_id,
+            "related": [{"id": str(entry["note_id"]), "filename": entry.get("original_filename"), "score": entry["score"]}
+                        for entry in entries],
+            "updated_at": updated_at
+        }), 200
+    except Exception as e:
+        logger.exception("Could not fetch related notes for note %s", note_id)
+        return jsonify({"message": f"Failed to fetch related notes: {str(e)}"}), 500
+
+
 @app.route("/api/my-notes", methods=["GET"])
 @verify_firebase_token
 def get_my_notes():
@@ -868,15 +1846,23 @@ def get_my_notes():
             if not note:
                 return jsonify({"message": "Note not found or you don't have access."}), 404
 
-            # Convert ObjectId to string and prepare for jsonify
-            note['_id'] = str(note['_id']) 
+            # The full texts come from the body store; ObjectId fields are serialized by the app's JSON provider
+            note["extracted_text"] = note_text(note)
+            note["raw_ocr_text"] = note_text(note, raw=True)
             return jsonify({"message": "Note retrieved successfully.", "notes": [note]}), 200 # Return as list for consistency
 
         else:
-            # Fetch all notes for the user (for NoteList component)
+            # Fetch all notes for the user (for NoteList component), optionally of one topic (?topic_id=)
+            query = {"user_id": user_uid}
+            topic_id = request.args.get('topic_id')
+            if topic_id is not None:
+                if not topic_id.isdigit():
+                    return jsonify({"message": "'topic_id' must be a non-negative integer."}), 400
+                query["topic_id"] = int(topic_id) # Served by the (user_id, topic_id) index
             notes_cursor = db.notes.find(
-                {"user_id": user_uid},
-                {"_id": 1, "original_filename": 1, "extracted_text": 1, "upload_date": 1, "topics": 1}
+                query,
+                {"_id": 1, "original_filename": 1, "preview_text": 1, "upload_date": 1, "topics": 1, "topic_id": 1,
+                 "thumbnail_key": 1, "extracted_text": 1} # Only notes stored before the body store still have it
             ).sort("upload_date", -1)
 
             notes_list = []
@@ -884,9 +1870,13 @@ def get_my_notes():
                 notes_list.append({
                     "id": str(note['_id']),
                     "filename": note['original_filename'],
-                    "preview_text": note['extracted_text'][:200] + "..." if len(note['extracted_text']) > 200 else note['extracted_text'],
+                    "preview_text": note_preview(note),
                     "upload_date": note['upload_date'],
-                    "topics": note.get('topics', [])
+                    "topics": note.get('topics', []),
+                    "topic_id": note.get('topic_id'),
+                    # Small preview image, so listings never download the original upload. Like every
+                    # API route it needs the Authorization header (NoteList loads it as a blob).
+                    "thumbnail_url": f"/api/notes/{note['_id']}/thumbnail" if note.get('thumbnail_key') else None
                 })
 
             return jsonify({
@@ -895,12 +1885,28 @@ def get_my_notes():
             }), 200
 
     except Exception as e:
-        print(f"Error retrieving notes for user {user_uid} (ID: {note_id}): {e}")
+        logger.exception("Could not retrieve notes for user %s (ID: %s)", user_uid, note_id)
         return jsonify({"message": f"Failed to retrieve notes: {str(e)}"}), 500
 
 
+@app.route("/api/topics", methods=["GET"])
+@verify_firebase_token
+def get_topics():
+    if topic_store is None:
+        return jsonify({"message": "Database not connected. Cannot retrieve topics."}), 500
+
+    user_uid = request.current_user.get('uid')
+    try:
+        # Filter notes of a topic with /api/my-notes?topic_id=<topic_id>
+        return jsonify({"message": "Topics retrieved successfully.", "topics": topic_store.topics(user_uid)}), 200
+    except Exception as e:
+        logger.exception("Could not retrieve topics for user %s", user_uid)
+        return jsonify({"message": f"Failed to retrieve topics: {str(e)}"}), 500
+
+
 @app.route("/api/notes/<string:note_id>/generate-quiz", methods=["POST"])
 @verify_firebase_token # Only authenticated users can generate quizzes
+@admission.limit("quiz")
 def generate_quiz(note_id):
     if db is None:
         return jsonify({"message": "Database not connected. Cannot generate quiz."}), 500
@@ -915,97 +1921,43 @@ def generate_quiz(note_id):
         if not note:
             return jsonify({"message": "Note not found or you don't have access."}), 404
 
-        note_text = note.get('extracted_text', '').strip()
-        if len(note_text) < 100: # Require a minimum amount of text to generate a meaningful quiz
+        text = note_text(note).strip()
+        if len(text) < 100: # Require a minimum amount of text to generate a meaningful quiz
             return jsonify({"message": "Note text too short to generate a meaningful quiz (min 100 chars required)."}), 400
 
-        print(f"Generating quiz for note ID: {note_id} (User: {user_uid})")
-
-        # 2. Craft the LLM Prompt for MCQ Generation (CRUCIAL STEP)
-        # We ask for JSON output for easy parsing.
-        system_prompt = """You are an expert educator and quiz generator. Your task is to create multiple-choice questions (MCQs) based on the provided text.
- 
-            Strictly adhere to the following format and rules:
-
-            Generate exactly 3 to 5 MCQs.
-
-            Each MCQ must have:
-
-                A 'question' field (string).
-
-                An 'options' field (an array of 4 strings).
-
-                A 'correct_answer' field (string, one of the options).
-
-            Ensure the questions are clear, directly related to the text, and have one unambiguous correct answer.
-
-            The output MUST be a JSON array of MCQ objects, and nothing else. Do NOT wrap the array in any other object (e.g., no {"quiz": [...]}). Do NOT add any introductory or concluding text, or conversational filler.
-
-            All output text must be in English.
-
-            Example JSON format (Note: this is just an example of one MCQ in the array):
-            [
-            {
-            "question": "What is the capital of France?",
-            "options": ["Berlin", "Madrid", "Paris", "Rome"],
-            "correct_answer": "Paris"
-            }
-            ]
-            """
-        user_prompt = f"Generate MCQs based on the following text:\n\n{note_text}"
-
-        llm_response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo-1106", # Using a newer model version if available, or "gpt-3.5-turbo"
-            response_format={"type": "json_object"}, # <--- CRUCIAL: Request JSON object response
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.5, # Slightly higher temperature for more varied questions
-            max_tokens=1500  # Adjust max_tokens based on expected quiz length
-        )
-
-
-        # 3. Parse the LLM's JSON response
-        quiz_json_string = llm_response.choices[0].message.content.strip()
-
-        # --- NEW: Always print raw LLM response for debugging ---
-        print(f"DEBUG: Raw LLM response from OpenAI (first 500 chars): {quiz_json_string[:500]}...")
-        # --- END NEW ---
+        # 2. Generate the MCQs: one prompt for short notes, map-reduce over the note's chunks
+        # for long ones (or as requested with {"mode": "single"|"map_reduce"})
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', QUIZ_MODE)
+        if mode not in ("auto", "single", "map_reduce"):
+            return jsonify({"message": f"Unknown quiz mode '{mode}'. Use 'auto', 'single' or 'map_reduce'."}), 400
+        if mode == "auto":
+            mode = "map_reduce" if count_tokens(text) > QUIZ_SINGLE_PROMPT_TOKENS else "single"
+        try:
+            route = model_router.route("quiz", "long" if mode == "map_reduce" else "short", user_uid)
+        except BudgetExceeded as e:
+            return budget_exceeded_response(e)
+        quiz_client = model_router.client(openai_client, route, user_uid)
+        logger.info("Generating quiz for note %s (user %s) in %s mode with %s.", note_id, user_uid, mode, route.model)
 
         try:
-            # The LLM's response_format={"type": "json_object"} typically forces the output to be
-            # a single JSON object. The prompt asks for an array inside.
-            parsed_quiz_data = json.loads(quiz_json_string)
-            generated_mcqs = [] # Initialize as empty list
-
-            # Check if it's a list (as requested in prompt)
-            if isinstance(parsed_quiz_data, list):
-                generated_mcqs = parsed_quiz_data
-            # Check if it's an object with a "quiz" key (common LLM behavior despite prompt)
-            elif isinstance(parsed_quiz_data, dict) and "quiz" in parsed_quiz_data:
-                if isinstance(parsed_quiz_data["quiz"], list):
-                    generated_mcqs = parsed_quiz_data["quiz"]
-                else:
-                    # Case: {"quiz": {...}} instead of {"quiz": [...]}, try to wrap it
-                    generated_mcqs = [parsed_quiz_data["quiz"]] if isinstance(parsed_quiz_data["quiz"], dict) else []
-                    if not generated_mcqs:
-                        raise ValueError("LLM returned 'quiz' key but its value is not a list or valid object.")
-            # Check if it's a single MCQ object (what we just saw in your debug log)
-            elif isinstance(parsed_quiz_data, dict) and "question" in parsed_quiz_data and "options" in parsed_quiz_data:
-                generated_mcqs = [parsed_quiz_data] # Wrap the single MCQ object in a list
+            if mode == "single":
+                generated_mcqs = quiz_generation.generate_single(quiz_client, text, model=route.model)
             else:
-                raise ValueError("LLM response not in expected quiz format. It's not a list, an object with 'quiz' key, or a single MCQ object.")
-
-            if not generated_mcqs: # Final check to ensure we got something
-                raise ValueError("Generated MCQs list is empty after parsing.")
+                docs, note_embedding = note_chunks(note)
+                generated_mcqs = quiz_generation.generate_map_reduce(
+                    quiz_client, docs,
+                    embed=embedding_function.embed_documents if embedding_function else None,
+                    count=QUIZ_QUESTION_COUNT, note_embedding=note_embedding, model=route.model,
+                    workers=QUIZ_MAP_WORKERS
+                )
+        except UpstreamUnavailable as e:
+            return upstream_unavailable_response(e, "Quiz generation")
         except json.JSONDecodeError as e:
-            print(f"Error decoding LLM JSON response: {e}")
-            # Raw LLM response already printed above if this block is hit
+            logger.exception("Could not decode LLM JSON response")
             return jsonify({"message": f"Quiz generation failed: Invalid JSON from LLM. {e}"}), 500
         except ValueError as e:
-            print(f"Error parsing LLM response format: {e}")
-            # Raw LLM response already printed above if this block is hit
+            logger.exception("Could not parse LLM response format")
             return jsonify({"message": f"Quiz generation failed: Unexpected LLM response format. {e}"}), 500
 
         
@@ -1019,12 +1971,13 @@ def generate_quiz(note_id):
             "user_id": user_uid,          # Link to the user who generated it
             "note_id": ObjectId(note_id), # Link to the original note
             "generation_date": time.time(), # Timestamp
-            "quiz_questions": generated_mcqs # Store the array of MCQs
+            "quiz_questions": generated_mcqs, # Store the array of MCQs
+            "model": route.model
         }
 
         result = quizzes_collection.insert_one(quiz_document)
         quiz_id = str(result.inserted_id) # Get the ID of the new quiz document
-        print(f"Quiz saved to MongoDB with ID: {quiz_id}")
+        logger.info("Quiz saved to MongoDB with ID: %s", quiz_id)
 
         # --- END OF NEW: Quiz saving logic ---
 
@@ -1037,7 +1990,7 @@ def generate_quiz(note_id):
         }), 200
 
     except Exception as e:
-        print(f"Error generating or saving quiz for note {note_id}: {e}")
+        logger.exception("Could not generate or save quiz for note %s", note_id)
         return jsonify({"message": f"Quiz generation failed: {str(e)}"}), 500
 
 
@@ -1055,19 +2008,14 @@ def get_quiz(quiz_id):
         if not quiz:
             return jsonify({"message": "Quiz not found or you don't have access."}), 404
 
-        # Convert ObjectId to string and prepare for jsonify
-        quiz['_id'] = str(quiz['_id'])
-        # Convert note_id ObjectId to string too if it's there
-        if 'note_id' in quiz and isinstance(quiz['note_id'], ObjectId):
-            quiz['note_id'] = str(quiz['note_id'])
-
+        # ObjectId fields (_id, note_id) are serialized by the app's JSON provider
         return jsonify({
             "message": "Quiz retrieved successfully.",
             "quiz": quiz
         }), 200
 
     except Exception as e:
-        print(f"Error retrieving quiz {quiz_id} for user {user_uid}: {e}")
+        logger.exception("Could not retrieve quiz %s for user %s", quiz_id, user_uid)
         return jsonify({"message": f"Failed to retrieve quiz: {str(e)}"}), 500
 
 
@@ -1085,7 +2033,7 @@ def get_my_quizzes():
         for quiz in quizzes_cursor:
             note_title = "Untitled Note"
             if 'note_id' in quiz and isinstance(quiz['note_id'], ObjectId):
-                note = db.notes.find_one({"_id": quiz['note_id']})
+                note = db.notes.find_one({"_id": quiz['note_id']}, {"original_filename": 1})
                 if note:
                     note_title = note.get('original_filename', 'Untitled Note')
             quizzes_list.append({
@@ -1099,17 +2047,138 @@ def get_my_quizzes():
             "quizzes": quizzes_list
         }), 200
     except Exception as e:
-        print(f"Error retrieving quizzes for user {user_uid}: {e}")
+        logger.exception("Could not retrieve quizzes for user %s", user_uid)
         return jsonify({"message": f"Failed to retrieve quizzes: {str(e)}"}), 500
 
 
+@app.route("/api/quizzes/<string:quiz_id>/attempts", methods=["POST"])
+@verify_firebase_token
+def submit_quiz_attempt(quiz_id):
+    """
+    Records answers to a quiz and reschedules its questions for revision.
+    Body: {"answers": [{"question_index", "selected_option", "quality" (optional SM-2 grade 0-5)}],
+    "duration_seconds" (optional)}.
+    """
+    if db is None or revision_store is None:
+        return jsonify({"message": "Database not connected. Cannot record quiz attempt."}), 500
+
+    user_uid = request.current_user.get('uid')
+    data = request.get_json(silent=True) or {}
+    answers = data.get('answers')
+    if not isinstance(answers, list) or not answers:
+        return jsonify({"message": "Please provide the answers of the attempt."}), 400
+    duration_seconds = data.get('duration_seconds')
+    if not isinstance(duration_seconds, (int, float)) or not 0 <= duration_seconds <= 24 * 3600:
+        duration_seconds = None
+
+    try:
+        quiz = db.quizzes.find_one({"_id": ObjectId(quiz_id), "user_id": user_uid},
+                                   {"note_id": 1, "quiz_questions": 1})
+        if not quiz:
+            return jsonify({"message": "Quiz not found or you don't have access."}), 404
+        graded = grade_answers(quiz.get('quiz_questions', []), [answer for answer in answers if isinstance(answer, dict)])
+        if not graded:
+            return jsonify({"message": "None of the answers matches a question of this quiz."}), 400
+
+        attempt, states = revision_store.record_attempt(user_uid, quiz, graded, duration_seconds)
+        logger.info("Quiz attempt on %s by user %s: %d/%d correct.",
+                    quiz_id, user_uid, attempt['correct'], attempt['total'])
+        return jsonify({
+            "message": "Quiz attempt recorded.",
+            "attempt_id": str(attempt['_id']),
+            "correct": attempt['correct'],
+            "total": attempt['total'],
+            "accuracy": round(100.0 * attempt['correct'] / attempt['total'], 1),
+            "reviews": [{
+                "question_index": answer["question_index"],
+                "correct": answer["correct"],
+                "interval_days": states[answer["question_index"]]["interval_days"],
+                "due_at": states[answer["question_index"]]["due_at"]
+            } for answer in graded]
+        }), 201
+
+    except Exception as e:
+        logger.exception("Could not record quiz attempt on %s for user %s", quiz_id, user_uid)
+        return jsonify({"message": f"Failed to record quiz attempt: {str(e)}"}), 500
+
+
+@app.route("/api/revision/due", methods=["GET"])
+@verify_firebase_token
+def get_due_reviews():
+    """The questions due for revision now, most overdue first (?limit=, default 20, max 100)."""
+    if db is None or revision_store is None:
+        return jsonify({"message": "Database not connected."}), 500
+
+    user_uid = request.current_user.get('uid')
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({"message": "limit must be an integer."}), 400
+
+    try:
+        now = time.time()
+        due_states = revision_store.due(user_uid, now=now, limit=limit)
+        quiz_ids = list({state["quiz_id"] for state in due_states})
+        quizzes = {quiz["_id"]: quiz for quiz in db.quizzes.find(
+            {"_id": {"$in": quiz_ids}, "user_id": user_uid}, {"note_id": 1, "quiz_questions": 1}
+        )}
+        reviews = []
+        for state in due_states:
+            questions = quizzes.get(state["quiz_id"], {}).get('quiz_questions', [])
+            if state["question_index"] >= len(questions):
+                continue # Quiz deleted since the last review
+            question = questions[state["question_index"]]
+            reviews.append({
+                "quiz_id": str(state["quiz_id"]),
+                "note_id": str(state["note_id"]) if state.get("note_id") else None,
+                "question_index": state["question_index"],
+                "question": question.get("question"),
+                "options": question.get("options", []),
+                "due_at": state["due_at"],
+                "overdue_days": round((now - state["due_at"]) / 86400.0, 1),
+                "interval_days": state["interval_days"],
+                "lapses": state.get("lapses", 0)
+            })
+        return jsonify({
+            "message": "Due reviews retrieved successfully.",
+            "due_count": revision_store.due_count(user_uid, now=now),
+            "reviews": reviews
+        }), 200
+
+    except Exception as e:
+        logger.exception("Could not retrieve due reviews for user %s", user_uid)
+        return jsonify({"message": f"Failed to retrieve due reviews: {str(e)}"}), 500
+
+
+@app.route("/api/llm-usage", methods=["GET"])
+@verify_firebase_token
+def get_llm_usage():
+    """The user's LLM token usage and estimated cost today, against their daily budget."""
+    if llm_usage is None:
+        return jsonify({"message": "Database not connected."}), 500
+
+    user_uid = request.current_user.get('uid')
+    try:
+        today = llm_usage.today(user_uid)
+        budget = USER_DAILY_TOKEN_BUDGET or None
+        return jsonify({
+            **today,
+            "daily_token_budget": budget,
+            "remaining_tokens": max(budget - today["tokens"], 0) if budget else None
+        }), 200
+    except Exception as e:
+        logger.exception("Could not retrieve LLM usage for user %s", user_uid)
+        return jsonify({"message": f"Failed to retrieve usage: {str(e)}"}), 500
+
+
 @app.route("/api/rag-query", methods=["POST"])
 @verify_firebase_token # Ensure only authenticated users can ask RAG queries
+@admission.limit("rag")
 def rag_query():
     if not openai_client:
         return jsonify({"message": "RAG failed: OpenAI client not initialized."}), 500
     if not vectorstore: # This check is now here, but vectorstore should not be None
-        print("RAG query received but vectorstore is not available globally.") # Add a debug print
+        logger.warning("RAG query received but vectorstore is not available globally.") # Add a debug print
         return jsonify({"message": "RAG failed: Vectorstore not available. Please check server logs."}), 500 # More specific message
 
     data = request.get_json()
@@ -1119,24 +2188,27 @@ def rag_query():
         return jsonify({"message": "Please provide a question for the RAG query."}), 400
 
     user_uid = request.current_user.get('uid')
-    print(f"RAG query from user {user_uid}: '{user_question}'")
+    logger.debug("RAG query from user %s: '%s'", user_uid, user_question)
 
     try:
         # 1. Retrieve Relevant Chunks from ChromaDB
         # We filter by user_id in metadata to only search within the user's own notes.
-        # k=4 means retrieve the top 4 most relevant chunks. Adjust as needed.
+        # RAG_CANDIDATE_K candidates are fetched; build_context trims them down to the token budget.
         # `filter` uses MongoDB-style queries on metadata.
-        retrieved_docs = vectorstore.similarity_search(
-            query=user_question,
-            k=4,
-            filter={"user_id": user_uid} # <--- CRUCIAL: Filter by user_id
-        )
+        retrieved_docs = search_user_chunks(user_question, RAG_CANDIDATE_K, user_uid) # <--- CRUCIAL: Filter by user_id
 
         if not retrieved_docs:
             return jsonify({"message": "No relevant information found in your notes for this question."}), 200 # Return 200, not an error
 
         # 2. Augment the LLM Prompt with Retrieved Context
-        context_text = "\n\n".join([doc.page_content for doc in retrieved_docs])
+        # Overlapping chunks are deduplicated, neighbours from the same note merged,
+        # optionally re-ranked, and packed into RAG_CONTEXT_TOKEN_BUDGET tokens.
+        context_text, retrieved_docs = build_context(
+            user_question,
+            retrieved_docs,
+            token_budget=RAG_CONTEXT_TOKEN_BUDGET,
+            cross_encoder=rerank_model
+        )
 
         # Design the RAG prompt: Instruct the LLM to answer based *only* on context
         system_prompt = """You are a helpful and knowledgeable assistant. Your task is to answer the user's question truthfully and concisely, based SOLELY on the provided context. If the answer is not available in the context, state that you cannot find the answer in the provided information.
@@ -1147,9 +2219,12 @@ def rag_query():
         """
     
         user_prompt = user_question
-        # 3. Call the LLM for Generation
-        llm_response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo", # Use gpt-3.5-turbo for cost/speed, or gpt-4 for better reasoning
+        # 3. Call the LLM for Generation, with a model for the question's complexity
+        route = model_router.route(
+            "rag", question_complexity(user_question, count_tokens, count_tokens(context_text)), user_uid
+        )
+        llm_response = model_router.client(openai_client, route, user_uid).chat.completions.create(
+            model=route.model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
@@ -1165,6 +2240,9 @@ def rag_query():
         for doc in retrieved_docs:
             sources.append({
                 "chunk_id": doc.metadata.get('chunk_id'),
+                "chunk_ids": doc.metadata.get('chunk_ids', [doc.metadata.get('chunk_id')]),
+                "page_numbers": doc.metadata.get('page_numbers', []),
+                "heading": doc.metadata.get('heading'),
                 "note_id": doc.metadata.get('note_id'),
                 "original_filename": doc.metadata.get('original_filename')
             })
@@ -1175,8 +2253,12 @@ def rag_query():
             "sources": sources
         }), 200
 
+    except UpstreamUnavailable as e:
+        return upstream_unavailable_response(e, "Answering questions")
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
     except Exception as e:
-        print(f"Error during RAG query for user {user_uid} and question '{user_question}': {e}")
+        logger.exception("RAG query failed for user %s and question '%s'", user_uid, user_question)
         return jsonify({"message": f"RAG query failed: {str(e)}"}), 500
 
 
@@ -1192,50 +2274,40 @@ def get_dashboard_stats():
         # 1. Number of notes uploaded
         notes_count = db.notes.count_documents({"user_id": user_uid})
 
-        # 2. Quizzes solved with accuracy (requires iterating through quiz results)
-        # For simplicity, let's just count quizzes generated for now.
-        # A full implementation would involve storing quiz submissions and their scores.
+        # 2. Quizzes solved with accuracy, from the recorded quiz attempts
         quizzes_generated_count = db.quizzes.count_documents({"user_id": user_uid})
-        # Placeholder for actual solved quizzes/accuracy (can expand later)
-        quizzes_solved = 0
-        average_accuracy = 0.0
+        attempt_stats = revision_store.stats(user_uid) if revision_store else {
+            "quizzes_solved": 0, "average_accuracy": 0.0, "study_time_hours": 0.0, "days_streak": 0, "weekly_progress": []
+        }
 
-        # 3. Days streak (placeholder)
-        days_streak = 0
+        # 3. Questions due for revision now
+        due_reviews = revision_store.due_count(user_uid) if revision_store else 0
 
-        # 4. Usage time (placeholder)
-        usage_time_minutes = 0
+        # 4. Quiz accuracy per topic, and its change over the last week
+        topic_mastery = []
+        if revision_store and topic_store:
+            topic_mastery = topic_store.mastery(
+                user_uid, revision_store.accuracy_by_note(user_uid),
+                revision_store.accuracy_by_note(user_uid, since=time.time() - 7 * 86400)
+            )
 
         return jsonify({
             "message": "Dashboard stats retrieved successfully.",
             "stats": {
                 "notes_uploaded": notes_count,
                 "quizzes_generated": quizzes_generated_count,
-                "quizzes_solved": quizzes_solved, # Placeholder for actual solved quizzes
-                "average_accuracy": average_accuracy, # Placeholder for actual average accuracy (e.g., 86.2)
-                "days_streak": days_streak, # Placeholder (e.g., 12)
-                "study_time_hours": 87.5, # Placeholder (e.g., 87.5)
-                # Mock data for charts
-                "weekly_progress": [
-                    {"day": "Mon", "time_h": 2.5, "accuracy": 85},
-                    {"day": "Tue", "time_h": 3.2, "accuracy": 76},
-                    {"day": "Wed", "time_h": 1.8, "accuracy": 92},
-                    {"day": "Thu", "time_h": 4.1, "accuracy": 88},
-                    {"day": "Fri", "time_h": 2.9, "accuracy": 76},
-                    {"day": "Sat", "time_h": 5.0, "accuracy": 90}, # Add weekend for full week
-                    {"day": "Sun", "time_h": 3.5, "accuracy": 82},
-                ],
-                "topic_mastery": [
-                    {"topic": "Linear Algebra", "percentage": 92, "change": 5},
-                    {"topic": "Operating Systems", "percentage": 88, "change": 3},
-                    {"topic": "Machine Learning", "percentage": 85, "change": -2},
-                    {"topic": "Database Systems", "percentage": 91, "change": 7},
-                ]
+                "quizzes_solved": attempt_stats["quizzes_solved"],
+                "average_accuracy": attempt_stats["average_accuracy"],
+                "days_streak": attempt_stats["days_streak"],
+                "study_time_hours": attempt_stats["study_time_hours"], # Time spent on quiz attempts
+                "due_reviews": due_reviews,
+                "weekly_progress": attempt_stats["weekly_progress"],
+                "topic_mastery": topic_mastery
             }
         }), 200
     
     except Exception as e:
-        print(f"Error retrieving dashboard stats for user {user_uid}: {e}")
+        logger.exception("Could not retrieve dashboard stats for user %s", user_uid)
         return jsonify({"message": f"Failed to retrieve dashboard stats: {str(e)}"}), 500
 
 
@@ -1253,17 +2325,13 @@ def search_notes():
         return jsonify({"message": "Please provide a search query."}), 400
 
     user_uid = request.current_user.get('uid')
-    print(f"User {user_uid} searching notes for query: '{user_query}'")
+    logger.debug("User %s searching notes for query: '%s'", user_uid, user_query)
 
     try:
         # Perform semantic search in ChromaDB
         # Filter by user_id to ensure users only search their own notes
         # k=5 means retrieve top 5 most relevant chunks (can be adjusted)
-        retrieved_chunks = vectorstore.similarity_search(
-            query=user_query,
-            k=5, # Retrieve top 5 relevant chunks
-            filter={"user_id": user_uid}
-        )
+        retrieved_chunks = search_user_chunks(user_query, 5, user_uid) # Retrieve top 5 relevant chunks
 
         if not retrieved_chunks:
             return jsonify({"message": "No relevant notes found for your query."}), 200
@@ -1279,15 +2347,18 @@ def search_notes():
                 # For a cleaner response, let's fetch the actual note doc
                 note_from_db = db.notes.find_one(
                     {"_id": ObjectId(note_id), "user_id": user_uid},
-                    {"_id": 1, "original_filename": 1, "extracted_text": 1, "upload_date": 1, "topics": 1}
+                    {"_id": 1, "original_filename": 1, "preview_text": 1, "extracted_text": 1, "upload_date": 1, "topics": 1,
+                     "thumbnail_key": 1}
                 )
                 if note_from_db:
                     found_notes_info[note_id] = {
                         "id": str(note_from_db['_id']),
                         "filename": note_from_db['original_filename'],
-                        "preview_text": note_from_db['extracted_text'][:200] + "..." if len(note_from_db['extracted_text']) > 200 else note_from_db['extracted_text'],
+                        "preview_text": note_preview(note_from_db),
                         "upload_date": note_from_db['upload_date'],
                         "topics": note_from_db.get('topics', []),
+                        "thumbnail_url": (f"/api/notes/{note_from_db['_id']}/thumbnail"
+                                          if note_from_db.get('thumbnail_key') else None),
                         "relevance_chunk": doc.page_content[:100] + "..." # Show a snippet of the relevant chunk
                     }
 
@@ -1300,7 +2371,7 @@ def search_notes():
         }), 200
 
     except Exception as e:
-        print(f"Error during search query for user {user_uid} and query '{user_query}': {e}")
+        logger.exception("Search query failed for user %s and query '%s'", user_uid, user_query)
         return jsonify({"message": f"Search failed: {str(e)}"}), 500
 
 
@@ -0,0 +1,227 @@
+# backend/batch_metrics.py
+"""
+Batch accuracy metrics for the offline evaluator.
+
+- Edit distance uses Hyyrö's bit-parallel formulation of Myers' algorithm (one big-integer
+  bit vector per column), with chunked alignment for long texts. It works on any sequence of hashable symbols, so the same code gives character
+  error rate (CER) and word error rate (WER).
+- Keyword precision/recall/F1 is computed for many documents at once with NumPy, with exact,
+  lemmatized or fuzzy keyword matching.
+"""
+import re
+import string
+
+import numpy as np
+
+LONG_TEXT_CHUNK = 4000 # Reference symbols per aligned chunk for long texts
+ANCHOR_LENGTH = 24 # Symbols used to locate a chunk boundary in the hypothesis
+_PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+
+# --- Edit distance ---
+
+def edit_distance(reference, hypothesis):
+    """Levenshtein distance between two sequences (strings or token lists), bit-parallel."""
+    # The shorter sequence becomes the bit-vector "pattern"
+    pattern, text = (reference, hypothesis) if len(reference) <= len(hypothesis) else (hypothesis, reference)
+    m = len(pattern)
+    if m == 0:
+        return len(text)
+
+    peq = {}
+    for i, symbol in enumerate(pattern):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+    mask = (1 << m) - 1
+    high_bit = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for symbol in text:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high_bit:
+            score += 1
+        elif mh & high_bit:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+
+def _find_anchor(hypothesis, anchor, expected, slack):
+    """Position of `anchor` in hypothesis closest to `expected` (within slack), or None."""
+    start = max(0, expected - slack)
+    end = min(len(hypothesis), expected + slack + len(anchor))
+    window = hypothesis[start:end]
+    if isinstance(window, str):
+        positions = [m.start() + start for m in re.finditer(re.escape(anchor), window)]
+    else:
+        anchor = list(anchor)
+        positions = [start + i for i in range(len(window) - len(anchor) + 1) if list(window[i:i + len(anchor)]) == anchor]
+    if not positions:
+        return None
+    return min(positions, key=lambda position: abs(position - expected))
+
+
+def chunked_edit_distance(reference, hypothesis, chunk=LONG_TEXT_CHUNK):
+    """
+    Edit distance for long texts: the reference is cut every `chunk` symbols, each cut is
+    located in the hypothesis by an exact anchor near its proportional position, and the
+    paired segments are compared separately. The result is an upper bound of the true
+    distance (it is exact when the anchors are found at the true alignment) and costs
+    O(n * chunk / wordsize) instead of O(n * m / wordsize).
+    """
+    if len(reference) <= 2 * chunk:
+        return edit_distance(reference, hypothesis)
+    ratio = len(hypothesis) / max(1, len(reference))
+    slack = chunk // 4
+    total = 0
+    ref_start = hyp_start = 0
+    for ref_cut in range(chunk, len(reference) - chunk // 2, chunk):
+        anchor = reference[ref_cut:ref_cut + ANCHOR_LENGTH]
+        hyp_cut = _find_anchor(hypothesis, anchor, int(ref_cut * ratio), slack)
+        if hyp_cut is None or hyp_cut < hyp_start:
+            continue # No reliable anchor: merge this chunk with the next one
+        total += edit_distance(reference[ref_start:ref_cut], hypothesis[hyp_start:hyp_cut])
+        ref_start, hyp_start = ref_cut, hyp_cut
+    return total + edit_distance(reference[ref_start:], hypothesis[hyp_start:])
+
+
+def tokenize_words(text):
+    return text.split()
+
+
+def character_error_rate(reference, hypothesis, chunk=LONG_TEXT_CHUNK):
+    """CER = character edit distance / reference length (None without a reference)."""
+    if not reference:
+        return None
+    return chunked_edit_distance(reference, hypothesis, chunk) / len(reference)
+
+
+def word_error_rate(reference, hypothesis, chunk=LONG_TEXT_CHUNK):
+    """WER = word edit distance / reference word count (None without a reference)."""
+    reference_words = tokenize_words(reference or "")
+    if not reference_words:
+        return None
+    # Map words to small integers so the bit-parallel kernel hashes ints, not strings
+    vocabulary = {}
+    reference_ids = [vocabulary.setdefault(word, len(vocabulary)) for word in reference_words]
+    hypothesis_ids = [vocabulary.setdefault(word, len(vocabulary)) for word in tokenize_words(hypothesis or "")]
+    return chunked_edit_distance(reference_ids, hypothesis_ids, chunk) / len(reference_ids)
+
+
+# --- Keyword matching ---
+
+def normalize_keyword(keyword):
+    return keyword.lower().translate(_PUNCTUATION).strip()
+
+
+def _simple_lemma(word):
+    """Small English suffix stripper, used when NLTK's WordNet lemmatizer is not installed."""
+    if word.endswith("ss") and not word.endswith("sses"):
+        return word # "class", "process": not plurals
+    for suffix, replacement in (("ies", "y"), ("sses", "ss"), ("ing", ""), ("ed", ""), ("es", ""), ("s", "")):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+try:
+    from nltk.stem import WordNetLemmatizer
+    _wordnet = WordNetLemmatizer()
+    _wordnet.lemmatize("tests") # Fails here if the WordNet corpus is not downloaded
+
+    def lemmatize(word):
+        return " ".join(_wordnet.lemmatize(part) for part in word.split())
+except Exception:
+    def lemmatize(word):
+        return " ".join(_simple_lemma(part) for part in word.split())
+
+
+def _keyword_set(keywords, match):
+    normalized = (normalize_keyword(keyword) for keyword in keywords)
+    if match == "lemma":
+        return {lemmatize(keyword) for keyword in normalized if keyword}
+    return {keyword for keyword in normalized if keyword}
+
+
+def _fuzzy_true_positives(ground_truth, extracted, threshold):
+    """One-to-one greedy matching of keywords whose normalized similarity >= threshold."""
+    if not ground_truth or not extracted:
+        return 0
+    ground_truth, extracted = sorted(ground_truth), sorted(extracted)
+    similarity = np.zeros((len(ground_truth), len(extracted)))
+    for i, expected in enumerate(ground_truth):
+        for j, candidate in enumerate(extracted):
+            longest = max(len(expected), len(candidate))
+            similarity[i, j] = 1.0 - edit_distance(expected, candidate) / longest
+    matches = 0
+    while True:
+        i, j = np.unravel_index(np.argmax(similarity), similarity.shape)
+        if similarity[i, j] < threshold:
+            return matches
+        matches += 1
+        similarity[i, :] = -1.0
+        similarity[:, j] = -1.0
+
+
+def keyword_metrics_batch(ground_truth_lists, extracted_lists, match="exact", fuzzy_threshold=0.85):
+    """
+    Precision, recall and F1 for many documents at once.
+
+    match: "exact" (case/punctuation-insensitive), "lemma" (also lemmatized) or "fuzzy"
+    (edit-distance similarity >= fuzzy_threshold). Documents without ground truth keywords
+    get NaN. Returns a dict of per-document arrays plus micro/macro averages.
+    """
+    base_match = "lemma" if match == "lemma" else "exact"
+    ground_truth_sets = [_keyword_set(keywords or [], base_match) for keywords in ground_truth_lists]
+    extracted_sets = [_keyword_set(keywords or [], base_match) for keywords in extracted_lists]
+
+    if match == "fuzzy":
+        true_positives = np.array([
+            _fuzzy_true_positives(expected, found, fuzzy_threshold)
+            for expected, found in zip(ground_truth_sets, extracted_sets)
+        ], dtype=np.float64)
+    else:
+        vocabulary = {}
+        for keyword_set in ground_truth_sets + extracted_sets:
+            for keyword in keyword_set:
+                vocabulary.setdefault(keyword, len(vocabulary))
+        ground_truth_matrix = np.zeros((len(ground_truth_sets), max(1, len(vocabulary))), dtype=bool)
+        extracted_matrix = np.zeros_like(ground_truth_matrix)
+        for row, keyword_set in enumerate(ground_truth_sets):
+            ground_truth_matrix[row, [vocabulary[k] for k in keyword_set]] = True
+        for row, keyword_set in enumerate(extracted_sets):
+            extracted_matrix[row, [vocabulary[k] for k in keyword_set]] = True
+        true_positives = (ground_truth_matrix & extracted_matrix).sum(axis=1).astype(np.float64)
+
+    ground_truth_counts = np.array([len(s) for s in ground_truth_sets], dtype=np.float64)
+    extracted_counts = np.array([len(s) for s in extracted_sets], dtype=np.float64)
+    has_ground_truth = ground_truth_counts > 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(extracted_counts > 0, true_positives / extracted_counts, 0.0)
+        recall = np.where(has_ground_truth, true_positives / ground_truth_counts, np.nan)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    precision = np.where(has_ground_truth, precision, np.nan)
+    f1 = np.where(has_ground_truth, f1, np.nan)
+
+    tp_total = true_positives[has_ground_truth].sum()
+    micro_precision = tp_total / extracted_counts[has_ground_truth].sum() if extracted_counts[has_ground_truth].sum() else 0.0
+    micro_recall = tp_total / ground_truth_counts[has_ground_truth].sum() if has_ground_truth.any() else float('nan')
+    micro_f1 = (2 * micro_precision * micro_recall / (micro_precision + micro_recall)
+                if (micro_precision + micro_recall) > 0 else 0.0)
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "micro": {"precision": micro_precision, "recall": micro_recall, "f1": micro_f1},
+        "macro": {
+            "precision": float(np.nanmean(precision)) if has_ground_truth.any() else float('nan'),
+            "recall": float(np.nanmean(recall)) if has_ground_truth.any() else float('nan'),
+            "f1": float(np.nanmean(f1)) if has_ground_truth.any() else float('nan'),
+        },
+    }
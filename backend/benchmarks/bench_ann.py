@@ -0,0 +1,177 @@
+# backend/benchmarks/bench_ann.py
+"""
+Recall-vs-latency benchmark for the ChromaDB searches behind /api/rag-query and /api/notes/search.
+
+For one user's chunks it measures:
+- end-to-end `vectorstore.similarity_search` latency (query embedding + ANN search), as the routes call it
+- raw HNSW query latency and recall@k against exact brute-force search over the same vectors
+- optionally, recall@k of exact search over a float16 / int8 quantized copy of the same vectors,
+  and latency and recall@k of the API's quantized search mode (ANN_QUANTIZATION), which rescores
+  those candidates with the float32 vectors
+
+HNSW parameters are fixed when a collection is built, so compare settings by re-indexing with
+each configuration (reindex.py --hnsw-* or CHROMA_HNSW_*) and running this against each collection.
+
+Example:
+    python benchmarks/bench_ann.py --user <uid> --k 5 8 --quantize int8
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from langchain_chroma import Chroma
+from langchain_huggingface import HuggingFaceEmbeddings as SentenceTransformerEmbeddings
+
+from ann import QUANTIZATION_MODES, QuantizedSearch, QuantizedSnapshot, exact_search, hnsw_collection_metadata
+from note_index import load_active_collection
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure ANN recall and latency of note searches.")
+    parser.add_argument("--chroma-path", default=os.path.join(BACKEND_DIR, "chroma_db"))
+    parser.add_argument("--user", default=None, help="User id to benchmark (default: user with most chunks).")
+    parser.add_argument("--queries", default=None, help="File with one question per line.")
+    parser.add_argument("--num-queries", type=int, default=50,
+                        help="Queries sampled from the user's own chunks when --queries is not given.")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 8],
+                        help="Result sizes (search_notes uses 5, rag_query uses RAG_CANDIDATE_K).")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES[1:], default=None,
+                        help="Also measure search over the user's vectors quantized this way.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return parser.parse_args()
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1000.0, q)) if samples else 0.0
+
+
+def load_user_chunks(vectorstore, user_id):
+    data = vectorstore.get(where={"user_id": user_id}, include=["embeddings", "documents"])
+    return data["ids"], np.asarray(data["embeddings"], dtype=np.float32), data["documents"]
+
+
+def format_recall(recall):
+    return f"{recall:.3f}" if recall is not None else "n/a"
+
+
+def pick_user(vectorstore):
+    data = vectorstore.get(include=["metadatas"])
+    counts = {}
+    for metadata in data["metadatas"]:
+        user_id = (metadata or {}).get("user_id")
+        if user_id:
+            counts[user_id] = counts.get(user_id, 0) + 1
+    if not counts:
+        raise SystemExit("The active collection has no chunks to benchmark.")
+    return max(counts, key=counts.get)
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    settings = load_active_collection(args.chroma_path)
+    embedding_function = SentenceTransformerEmbeddings(model_name=settings["embedding_model_name"])
+    vectorstore = Chroma(
+        collection_name=settings["collection_name"],
+        persist_directory=args.chroma_path,
+        embedding_function=embedding_function,
+        collection_metadata=hnsw_collection_metadata(settings)
+    )
+
+    user_id = args.user or pick_user(vectorstore)
+    ids, vectors, documents = load_user_chunks(vectorstore, user_id)
+    print(f"Collection '{settings['collection_name']}', user {user_id}: {len(ids)} chunks, "
+          f"HNSW M={settings['hnsw_m']} ef_construction={settings['hnsw_construction_ef']} "
+          f"ef_search={settings['hnsw_search_ef']}")
+
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        # Short phrases from the user's own notes stand in for real questions
+        sample = random.sample(documents, min(args.num_queries, len(documents)))
+        queries = [" ".join(doc.split()[:12]) for doc in sample]
+
+    snapshot = QuantizedSnapshot.from_vectors(ids, [user_id] * len(ids), vectors, args.quantize) if args.quantize else None
+    quantized_search = QuantizedSearch(vectorstore._collection, args.quantize) if args.quantize else None
+    where = {"user_id": user_id}
+    results = {"collection": settings["collection_name"], "user_id": user_id, "chunks": len(ids),
+               "hnsw": {key: settings[key] for key in ("hnsw_m", "hnsw_construction_ef", "hnsw_search_ef")},
+               "queries": len(queries), "by_k": {}}
+
+    embed_times = []
+    query_vectors = []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.append(np.asarray(embedding_function.embed_query(query), dtype=np.float32))
+        embed_times.append(time.perf_counter() - started)
+
+    for k in args.k:
+        end_to_end, ann_times, exact_times = [], [], []
+        ann_recalls, snapshot_recalls, rescored_recalls, rescored_times = [], [], [], []
+        for query, query_vector in zip(queries, query_vectors):
+            started = time.perf_counter()
+            vectorstore.similarity_search(query=query, k=k, filter=where)
+            end_to_end.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            ann = vectorstore._collection.query(query_embeddings=[query_vector.tolist()], n_results=k, where=where)
+            ann_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            exact = {ids[i] for i in exact_search(vectors, query_vector, k)}
+            exact_times.append(time.perf_counter() - started)
+
+            if exact:
+                ann_recalls.append(len(exact & set(ann["ids"][0])) / len(exact))
+                if snapshot is not None:
+                    snapshot_recalls.append(len(exact & set(snapshot.search(query_vector, k, user_id))) / len(exact))
+                    started = time.perf_counter()
+                    rescored = quantized_search.search(query_vector, k, user_id)
+                    rescored_times.append(time.perf_counter() - started)
+                    rescored_recalls.append(len(exact & {chunk_id for chunk_id, _, _ in rescored}) / len(exact))
+
+        row = {
+            "similarity_search_p50_ms": percentile_ms(end_to_end, 50),
+            "similarity_search_p99_ms": percentile_ms(end_to_end, 99),
+            "hnsw_query_p50_ms": percentile_ms(ann_times, 50),
+            "hnsw_query_p99_ms": percentile_ms(ann_times, 99),
+            "exact_p50_ms": percentile_ms(exact_times, 50),
+            "hnsw_recall": float(np.mean(ann_recalls)) if ann_recalls else None
+        }
+        if snapshot is not None:
+            row["snapshot_mode"] = snapshot.mode
+            row["snapshot_recall"] = float(np.mean(snapshot_recalls)) if snapshot_recalls else None
+            row["rescored_p50_ms"] = percentile_ms(rescored_times, 50)
+            row["rescored_recall"] = float(np.mean(rescored_recalls)) if rescored_recalls else None
+        results["by_k"][k] = row
+
+        print(f"k={k}: similarity_search p50 {row['similarity_search_p50_ms']:.2f} ms / p99 {row['similarity_search_p99_ms']:.2f} ms | "
+              f"HNSW p50 {row['hnsw_query_p50_ms']:.2f} ms, recall {format_recall(row['hnsw_recall'])} | "
+              f"exact p50 {row['exact_p50_ms']:.2f} ms"
+              + (f" | {snapshot.mode} snapshot recall {format_recall(row['snapshot_recall'])}, rescored p50 "
+                 f"{row['rescored_p50_ms']:.2f} ms, recall {format_recall(row['rescored_recall'])}" if snapshot is not None else ""))
+
+    results["query_embedding_p50_ms"] = percentile_ms(embed_times, 50)
+    print(f"Query embedding p50 {results['query_embedding_p50_ms']:.2f} ms")
+    if snapshot is not None:
+        print(f"Quantized size: {snapshot.nbytes / 1e6:.2f} MB ({snapshot.mode}) vs "
+              f"{vectors.nbytes / 1e6:.2f} MB as float32")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
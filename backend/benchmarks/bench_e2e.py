@@ -0,0 +1,229 @@
+# backend/benchmarks/bench_e2e.py
+"""
+End-to-end benchmark of the upload, listing, search and RAG endpoints.
+
+The Flask app runs in-process with stubbed OpenAI/YouTube/Firebase clients and a local
+MongoDB stand-in (see stubs.py); embeddings, KeyBERT, chunking and ChromaDB are real.
+For every endpoint it reports p50/p99 latency, throughput and peak RSS at the requested
+concurrency, and stores the results under benchmarks/results/ keyed by git commit so runs
+can be compared between commits.
+
+Examples:
+    python benchmarks/bench_e2e.py --concurrency 4 --requests 40
+    python benchmarks/bench_e2e.py --compare benchmarks/results/<older>.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from stubs import install_stubs
+from synthetic import NOTE_SPECS, generate_notes
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+ENDPOINTS = ("upload-note", "my-notes", "notes-search", "rag-query")
+SEARCH_QUERIES = ["process scheduling", "page table", "context switch", "memory frames", "starvation"]
+RAG_QUESTIONS = ["What is round robin scheduling?", "What does the TLB cache?", "What is starvation?"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark NoteVerse API endpoints end to end.")
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint.")
+    parser.add_argument("--users", type=int, default=2, help="Distinct users the requests are spread over.")
+    parser.add_argument("--notes", nargs="+", default=list(NOTE_SPECS), choices=sorted(NOTE_SPECS),
+                        help="Synthetic note files cycled through by upload requests.")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated OpenAI latency per call.")
+    parser.add_argument("--youtube-latency-ms", type=float, default=0.0)
+    parser.add_argument("--mongo-uri", default=None, help="Use a real MongoDB instead of mongomock.")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per endpoint.")
+    parser.add_argument("--output", default=None, help="Result file (default: results/<commit>-<time>.json).")
+    parser.add_argument("--compare", default=None, help="Earlier result file to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent.")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Peak, not current, outside Linux
+
+
+class RssSampler:
+    """Samples the process RSS in the background to find the peak during one phase."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def make_request(app, endpoint, i, args, notes):
+    """Builds and sends request i for an endpoint. Returns the HTTP status code."""
+    user = f"bench-user-{i % args.users}"
+    headers = {"Authorization": f"Bearer {user}"}
+    client = app.test_client()
+    if endpoint == "upload-note":
+        name = args.notes[i % len(args.notes)]
+        data = {"noteImage": (io.BytesIO(notes[name]), f"{i}-{name}")}
+        response = client.post("/api/upload-note", data=data, headers=headers, content_type="multipart/form-data")
+    elif endpoint == "my-notes":
+        response = client.get("/api/my-notes", headers=headers)
+    elif endpoint == "notes-search":
+        response = client.get("/api/notes/search", query_string={"query": SEARCH_QUERIES[i % len(SEARCH_QUERIES)]},
+                              headers=headers)
+    else:
+        response = client.post("/api/rag-query", json={"question": RAG_QUESTIONS[i % len(RAG_QUESTIONS)]},
+                               headers=headers)
+    response.get_data()
+    return response.status_code
+
+
+def run_endpoint(app, endpoint, args, notes):
+    for i in range(args.warmup):
+        make_request(app, endpoint, i, args, notes)
+
+    latencies = []
+    statuses = {}
+
+    def timed(i):
+        started = time.perf_counter()
+        status = make_request(app, endpoint, i, args, notes)
+        return time.perf_counter() - started, status
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for latency, status in executor.map(timed, range(args.warmup, args.warmup + args.requests)):
+                latencies.append(latency)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        wall_seconds = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "p50_ms": percentile(latencies, 50) * 1000.0,
+        "p99_ms": percentile(latencies, 99) * 1000.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000.0,
+        "throughput_rps": args.requests / wall_seconds,
+        "peak_rss_mb": rss.peak / 1e6,
+        "statuses": statuses,
+    }
+
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nComparison with {baseline.get('commit')} ({os.path.basename(baseline_path)}):")
+    regressions = 0
+    for endpoint, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        for metric, higher_is_worse in (("p50_ms", True), ("p99_ms", True), ("throughput_rps", False),
+                                        ("peak_rss_mb", True)):
+            change = (result[metric] - before[metric]) / before[metric] * 100.0 if before[metric] else 0.0
+            worse = change > threshold if higher_is_worse else change < -threshold
+            regressions += worse
+            print(f"  {endpoint:13s} {metric:15s} {before[metric]:10.2f} -> {result[metric]:10.2f} "
+                  f"({change:+.1f}%){'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    work_dir = install_stubs(
+        llm_latency_seconds=args.llm_latency_ms / 1000.0,
+        youtube_latency_seconds=args.youtube_latency_ms / 1000.0,
+        mongo_uri=args.mongo_uri
+    )
+    print(f"Working directory: {work_dir}")
+    startup_started = time.perf_counter()
+    import app as app_module # Heavy: loads embedding/KeyBERT models
+    startup_seconds = time.perf_counter() - startup_started
+    notes = generate_notes(args.notes)
+
+    results = {
+        "commit": git_commit(),
+        "created": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "startup_seconds": startup_seconds,
+        "endpoints": {},
+    }
+    # Listing/search/RAG need data: make sure notes exist even if upload is not benchmarked
+    if "upload-note" not in args.endpoints:
+        for i in range(max(args.users, len(args.notes))):
+            make_request(app_module.app, "upload-note", i, args, notes)
+
+    for endpoint in args.endpoints:
+        result = run_endpoint(app_module.app, endpoint, args, notes)
+        results["endpoints"][endpoint] = result
+        print(f"{endpoint:13s} p50 {result['p50_ms']:9.1f} ms | p99 {result['p99_ms']:9.1f} ms | "
+              f"{result['throughput_rps']:7.2f} req/s | peak RSS {result['peak_rss_mb']:8.1f} MB | {result['statuses']}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}-{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# backend/benchmarks/bench_embeddings.py
+"""
+Embedding throughput of the PyTorch model against its ONNX exports (onnx_embeddings.py).
+
+For each backend (torch fp32, onnx fp32, onnx int8) and batch size it measures texts/s on
+note-like chunks, and reports the model file sizes, the resident memory after loading and
+how closely the ONNX embeddings match the PyTorch ones.
+
+Example:
+    python onnx_embeddings.py export --model paraphrase-multilingual-MiniLM-L12-v2
+    python benchmarks/bench_embeddings.py --batch-sizes 1 8 32 --output embeddings.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from note_index import load_active_collection
+from onnx_embeddings import CHECK_TEXTS, FP32_FILE, INT8_FILE, OnnxEncoder, compare_embeddings, default_model_dir
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare PyTorch and ONNX embedding throughput.")
+    parser.add_argument("--model", default=None, help="Embedding model (default: the active collection's).")
+    parser.add_argument("--model-dir", default=None, help="Exported ONNX model (default: onnx_models/<model>).")
+    parser.add_argument("--texts", default=None, help="File with one text per line (default: synthetic chunks).")
+    parser.add_argument("--num-texts", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--backends", nargs="+", choices=["torch", "onnx-fp32", "onnx-int8"],
+                        default=["torch", "onnx-fp32", "onnx-int8"])
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0: library default).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return parser.parse_args()
+
+
+def load_texts(path, count):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return (texts * (count // max(len(texts), 1) + 1))[:count]
+    # Chunks of a few note sentences each, of varied length like real chunks
+    return [" ".join(random.choices(CHECK_TEXTS[:-8], k=random.randint(1, 12))) for _ in range(count)]
+
+
+def rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def file_mb(path):
+    return os.path.getsize(path) / 1e6 if os.path.exists(path) else None
+
+
+def measure(encode, texts, batch_size):
+    encode(texts[:batch_size]) # Warm-up
+    started = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        encode(texts[start:start + batch_size])
+    seconds = time.perf_counter() - started
+    return {"batch_size": batch_size, "texts_per_second": round(len(texts) / seconds, 1),
+            "ms_per_text": round(seconds * 1000.0 / len(texts), 3)}
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    model_name = args.model or load_active_collection(os.path.join(BACKEND_DIR, "chroma_db"))["embedding_model_name"]
+    model_dir = args.model_dir or default_model_dir(model_name)
+    texts = load_texts(args.texts, args.num_texts)
+
+    results = {"model": model_name, "model_dir": model_dir, "num_texts": len(texts), "backends": {},
+               "file_mb": {"onnx-fp32": file_mb(os.path.join(model_dir, FP32_FILE)),
+                           "onnx-int8": file_mb(os.path.join(model_dir, INT8_FILE))}}
+    reference = None
+    for backend in args.backends:
+        rss_before = rss_mb()
+        if backend == "torch":
+            import torch
+            from sentence_transformers import SentenceTransformer
+            if args.threads:
+                torch.set_num_threads(args.threads)
+            model = SentenceTransformer(model_name, device="cpu")
+            encode = lambda batch, model=model: model.encode(batch, batch_size=len(batch), show_progress_bar=False)
+        else:
+            encoder = OnnxEncoder(model_dir, quantized=backend == "onnx-int8", threads=args.threads)
+            if backend == "onnx-int8" and not encoder.quantized:
+                print("Skipping onnx-int8: the model directory has no usable int8 model.")
+                continue
+            encode = lambda batch, encoder=encoder: encoder.encode(batch, batch_size=len(batch))
+        entry = {"rss_increase_mb": round(rss_mb() - rss_before, 1),
+                 "runs": [measure(encode, texts, batch_size) for batch_size in args.batch_sizes]}
+
+        embeddings = np.asarray(encode(CHECK_TEXTS), dtype=np.float32)
+        if backend == "torch":
+            reference = embeddings
+        elif reference is not None:
+            entry["accuracy"] = compare_embeddings(reference, embeddings)
+        results["backends"][backend] = entry
+
+        print(f"{backend}: +{entry['rss_increase_mb']:.0f} MB RSS")
+        for run in entry["runs"]:
+            print(f"  batch {run['batch_size']:>3}: {run['texts_per_second']:8.1f} texts/s "
+                  f"({run['ms_per_text']:.2f} ms/text)")
+        if "accuracy" in entry:
+            print(f"  vs torch: min cosine {entry['accuracy']['min_cosine']:.4f}, "
+                  f"top-10 overlap {entry['accuracy']['neighbour_overlap']:.3f}")
+    for backend, size in results["file_mb"].items():
+        if size is not None:
+            print(f"{backend} model file: {size:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# backend/benchmarks/bench_json.py
+"""
+Bytes and CPU per response for the JSON serialization and compression of API responses.
+
+Builds the response bodies of the note detail (full note document), note listing and quiz
+routes from synthetic notes, then compares:
+- serializers: the standard json module as Flask's default provider uses it (sorted keys,
+  ASCII escapes, ObjectIds converted by hand) against serialization.dumps_bytes()
+- encodings: identity, gzip and brotli (if installed) on the serialized body
+
+Example:
+    python benchmarks/bench_json.py --text-kb 40 --notes 200 --repeat 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from bson.objectid import ObjectId
+
+import serialization
+from serialization import compress, dumps_bytes
+from stubs import SYNTHETIC_PAGE_TEXT
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure JSON serialization and compression of API responses.")
+    parser.add_argument("--text-kb", type=int, default=40, help="Extracted text size of the detailed note.")
+    parser.add_argument("--notes", type=int, default=200, help="Notes in the listing response.")
+    parser.add_argument("--repeat", type=int, default=100, help="Timed repetitions per measurement.")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return parser.parse_args()
+
+
+def note_text(kilobytes):
+    text, page = "", 1
+    while len(text) < kilobytes * 1024:
+        text += SYNTHETIC_PAGE_TEXT.format(page=page) + "\n\n"
+        page += 1
+    return text[:kilobytes * 1024]
+
+
+def sample_payloads(text_kb, notes):
+    text = note_text(text_kb)
+    note = {
+        "_id": ObjectId(), "user_id": "bench-user", "original_filename": "lecture-07.pdf",
+        "storage_key": "originals/ab/cd/abcd.pdf", "thumbnail_key": "thumbnails/ab/cd/abcd_320.jpg",
+        "extracted_text": text, "raw_ocr_text": text, "upload_date": time.time(), "tags": [],
+        "topics": ["scheduling", "process", "memory", "paging", "kernel", "threads", "deadlock"],
+        "resource_links": [], "page_offsets": list(range(0, len(text), 2400)), "chunk_count": len(text) // 500,
+        "content_sha256": "ab" * 32, "file_size": 2 * 1024 * 1024
+    }
+    listing = [{
+        "id": ObjectId(), "filename": f"note-{i}.pdf", "preview_text": text[:200] + "...",
+        "upload_date": time.time() - i * 3600, "topics": note["topics"],
+        "thumbnail_url": f"/api/notes/{ObjectId()}/thumbnail"
+    } for i in range(notes)]
+    quiz = {
+        "_id": ObjectId(), "note_id": note["_id"], "user_id": "bench-user", "generation_date": time.time(),
+        "quiz_questions": [{
+            "question": f"Which statement about topic {i} is correct?",
+            "options": [f"Option {j} for question {i}" for j in range(4)],
+            "correct_answer": f"Option 2 for question {i}"
+        } for i in range(5)]
+    }
+    return {
+        "note-detail": {"message": "Note retrieved successfully.", "notes": [note]},
+        "my-notes": {"message": "Notes retrieved successfully.", "notes": listing},
+        "quiz": {"message": "Quiz retrieved successfully.", "quiz": quiz},
+    }
+
+
+def stringify_ids(value):
+    """What the routes did before the JSON provider: ObjectIds converted by hand."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: stringify_ids(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [stringify_ids(item) for item in value]
+    return value
+
+
+def baseline_dumps(payload):
+    # Flask's DefaultJSONProvider: json.dumps with sorted keys and ASCII escapes
+    return json.dumps(stringify_ids(payload), sort_keys=True, ensure_ascii=True).encode("utf-8")
+
+
+def time_per_call_us(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    args = parse_args()
+    encodings = ["gzip"] + (["br"] if serialization.brotli is not None else [])
+    results = {"orjson": serialization.orjson is not None, "brotli": serialization.brotli is not None, "payloads": {}}
+    print(f"orjson: {'yes' if results['orjson'] else 'no (json fallback)'}, brotli: {'yes' if results['brotli'] else 'no'}")
+    print(f"{'payload':<12} {'serializer':<10} {'bytes':>10} {'serialize us':>13} " +
+          " ".join(f"{encoding + ' bytes':>11} {encoding + ' us':>9}" for encoding in encodings))
+    for name, payload in sample_payloads(args.text_kb, args.notes).items():
+        rows = {}
+        for serializer, dumps in (("baseline", baseline_dumps), ("fast", dumps_bytes)):
+            body = dumps(payload)
+            row = {"bytes": len(body), "serialize_us": time_per_call_us(lambda: dumps(payload), args.repeat)}
+            for encoding in encodings:
+                row[f"{encoding}_bytes"] = len(compress(body, encoding))
+                row[f"{encoding}_us"] = time_per_call_us(lambda: compress(body, encoding), max(1, args.repeat // 4))
+            rows[serializer] = row
+            print(f"{name:<12} {serializer:<10} {row['bytes']:>10} {row['serialize_us']:>13.1f} " +
+                  " ".join(f"{row[encoding + '_bytes']:>11} {row[encoding + '_us']:>9.1f}" for encoding in encodings))
+        results["payloads"][name] = rows
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# backend/benchmarks/fake_upstreams.py
+"""
+Local fake OpenAI and YouTube Data API servers with injectable latency and failures, for
+exercising the outbound clients (upstreams.py): timeouts, retries, circuit breakers and
+cached/degraded results.
+
+Serves POST /v1/chat/completions (canned vision, quiz and RAG answers, as stubs.py) and
+GET /youtube/v3/search. Point the API at it with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 YOUTUBE_API_ENDPOINT=http://127.0.0.1:8099
+
+Examples:
+    python benchmarks/fake_upstreams.py --latency 0.2
+    python benchmarks/fake_upstreams.py --error-rate 0.3 --hang-rate 0.05 --hang-seconds 120
+    python benchmarks/fake_upstreams.py --outage-start 30 --outage-seconds 60
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from stubs import SYNTHETIC_PAGE_TEXT, SYNTHETIC_QUIZ
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fake OpenAI and YouTube servers with injectable failures.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction answered with 429 + Retry-After.")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests that hang.")
+    parser.add_argument("--hang-seconds", type=float, default=120.0, help="How long a hanging request hangs.")
+    parser.add_argument("--outage-start", type=float, default=None,
+                        help="Seconds after start when every request starts failing with 503.")
+    parser.add_argument("--outage-seconds", type=float, default=60.0, help="Length of the outage.")
+    return parser.parse_args()
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+    settings = None
+    started = time.monotonic()
+    page_counter = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_failure(self):
+        """Sends an injected failure and returns True, or returns False to answer normally."""
+        settings = self.settings
+        elapsed = time.monotonic() - self.started
+        if settings.outage_start is not None and settings.outage_start <= elapsed < settings.outage_start + settings.outage_seconds:
+            self._send_json(503, {"error": {"message": "Injected outage", "type": "server_error"}})
+            return True
+        if settings.latency:
+            time.sleep(settings.latency)
+        roll = random.random()
+        if roll < settings.hang_rate:
+            time.sleep(settings.hang_seconds)
+        elif roll < settings.hang_rate + settings.error_rate:
+            self._send_json(503, {"error": {"message": "Injected failure", "type": "server_error"}})
+            return True
+        elif roll < settings.hang_rate + settings.error_rate + settings.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "Injected rate limit", "type": "rate_limit_error"}},
+                            {"Retry-After": "1"})
+            return True
+        return False
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if urlparse(self.path).path != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        if self._inject_failure():
+            return
+        messages = request.get("messages") or []
+        last_content = messages[-1]["content"] if messages else ""
+        if isinstance(last_content, list): # Vision request (text + image parts)
+            with self.lock:
+                FakeUpstreamHandler.page_counter += 1
+                content = SYNTHETIC_PAGE_TEXT.format(page=FakeUpstreamHandler.page_counter)
+        elif (request.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({"quiz": SYNTHETIC_QUIZ})
+        else:
+            content = "Round robin gives every process a fixed time quantum."
+        prompt_tokens = max(1, len(json.dumps(messages)) // 4)
+        completion_tokens = max(1, len(content) // 4)
+        self._send_json(200, {
+            "id": f"chatcmpl-fake-{time.time_ns()}", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/youtube/v3/search":
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        if self._inject_failure():
+            return
+        query = parse_qs(url.query)
+        q = query.get("q", [""])[0]
+        self._send_json(200, {"kind": "youtube#searchListResponse", "items": [{
+            "id": {"kind": "youtube#video", "videoId": f"video{i}"},
+            "snippet": {"title": f"{q} #{i}", "description": "Synthetic result",
+                        "thumbnails": {"high": {"url": f"https://example.invalid/{i}.jpg"}}}
+        } for i in range(int(query.get("maxResults", ["5"])[0]))]})
+
+
+def main():
+    args = parse_args()
+    FakeUpstreamHandler.settings = args
+    FakeUpstreamHandler.started = time.monotonic()
+    server = ThreadingHTTPServer((args.host, args.port), FakeUpstreamHandler)
+    server.daemon_threads = True
+    print(f"Fake upstreams on http://{args.host}:{args.port} "
+          f"(OPENAI_BASE_URL=http://{args.host}:{args.port}/v1, YOUTUBE_API_ENDPOINT=http://{args.host}:{args.port})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# backend/benchmarks/stubs.py
+"""
+Local stand-ins for the external services app.py talks to, so the API can be benchmarked
+offline: Firebase auth, the OpenAI API, the YouTube Data API and MongoDB (via mongomock).
+
+install_stubs() must run before `import app`. Embedding/KeyBERT models and ChromaDB stay real,
+since their CPU cost is part of what the benchmark measures.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+SYNTHETIC_PAGE_TEXT = """# Operating Systems - Lecture {page}
+
+PROCESS SCHEDULING
+A process scheduler decides which ready process runs next on the CPU. Round robin gives every
+process a fixed time quantum, while shortest job first minimises the average waiting time.
+
+Key terms:
+- context switch: saving and restoring the state of a process
+- starvation: a process waits indefinitely because others are always preferred
+- throughput: number of processes completed per unit of time
+
+MEMORY MANAGEMENT
+Paging divides memory into fixed-size frames and processes into pages. The page table maps
+virtual pages to physical frames; a TLB caches recent translations to avoid extra lookups.
+"""
+
+SYNTHETIC_QUIZ = [
+    {"question": "Which scheduling algorithm gives every process a fixed time quantum?",
+     "options": ["Round robin", "Shortest job first", "FIFO", "Priority"], "correct_answer": "Round robin"},
+    {"question": "What does a TLB cache?",
+     "options": ["Page translations", "Disk blocks", "Process states", "Interrupts"],
+     "correct_answer": "Page translations"},
+    {"question": "What is starvation?",
+     "options": ["Indefinite waiting", "A deadlock", "A page fault", "A context switch"],
+     "correct_answer": "Indefinite waiting"},
+]
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content):
+        self.message = _Message(content)
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class _Completion:
+    def __init__(self, content, prompt_chars):
+        self.choices = [_Choice(content)]
+        self.usage = _Usage(max(1, prompt_chars // 4), max(1, len(content) // 4))
+
+
+class FakeChatCompletions:
+    """Answers vision, quiz and RAG prompts with canned content after a simulated latency."""
+
+    def __init__(self, latency_seconds):
+        self.latency_seconds = latency_seconds
+        self._page_counter = 0
+        self._lock = threading.Lock()
+
+    def create(self, model=None, messages=None, response_format=None, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        prompt_chars = sum(len(json.dumps(message.get("content"))) for message in messages or [])
+        last_content = messages[-1]["content"] if messages else ""
+        if isinstance(last_content, list): # Vision request (text + image parts)
+            with self._lock:
+                self._page_counter += 1
+                page = self._page_counter
+            return _Completion(SYNTHETIC_PAGE_TEXT.format(page=page), prompt_chars)
+        if response_format and response_format.get("type") == "json_object":
+            return _Completion(json.dumps({"quiz": SYNTHETIC_QUIZ}), prompt_chars)
+        return _Completion("Round robin gives every process a fixed time quantum.", prompt_chars)
+
+
+class FakeOpenAI:
+    def __init__(self, api_key=None, latency_seconds=0.0, **kwargs):
+        self.chat = types.SimpleNamespace(completions=FakeChatCompletions(latency_seconds))
+
+
+class _FakeYouTubeRequest:
+    def __init__(self, query, latency_seconds):
+        self.query = query
+        self.latency_seconds = latency_seconds
+
+    def execute(self, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return {"items": [{
+            "id": {"videoId": f"video{i}"},
+            "snippet": {"title": f"{self.query} #{i}", "description": "Synthetic result",
+                        "thumbnails": {"high": {"url": f"https://example.invalid/{i}.jpg"}}}
+        } for i in range(5)]}
+
+
+class FakeYouTube:
+    def __init__(self, latency_seconds):
+        self.latency_seconds = latency_seconds
+
+    def search(self):
+        return types.SimpleNamespace(list=lambda q=None, **kwargs: _FakeYouTubeRequest(q, self.latency_seconds))
+
+
+def _fake_verify_id_token(id_token, *args, **kwargs):
+    # Benchmark clients send "Bearer <uid>"; the token itself is the user id
+    return {"uid": id_token, "email": f"{id_token}@bench.local"}
+
+
+def install_stubs(work_dir=None, llm_latency_seconds=0.0, youtube_latency_seconds=0.0, mongo_uri=None):
+    """
+    Installs the stand-ins and points app.py's data directories at work_dir.
+    A real MongoDB is used when mongo_uri is given, mongomock otherwise.
+    Returns the work directory.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="noteverse-bench-")
+    key_path = os.path.join(work_dir, "serviceAccountKey.json")
+    with open(key_path, 'w') as f:
+        json.dump({"type": "service_account"}, f)
+
+    os.environ.update({
+        "FIREBASE_SERVICE_ACCOUNT_KEY_PATH": key_path,
+        "OPENAI_API_KEY": "bench",
+        "YOUTUBE_API_KEY": "bench",
+        "MONGO_URI": mongo_uri or "mongodb://bench.local:27017",
+        "MONGO_DB_NAME": "NoteVerseBench",
+        "UPLOAD_FOLDER": os.path.join(work_dir, "uploads"),
+        "CHROMA_DB_PATH": os.path.join(work_dir, "chroma_db"),
+    })
+
+    # Firebase Admin SDK
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firebase_admin.credentials = types.SimpleNamespace(Certificate=lambda path: path)
+    firebase_admin.auth = types.SimpleNamespace(verify_id_token=_fake_verify_id_token)
+    sys.modules["firebase_admin"] = firebase_admin
+    sys.modules["firebase_admin.credentials"] = firebase_admin.credentials
+    sys.modules["firebase_admin.auth"] = firebase_admin.auth
+
+    # OpenAI and YouTube clients
+    import openai
+    openai.OpenAI = lambda api_key=None, **kwargs: FakeOpenAI(api_key, llm_latency_seconds)
+    import googleapiclient.discovery
+    googleapiclient.discovery.build = lambda *args, **kwargs: FakeYouTube(youtube_latency_seconds)
+
+    # EasyOCR is loaded at startup but not used by the measured paths; skip its model download
+    import easyocr
+    easyocr.Reader = lambda *args, **kwargs: types.SimpleNamespace(readtext=lambda image: [])
+
+    if not mongo_uri:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("mongomock is required for the local Mongo stand-in: pip install mongomock "
+                             "(or pass --mongo-uri to benchmark against a real MongoDB).")
+
+        class LocalMongoClient(mongomock.MongoClient):
+            @property
+            def admin(self):
+                # Answers the startup ping app.py sends
+                return types.SimpleNamespace(command=lambda *args, **kwargs: {"ok": 1.0})
+
+        import pymongo
+        pymongo.MongoClient = LocalMongoClient
+
+    return work_dir
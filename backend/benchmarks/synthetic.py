@@ -0,0 +1,77 @@
+# backend/benchmarks/synthetic.py
+"""Synthetic note files for benchmarks: typed PDFs and scanned-looking images/PDFs of various sizes."""
+import io
+import random
+
+import fitz # PyMuPDF
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from stubs import SYNTHETIC_PAGE_TEXT
+
+# name -> (kind, pages)
+NOTE_SPECS = {
+    "typed-1p.pdf": ("typed_pdf", 1),
+    "typed-5p.pdf": ("typed_pdf", 5),
+    "typed-20p.pdf": ("typed_pdf", 20),
+    "scan-1p.jpg": ("scan_image", 1),
+    "scan-1p.png": ("scan_image", 1),
+    "scan-3p.pdf": ("scan_pdf", 3),
+}
+A4_300_DPI = (2480, 3508)
+
+
+def typed_pdf(pages):
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(56, 56, 540, 790), SYNTHETIC_PAGE_TEXT.format(page=page_number), fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def scan_page(page_number, seed, size=A4_300_DPI):
+    """A page of dark text on an off-white, noisy, slightly rotated background."""
+    rng = random.Random(seed)
+    image = Image.new("L", size, 235)
+    draw = ImageDraw.Draw(image)
+    y = 150
+    for line in SYNTHETIC_PAGE_TEXT.format(page=page_number).splitlines():
+        draw.text((180 + rng.randint(-6, 6), y), line, fill=rng.randint(20, 60))
+        y += 60
+    noise = np.random.default_rng(seed).normal(0, 12, (size[1], size[0]))
+    image = Image.fromarray(np.clip(np.asarray(image, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+    image = image.filter(ImageFilter.GaussianBlur(0.6))
+    return image.rotate(rng.uniform(-2.0, 2.0), fillcolor=235, expand=False).convert("RGB")
+
+
+def scan_image(pages, extension, seed=0):
+    buffer = io.BytesIO()
+    image = scan_page(1, seed)
+    if extension == "png":
+        image.save(buffer, "PNG")
+    else:
+        image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def scan_pdf(pages, seed=0):
+    images = [scan_page(page_number, seed + page_number) for page_number in range(1, pages + 1)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, "PDF", resolution=300, save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+def generate_notes(names=None):
+    """Returns {filename: bytes} for the requested synthetic notes (all by default)."""
+    notes = {}
+    for name in names or NOTE_SPECS:
+        kind, pages = NOTE_SPECS[name]
+        if kind == "typed_pdf":
+            notes[name] = typed_pdf(pages)
+        elif kind == "scan_image":
+            notes[name] = scan_image(pages, name.rsplit(".", 1)[-1])
+        else:
+            notes[name] = scan_pdf(pages)
+    return notes
@@ -0,0 +1,270 @@
+# backend/evaluate.py
+"""
+Offline evaluation of the ingestion pipeline against the Ground_Truth corpus.
+
+Every note file in the input folder that has a `<name>_text.txt` / `<name>_keywords.txt`
+ground truth is run through one or more pipeline configurations in a process pool. Each run
+records per-stage latency next to OCR accuracy, CER and WER (computed in the worker). Keyword
+precision/recall/F1 is computed for all runs at once at the end (batch_metrics), with exact,
+lemmatized or fuzzy keyword matching. The whole evaluation is written as one CSV and one JSON
+report to Evaluation_Results/.
+
+By default it evaluates the production configuration (vision model on preprocessed pages)
+against the same model on unprocessed pages, and reports the payload size ratio and the
+accuracy, CER/WER and keyword F1 deltas between the two: the check that preprocessing
+(on by default, VISION_PREPROCESS) saves bytes without losing accuracy.
+
+Example:
+    python evaluate.py --config 2-vision-llm 3-easyocr-llm-cleanup --workers 4 --keyword-match lemma
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import pipeline
+from batch_metrics import character_error_rate, word_error_rate, keyword_metrics_batch
+from evaluation import get_ground_truth
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+GROUND_TRUTH_FOLDER = os.path.join(BACKEND_DIR, 'Ground_Truth')
+RESULTS_FOLDER = os.path.join(BACKEND_DIR, 'Evaluation_Results')
+
+# Pipeline configurations (the numbered "Combinations" of the original experiments)
+PIPELINE_CONFIGS = {
+    "1-easyocr": {"extractor": "easyocr", "cleanup_model": None},
+    "2-vision-llm": {"extractor": "vision", "vision_model": "gpt-4o-mini"},
+    "3-easyocr-llm-cleanup": {"extractor": "easyocr", "cleanup_model": "gpt-3.5-turbo"},
+    # Vision LLM on deskewed, cropped, grayscale, downscaled pages (pipeline.DEFAULT_PREPROCESS)
+    "4-vision-llm-preprocessed": {"extractor": "vision", "vision_model": "gpt-4o-mini", "preprocess": True},
+}
+DEFAULT_CONFIG = "4-vision-llm-preprocessed" # What upload_note runs in production (VISION_PREPROCESS=true)
+BASELINE_CONFIG = "2-vision-llm" # The same model on unprocessed pages, which preprocessing must match
+
+STAGES = ("rasterize", "extract", "cleanup", "keywords")
+REPORT_FIELDS = (
+    ["config", "filename", "status", "error", "pages", "payload_bytes", "ocr_accuracy", "cer", "wer",
+     "keyword_precision", "keyword_recall", "keyword_f1"]
+    + [f"{stage}_seconds" for stage in STAGES] + ["total_seconds", "keywords"]
+)
+
+# Models are loaded once per worker process, on first use
+_worker_models = {}
+
+
+def _get_model(name):
+    if name not in _worker_models:
+        if name == "openai":
+            from openai import OpenAI
+            _worker_models[name] = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        elif name == "keywords":
+            from keybert import KeyBERT
+            from keywords import KEYWORD_MODEL_NAME, KeywordExtractor
+            _worker_models[name] = KeywordExtractor(KeyBERT(model=KEYWORD_MODEL_NAME))
+        elif name == "easyocr":
+            import easyocr
+            _worker_models[name] = easyocr.Reader(['en', 'hi'], gpu=False)
+    return _worker_models[name]
+
+
+def evaluate_file(file_path, config_name, ground_truth_folder):
+    """Runs one file through one pipeline configuration. Never raises: errors end up in the row."""
+    config = PIPELINE_CONFIGS[config_name]
+    filename = os.path.basename(file_path)
+    row = {"config": config_name, "filename": filename, "status": "ok", "error": ""}
+    timings = dict.fromkeys(STAGES, 0.0)
+    started = time.perf_counter()
+    text = ""
+    keywords = []
+    try:
+        stage_started = time.perf_counter()
+        if config["extractor"] == "vision" and config.get("preprocess"):
+            images = pipeline.file_to_vision_pages(file_path, pipeline.DEFAULT_PREPROCESS)
+        elif config["extractor"] == "vision":
+            images = pipeline.file_to_base64_images(file_path)
+        else:
+            images = pipeline.file_to_rgb_images(file_path)
+        timings["rasterize"] = time.perf_counter() - stage_started
+        row["pages"] = len(images)
+        if config["extractor"] == "vision":
+            row["payload_bytes"] = pipeline.payload_bytes(images)
+
+        stage_started = time.perf_counter()
+        if config["extractor"] == "vision":
+            pages = pipeline.extract_text_with_vision(_get_model("openai"), images, model=config["vision_model"])
+        else:
+            pages = pipeline.extract_text_with_easyocr(_get_model("easyocr"), images)
+        text = "\n\n".join(pages)
+        timings["extract"] = time.perf_counter() - stage_started
+
+        if config.get("cleanup_model") and len(text.strip()) > 50:
+            stage_started = time.perf_counter()
+            text = pipeline.clean_text_with_llm(_get_model("openai"), text, model=config["cleanup_model"]) or text
+            timings["cleanup"] = time.perf_counter() - stage_started
+
+        if len(text.strip()) > 50:
+            stage_started = time.perf_counter()
+            keywords = _get_model("keywords").extract(text)
+            timings["keywords"] = time.perf_counter() - stage_started
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = str(e)
+
+    ground_truth_text, ground_truth_keywords = get_ground_truth(ground_truth_folder, filename)
+    row["cer"] = character_error_rate(ground_truth_text, text)
+    row["wer"] = word_error_rate(ground_truth_text, text)
+    row["ocr_accuracy"] = (1.0 - row["cer"]) * 100 if row["cer"] is not None else None
+    row["ground_truth_keywords"] = ground_truth_keywords # Scored in batch by add_keyword_metrics()
+    row["extracted_keywords"] = keywords
+    row.update({f"{stage}_seconds": seconds for stage, seconds in timings.items()})
+    row["total_seconds"] = time.perf_counter() - started
+    row["keywords"] = ", ".join(keywords)
+    return row
+
+
+def find_inputs(input_folder, ground_truth_folder):
+    """Note files in input_folder that have a ground truth text file."""
+    inputs = []
+    for name in sorted(os.listdir(input_folder)):
+        base_name, extension = os.path.splitext(name)
+        if extension.lower() not in pipeline.SUPPORTED_EXTENSIONS:
+            continue
+        if os.path.exists(os.path.join(ground_truth_folder, f"{base_name}_text.txt")):
+            inputs.append(os.path.join(input_folder, name))
+    return inputs
+
+
+def add_keyword_metrics(rows, match="exact"):
+    """Keyword precision/recall/F1 for all rows in one vectorized pass. Returns micro averages per config."""
+    micro = {}
+    for config_name in sorted({row["config"] for row in rows}):
+        config_rows = [row for row in rows if row["config"] == config_name]
+        metrics = keyword_metrics_batch(
+            [row.pop("ground_truth_keywords") for row in config_rows],
+            [row.pop("extracted_keywords") for row in config_rows],
+            match=match
+        )
+        for i, row in enumerate(config_rows):
+            for name in ("precision", "recall", "f1"):
+                value = float(metrics[name][i])
+                row[f"keyword_{name}"] = None if value != value else value # NaN (no ground truth) -> None
+        micro[config_name] = metrics["micro"]
+    return micro
+
+
+def summarize(rows, keyword_micro=None):
+    """Mean metrics and latency percentiles per configuration."""
+    summary = {}
+    for config_name in sorted({row["config"] for row in rows}):
+        config_rows = [row for row in rows if row["config"] == config_name]
+        entry = {"files": len(config_rows), "errors": sum(row["status"] != "ok" for row in config_rows)}
+        for metric in ("payload_bytes", "ocr_accuracy", "cer", "wer", "keyword_precision", "keyword_recall", "keyword_f1"):
+            values = [row[metric] for row in config_rows if row.get(metric) is not None]
+            entry[f"mean_{metric}"] = statistics.fmean(values) if values else None
+        if keyword_micro and config_name in keyword_micro:
+            entry.update({f"micro_keyword_{name}": value for name, value in keyword_micro[config_name].items()})
+        for stage in list(STAGES) + ["total"]:
+            values = sorted(row[f"{stage}_seconds"] for row in config_rows)
+            entry[f"{stage}_p50_seconds"] = statistics.median(values) if values else None
+            entry[f"{stage}_max_seconds"] = values[-1] if values else None
+        summary[config_name] = entry
+    return summary
+
+
+def compare(summary, baseline=BASELINE_CONFIG):
+    """
+    Per configuration, the change of its mean payload size, accuracy, CER/WER and keyword F1
+    against the baseline configuration (when both were evaluated).
+    """
+    if baseline not in summary:
+        return {}
+    reference = summary[baseline]
+    comparison = {}
+    for config_name, entry in summary.items():
+        if config_name == baseline:
+            continue
+        deltas = {}
+        for metric in ("ocr_accuracy", "cer", "wer", "keyword_f1"):
+            value, base = entry[f"mean_{metric}"], reference[f"mean_{metric}"]
+            deltas[f"{metric}_delta"] = value - base if value is not None and base is not None else None
+        value, base = entry["mean_payload_bytes"], reference["mean_payload_bytes"]
+        deltas["payload_ratio"] = value / base if value is not None and base else None
+        comparison[config_name] = deltas
+    return comparison
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate ingestion pipeline configurations against Ground_Truth.")
+    parser.add_argument("--config", nargs="+", default=[BASELINE_CONFIG, DEFAULT_CONFIG],
+                        choices=sorted(PIPELINE_CONFIGS), help="Pipeline configuration(s) to evaluate (default: production against its baseline).")
+    parser.add_argument("--inputs", default=GROUND_TRUTH_FOLDER,
+                        help="Folder with the note files (default: the Ground_Truth folder).")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_FOLDER)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--keyword-match", default="exact", choices=("exact", "lemma", "fuzzy"),
+                        help="How extracted keywords are matched against the ground truth.")
+    parser.add_argument("--output", default=None,
+                        help="Report path without extension (default: Evaluation_Results/evaluation_<time>).")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    load_dotenv()
+
+    inputs = find_inputs(args.inputs, args.ground_truth)
+    if not inputs:
+        raise SystemExit(f"No note files with ground truth found in {args.inputs}.")
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_FOLDER, f"evaluation_{time.strftime('%Y%m%d_%H%M%S')}")
+
+    jobs = [(file_path, config_name) for config_name in args.config for file_path in inputs]
+    print(f"Evaluating {len(inputs)} file(s) x {len(args.config)} configuration(s) with {args.workers} worker(s)...")
+    started = time.perf_counter()
+    rows = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(evaluate_file, file_path, config_name, args.ground_truth)
+                   for file_path, config_name in jobs]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            accuracy = f"{row['ocr_accuracy']:.2f}%" if row["ocr_accuracy"] is not None else "n/a"
+            print(f"[{len(rows)}/{len(jobs)}] {row['config']} {row['filename']}: {row['status']}, "
+                  f"accuracy {accuracy}, {row['total_seconds']:.1f}s")
+    rows.sort(key=lambda row: (row["config"], row["filename"]))
+    keyword_micro = add_keyword_metrics(rows, match=args.keyword_match)
+
+    with open(output + ".csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    summary = summarize(rows, keyword_micro)
+    comparison = compare(summary)
+    with open(output + ".json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "created": time.time(),
+            "configs": {name: PIPELINE_CONFIGS[name] for name in args.config},
+            "keyword_match": args.keyword_match,
+            "wall_seconds": time.perf_counter() - started,
+            "summary": summary,
+            "comparison": {"baseline": BASELINE_CONFIG, "configs": comparison},
+            "results": rows
+        }, f, indent=2)
+
+    for config_name, entry in summary.items():
+        print(f"{config_name}: accuracy {entry['mean_ocr_accuracy']}, F1 {entry['mean_keyword_f1']}, "
+              f"p50 total {entry['total_p50_seconds']:.2f}s ({entry['errors']} errors)")
+    for config_name, deltas in comparison.items():
+        print(f"{config_name} vs {BASELINE_CONFIG}: " + ", ".join(
+            f"{name} {value:+.4f}" if name.endswith("_delta") else f"{name} {value:.3f}"
+            for name, value in deltas.items() if value is not None))
+    print(f"Reports saved to {output}.csv and {output}.json")
+
+
+if __name__ == "__main__":
+    main()
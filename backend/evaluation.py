@@ -0,0 +1,30 @@
+# backend/evaluation.py
+"""Ground truth loading for the offline evaluator (evaluate.py); the metrics are in batch_metrics.py."""
+import os
+
+
+def get_ground_truth(ground_truth_folder, original_filename):
+    """
+    Retrieves ground truth text and keywords for a given filename.
+    Assumes files are named: <filename>_text.txt and <filename>_keywords.txt
+    Missing files give an empty text / keyword list.
+    """
+    base_name = os.path.splitext(original_filename)[0]
+
+    text_path = os.path.join(ground_truth_folder, f"{base_name}_text.txt")
+    keywords_path = os.path.join(ground_truth_folder, f"{base_name}_keywords.txt")
+
+    ground_truth_text = ""
+    ground_truth_keywords = []
+
+    if os.path.exists(text_path):
+        with open(text_path, 'r', encoding='utf-8') as f:
+            ground_truth_text = f.read().strip()
+
+    if os.path.exists(keywords_path):
+        with open(keywords_path, 'r', encoding='utf-8') as f:
+            keyword_line = f.read().strip()
+            # Split by comma and strip whitespace from each keyword
+            ground_truth_keywords = [k.strip() for k in keyword_line.split(',') if k.strip()]
+
+    return ground_truth_text, ground_truth_keywords
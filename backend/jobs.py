@@ -0,0 +1,272 @@
+# backend/jobs.py
+"""
+MongoDB-backed job queue for ingestion work.
+
+API servers enqueue jobs; any number of worker processes (worker.py) on any number of nodes
+claim them. A claim is an atomic find_one_and_update that sets a lease; the worker renews
+the lease while it works, and a job whose lease expires (crashed or stuck worker) becomes
+claimable again. Failed jobs are retried with exponential backoff and jitter up to
+max_attempts, then dead-lettered (status "dead") with their last error. Dead-lettered and
+failed jobs keep what they reference (an ingest job's stored upload) so they can be requeued,
+until purge() removes them.
+
+Per-user fairness: every job records `user_rank`, the number of unfinished jobs the same user
+already had when it was enqueued. Workers claim by (user_rank, created_at), so every user's
+first job runs before anyone's second job, and one user uploading a whole semester of notes
+does not hold everyone else back.
+"""
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+from observability import Counter, Histogram, get_logger, register
+
+logger = get_logger("jobs")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, DEAD = "queued", "running", "succeeded", "failed", "dead"
+UNFINISHED = (QUEUED, RUNNING)
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 10.0
+RETRY_MAX_SECONDS = 600.0
+
+JOBS_TOTAL = register(Counter(
+    "noteverse_jobs_total", "Queue jobs by type and outcome.", ["type", "outcome"]
+))
+JOB_WAIT_SECONDS = register(Histogram(
+    "noteverse_job_wait_seconds", "Time jobs spent queued before a worker claimed them.", ["type"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+))
+
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix (e.g. an invalid file): fails without retry."""
+
+
+class DeferJob(Exception):
+    """A job that cannot run yet (e.g. its user's token budget is spent): runs again after `delay` seconds."""
+
+    def __init__(self, message, delay):
+        super().__init__(message)
+        self.delay = delay
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def retry_delay(attempts, base=RETRY_BASE_SECONDS, maximum=RETRY_MAX_SECONDS):
+    """Exponential backoff with full jitter for the given number of attempts made."""
+    return random.uniform(0, min(maximum, base * (2 ** max(0, attempts - 1))))
+
+
+class JobQueue:
+    def __init__(self, collection, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", ASCENDING), ("user_rank", ASCENDING), ("created_at", ASCENDING)])
+        self.collection.create_index([("user_id", ASCENDING), ("status", ASCENDING)])
+        self.collection.create_index([("payload.storage_key", ASCENDING)], sparse=True)
+
+    def enqueue(self, job_type, user_id, payload, trace_id=None, max_attempts=None):
+        """Adds a job. Returns its id."""
+        now = time.time()
+        job = {
+            "_id": ObjectId(),
+            "type": job_type,
+            "user_id": user_id,
+            "payload": payload,
+            "status": QUEUED,
+            "user_rank": self.collection.count_documents({"user_id": user_id, "status": {"$in": list(UNFINISHED)}}),
+            "attempts": 0,
+            "max_attempts": max_attempts or self.max_attempts,
+            "available_at": now,
+            "created_at": now,
+            "updated_at": now,
+            "trace_id": trace_id,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "result": None,
+            "error": None
+        }
+        self.collection.insert_one(job)
+        JOBS_TOTAL.inc(job_type, "enqueued")
+        return job["_id"]
+
+    def get(self, job_id, user_id=None):
+        query = {"_id": ObjectId(job_id)}
+        if user_id is not None:
+            query["user_id"] = user_id
+        return self.collection.find_one(query)
+
+    def claim(self, worker_id, job_types=None):
+        """
+        Leases the next job (fairest first), or returns None when nothing is claimable.
+        Jobs whose lease expired are reclaimed; if they already used all attempts they are
+        dead-lettered instead.
+        """
+        while True:
+            now = time.time()
+            query = {"$or": [
+                {"status": QUEUED, "available_at": {"$lte": now}},
+                {"status": RUNNING, "lease_expires_at": {"$lt": now}}
+            ]}
+            if job_types:
+                query["type"] = {"$in": list(job_types)}
+            job = self.collection.find_one_and_update(
+                query,
+                {"$set": {"status": RUNNING, "lease_owner": worker_id, "lease_expires_at": now + self.lease_seconds,
+                          "updated_at": now, "started_at": now},
+                 "$inc": {"attempts": 1}},
+                sort=[("user_rank", ASCENDING), ("created_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                return None
+            if job["attempts"] > job["max_attempts"]:
+                # The previous holder's lease ran out on its last attempt (crash or timeout)
+                self._finish(job, DEAD, error=job.get("error") or "Lease expired on the final attempt.")
+                continue
+            JOB_WAIT_SECONDS.observe(now - job["created_at"], job["type"])
+            return job
+
+    def renew(self, job, worker_id):
+        """Extends the lease. Returns False if the job is no longer ours."""
+        now = time.time()
+        result = self.collection.update_one(
+            {"_id": job["_id"], "lease_owner": worker_id, "status": RUNNING},
+            {"$set": {"lease_expires_at": now + self.lease_seconds, "updated_at": now}}
+        )
+        return result.matched_count == 1
+
+    def complete(self, job, worker_id, result=None):
+        return self._finish(job, SUCCEEDED, worker_id=worker_id, result=result)
+
+    def fail(self, job, worker_id, error, permanent=False):
+        """Schedules a retry with backoff, or fails/dead-letters the job when out of attempts."""
+        if permanent:
+            return self._finish(job, FAILED, worker_id=worker_id, error=error)
+        if job["attempts"] >= job["max_attempts"]:
+            return self._finish(job, DEAD, worker_id=worker_id, error=error)
+        now = time.time()
+        delay = retry_delay(job["attempts"])
+        updated = self.collection.update_one(
+            {"_id": job["_id"], "lease_owner": worker_id},
+            {"$set": {"status": QUEUED, "available_at": now + delay, "lease_owner": None, "lease_expires_at": None,
+                      "error": error, "updated_at": now}}
+        )
+        JOBS_TOTAL.inc(job["type"], "retried")
+        logger.warning("Job %s attempt %d failed, retrying in %.0fs: %s", job["_id"], job["attempts"], delay, error)
+        return updated.matched_count == 1
+
+    def defer(self, job, worker_id, delay, reason):
+        """Puts the job back in the queue for `delay` seconds without counting the attempt."""
+        now = time.time()
+        updated = self.collection.update_one(
+            {"_id": job["_id"], "lease_owner": worker_id},
+            {"$set": {"status": QUEUED, "available_at": now + delay, "lease_owner": None, "lease_expires_at": None,
+                      "error": reason, "updated_at": now},
+             "$inc": {"attempts": -1}}
+        )
+        JOBS_TOTAL.inc(job["type"], "deferred")
+        logger.info("Job %s deferred for %.0fs: %s", job["_id"], delay, reason)
+        return updated.matched_count == 1
+
+    def _finish(self, job, status, worker_id=None, result=None, error=None):
+        query = {"_id": job["_id"]}
+        if worker_id is not None:
+            query["lease_owner"] = worker_id # A worker that lost its lease must not overwrite the new holder
+        now = time.time()
+        updated = self.collection.update_one(query, {"$set": {
+            "status": status, "result": result, "error": error, "finished_at": now, "updated_at": now,
+            "lease_owner": None, "lease_expires_at": None
+        }})
+        JOBS_TOTAL.inc(job["type"], status)
+        if status == DEAD:
+            logger.error("Job %s dead-lettered after %d attempts: %s", job["_id"], job["attempts"], error)
+        return updated.matched_count == 1
+
+    def references_storage(self, storage_key, exclude_job_id=None):
+        """True if a job that is unfinished, dead-lettered or failed still needs this stored object."""
+        query = {"payload.storage_key": storage_key, "status": {"$ne": SUCCEEDED}}
+        if exclude_job_id is not None:
+            query["_id"] = {"$ne": exclude_job_id}
+        return self.collection.count_documents(query, limit=1) > 0
+
+    def purge(self, finished_before, on_purge=None):
+        """
+        Deletes dead-lettered and failed jobs that finished before `finished_before`, calling
+        on_purge(job) after each one is gone (to release what it referenced). Returns the count.
+        """
+        purged = 0
+        for job in self.collection.find({"status": {"$in": [DEAD, FAILED]}, "finished_at": {"$lt": finished_before}}):
+            # The status condition skips a job requeued in the meantime
+            if self.collection.delete_one({"_id": job["_id"], "status": {"$in": [DEAD, FAILED]}}).deleted_count:
+                purged += 1
+                if on_purge is not None:
+                    on_purge(job)
+        return purged
+
+    def requeue_dead(self, job_id):
+        """Puts a dead-lettered job back in the queue with a fresh set of attempts."""
+        now = time.time()
+        return self.collection.update_one(
+            {"_id": ObjectId(job_id), "status": {"$in": [DEAD, FAILED]}},
+            {"$set": {"status": QUEUED, "attempts": 0, "available_at": now, "updated_at": now, "error": None}}
+        ).matched_count == 1
+
+
+class LeaseKeeper:
+    """Renews a job's lease in the background while a worker processes it."""
+
+    def __init__(self, queue, job, worker_id):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(1.0, self.queue.lease_seconds / 3.0)
+        while not self._stop.wait(interval):
+            try:
+                if not self.queue.renew(self.job, self.worker_id):
+                    self.lost = True
+                    logger.warning("Lost the lease on job %s.", self.job["_id"])
+                    return
+            except Exception as e:
+                logger.warning("Could not renew the lease on job %s: %s", self.job["_id"], e)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def job_status(job):
+    """Public view of a job for the status endpoint."""
+    return {
+        "job_id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+        "result": job.get("result"),
+        "error": job.get("error")
+    }
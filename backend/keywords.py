@@ -0,0 +1,271 @@
+# backend/keywords.py
+"""
+Batched KeyBERT-style keyword extraction.
+
+KeyBERT scores candidate words by embedding similarity to the document and picks a diverse
+top-n with Maximal Marginal Relevance (MMR). Running it note by note embeds every distinct
+word of every note. This module instead:
+
+- pre-filters candidates with a CountVectorizer (stopwords, minimum length, and only the
+  most frequent words of each document),
+- embeds the candidates of a whole batch of notes/pages in one call, with a cache of word
+  embeddings shared between calls,
+- accepts precomputed document embeddings (the mean of a note's chunk vectors, which covers
+  the whole note instead of the first 128 tokens the model sees),
+- can run in a separate worker process, so transformer inference does not compete with the
+  request threads,
+- can run the model with ONNX Runtime (EMBEDDING_BACKEND=onnx, see onnx_embeddings.py).
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, ENGLISH_STOP_WORDS
+
+from observability import get_logger, span
+
+logger = get_logger("keywords")
+
+KEYWORD_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+TOP_N = 7
+DIVERSITY = 0.7
+MAX_CANDIDATES = 64 # Most frequent candidate words kept per document
+WORD_CACHE_SIZE = 50000
+
+# Common Hindi/Marathi function words; English ones come from scikit-learn
+INDIC_STOP_WORDS = frozenset("""
+और का की के को में से है हैं था थे थी पर भी यह वह इस उस एक लिए तो ही या जो कि नहीं कर किया
+करने होता होती होते गया गई हो रहा रही रहे आणि आहे होते हा ही हे व या ते ती त्या मध्ये साठी
+""".split())
+STOP_WORDS = frozenset(ENGLISH_STOP_WORDS) | INDIC_STOP_WORDS
+# Words of two or more letters, including Devanagari vowel signs (which \w alone splits on)
+TOKEN_PATTERN = r"(?u)[\w\u0900-\u097F]{2,}"
+
+
+def candidate_words(texts, max_candidates=MAX_CANDIDATES, stop_words=STOP_WORDS):
+    """Per document, the up to max_candidates most frequent non-stopword unigrams."""
+    vectorizer = CountVectorizer(token_pattern=TOKEN_PATTERN, stop_words=list(stop_words), lowercase=True)
+    try:
+        counts = vectorizer.fit_transform(texts)
+    except ValueError: # Only stopwords / empty documents
+        return [[] for _ in texts]
+    vocabulary = vectorizer.get_feature_names_out()
+    candidates = []
+    for row in range(counts.shape[0]):
+        start, end = counts.indptr[row], counts.indptr[row + 1]
+        columns, frequencies = counts.indices[start:end], counts.data[start:end]
+        order = np.argsort(-frequencies, kind="stable")
+        words = [vocabulary[columns[i]] for i in order if not vocabulary[columns[i]].isdigit()]
+        candidates.append(words[:max_candidates])
+    return candidates
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def mmr(doc_embedding, word_embeddings, words, top_n=TOP_N, diversity=DIVERSITY):
+    """
+    Maximal Marginal Relevance over normalized embeddings (as KeyBERT's MMR). Returns
+    (word, similarity to the document) pairs, most similar first.
+    """
+    word_doc_similarity = word_embeddings @ doc_embedding
+    word_similarity = word_embeddings @ word_embeddings.T
+    selected = [int(np.argmax(word_doc_similarity))]
+    remaining = [i for i in range(len(words)) if i != selected[0]]
+    for _ in range(min(top_n, len(words)) - 1):
+        candidate_similarity = word_doc_similarity[remaining]
+        redundancy = np.max(word_similarity[remaining][:, selected], axis=1)
+        scores = (1 - diversity) * candidate_similarity - diversity * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    selected.sort(key=lambda i: -word_doc_similarity[i])
+    return [(words[i], float(word_doc_similarity[i])) for i in selected]
+
+
+class KeywordExtractor:
+    """Keyword extraction for batches of documents with a KeyBERT model's embedding backend."""
+
+    def __init__(self, keybert_model, top_n=TOP_N, diversity=DIVERSITY, max_candidates=MAX_CANDIDATES,
+                 word_cache_size=WORD_CACHE_SIZE):
+        self.keybert_model = keybert_model
+        self.top_n = top_n
+        self.diversity = diversity
+        self.max_candidates = max_candidates
+        self.word_cache_size = word_cache_size
+        self._word_cache = OrderedDict()
+        self._cache_lock = threading.Lock() # Flask serves requests from several threads
+
+    def _embed(self, texts):
+        return np.asarray(self.keybert_model.model.embed(texts), dtype=np.float32)
+
+    def _word_embeddings(self, words):
+        with self._cache_lock:
+            found = {word: self._word_cache[word] for word in words if word in self._word_cache}
+            for word in found:
+                self._word_cache.move_to_end(word)
+        missing = [word for word in words if word not in found]
+        if missing:
+            found.update(zip(missing, self._embed(missing)))
+            with self._cache_lock:
+                for word in missing:
+                    self._word_cache[word] = found[word]
+                while len(self._word_cache) > self.word_cache_size:
+                    self._word_cache.popitem(last=False)
+        return found
+
+    def extract_batch(self, texts, doc_embeddings=None):
+        """
+        Keywords (most relevant first) for each text. doc_embeddings may hold a precomputed
+        vector per text from the same embedding model, or None to embed that text here.
+        """
+        if not texts:
+            return []
+        doc_embeddings = list(doc_embeddings) if doc_embeddings is not None else [None] * len(texts)
+        with span("keyword_candidates"):
+            candidates = candidate_words(texts, self.max_candidates)
+        with span("keyword_embedding"):
+            missing = [i for i, embedding in enumerate(doc_embeddings) if embedding is None and candidates[i]]
+            if missing:
+                for i, embedding in zip(missing, self._embed([texts[i] for i in missing])):
+                    doc_embeddings[i] = embedding
+            vocabulary = sorted({word for words in candidates for word in words})
+            word_vectors = self._word_embeddings(vocabulary) if vocabulary else {}
+
+        keywords = []
+        for words, doc_embedding in zip(candidates, doc_embeddings):
+            if not words:
+                keywords.append([])
+                continue
+            doc_vector = _normalize_rows(np.asarray(doc_embedding, dtype=np.float32)[None, :])[0]
+            word_matrix = _normalize_rows(np.stack([word_vectors[word] for word in words]))
+            keywords.append([word for word, _ in mmr(doc_vector, word_matrix, words, self.top_n, self.diversity)])
+        return keywords
+
+    def extract(self, text, doc_embedding=None):
+        return self.extract_batch([text], None if doc_embedding is None else [doc_embedding])[0]
+
+
+def load_keybert(model_name, onnx_model_dir=None, onnx_quantized=True):
+    """
+    KeyBERT with the exported ONNX model in onnx_model_dir, or with the PyTorch model (also when
+    the ONNX model cannot be loaded, like the embedding function).
+    """
+    from keybert import KeyBERT
+    if onnx_model_dir:
+        try:
+            from onnx_embeddings import keybert_backend, load_encoder
+            encoder = load_encoder(onnx_model_dir, model_name=model_name, quantized=onnx_quantized,
+                                   threads=int(os.getenv("ONNX_THREADS", "0")))
+            return KeyBERT(model=keybert_backend(encoder))
+        except Exception:
+            logger.exception("Could not load the ONNX model for keywords from %s. Using PyTorch.", onnx_model_dir)
+    return KeyBERT(model=model_name)
+
+
+# --- Worker process ---
+
+_worker_extractor = None
+
+
+def _init_worker(model_name, onnx_model_dir, onnx_quantized, options):
+    global _worker_extractor
+    _worker_extractor = KeywordExtractor(load_keybert(model_name, onnx_model_dir, onnx_quantized), **options)
+
+
+def _extract_in_worker(texts, doc_embeddings):
+    return _worker_extractor.extract_batch(texts, doc_embeddings)
+
+
+def _start_worker():
+    return None
+
+
+@contextmanager
+def _as_main_module():
+    """
+    Lets processes spawned meanwhile start from this module: a spawned child re-runs the parent's
+    __main__, which for `python app.py` or `python worker.py` is the whole API initialisation.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class KeywordService:
+    """
+    Keyword extraction in-process (workers=0) or in a pool of worker processes that each load
+    their own copy of the model. `submit()` returns a Future either way.
+    """
+
+    def __init__(self, model_name=KEYWORD_MODEL_NAME, workers=0, onnx_model_dir=None, onnx_quantized=True, **options):
+        self.model_name = model_name
+        self.workers = workers
+        self.onnx_model_dir = onnx_model_dir
+        self._extractor = None
+        self._executor = None
+        if workers > 0:
+            # Spawned, not forked: a fork of the API process would inherit its threads and locks
+            # (Flask, the Mongo client, torch's thread pool) in whatever state they were in
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker,
+                                                 initargs=(model_name, onnx_model_dir, onnx_quantized, options))
+            # The pool starts its processes on submit: start them all now, importing only this module
+            with _as_main_module():
+                for _ in range(workers):
+                    self._executor.submit(_start_worker)
+        else:
+            self._extractor = KeywordExtractor(load_keybert(model_name, onnx_model_dir, onnx_quantized), **options)
+
+    @classmethod
+    def from_env(cls):
+        """
+        KEYWORD_WORKERS (default 0: in-process), KEYWORD_MAX_CANDIDATES, and EMBEDDING_BACKEND=onnx
+        with ONNX_MODEL_DIR (default: onnx_models/<model>) and ONNX_QUANTIZED for ONNX Runtime inference.
+        """
+        onnx_model_dir = None
+        if os.getenv("EMBEDDING_BACKEND", "torch").lower() == "onnx":
+            from onnx_embeddings import default_model_dir
+            onnx_model_dir = os.getenv("ONNX_MODEL_DIR") or default_model_dir(KEYWORD_MODEL_NAME)
+        return cls(
+            workers=int(os.getenv("KEYWORD_WORKERS", "0")),
+            onnx_model_dir=onnx_model_dir,
+            onnx_quantized=os.getenv("ONNX_QUANTIZED", "true").lower() == "true",
+            max_candidates=int(os.getenv("KEYWORD_MAX_CANDIDATES", str(MAX_CANDIDATES)))
+        )
+
+    def uses_model(self, embedding_model_name):
+        """True if vectors from embedding_model_name can serve as document embeddings."""
+        return embedding_model_name.split('/')[-1] == self.model_name.split('/')[-1]
+
+    def submit(self, texts, doc_embeddings=None):
+        if doc_embeddings is not None:
+            doc_embeddings = [None if e is None else np.asarray(e, dtype=np.float32) for e in doc_embeddings]
+        if self._executor is not None:
+            return self._executor.submit(_extract_in_worker, list(texts), doc_embeddings)
+        future = Future()
+        try:
+            future.set_result(self._extractor.extract_batch(list(texts), doc_embeddings))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def extract_batch(self, texts, doc_embeddings=None):
+        return self.submit(texts, doc_embeddings).result()
+
+    def extract(self, text, doc_embedding=None):
+        return self.extract_batch([text], None if doc_embedding is None else [doc_embedding])[0]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
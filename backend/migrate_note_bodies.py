@@ -0,0 +1,106 @@
+# backend/migrate_note_bodies.py
+"""
+Moves the texts of notes stored inline (`extracted_text`/`raw_ocr_text` in the note
+document) into the compressed note body store, leaving `preview_text` and `text_length`
+in the note document.
+
+Each batch writes the bodies first and then slims the note documents, so an interrupted run
+loses nothing: run it again and it continues with the notes that still have inline text.
+The API reads both layouts, so it can keep serving while the migration runs. A body is only
+written where the note has none yet (an edit through the API may have stored a newer one),
+and a note is only slimmed if it still has the inline text and the `updated_date` it was
+read with, and its stored body holds that same text. Notes edited meanwhile stay inline
+(still read correctly) and are reported as skipped.
+
+Example:
+    python migrate_note_bodies.py --dry-run
+    python migrate_note_bodies.py --batch-size 200
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from note_bodies import NoteBodyStore, compress_text, inline_text, summary_fields
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Move inline note texts into the compressed note body store.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Notes migrated per batch.")
+    parser.add_argument("--user", default=None, help="Only migrate notes of this user id.")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many notes.")
+    parser.add_argument("--codec", default=os.getenv("NOTE_BODY_CODEC"), help="zstd or zlib (default: zstd if installed).")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how much the texts would compress.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    load_dotenv()
+
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        raise SystemExit("Error: MONGO_URI is not set in .env.")
+    db = MongoClient(mongo_uri)[os.getenv("MONGO_DB_NAME", "NoteVerseDB")]
+    store = NoteBodyStore(db, codec=args.codec,
+                          inline_max_bytes=int(os.getenv("NOTE_BODY_INLINE_MAX_BYTES", str(1024 * 1024))))
+
+    query = {"extracted_text": {"$exists": True}}
+    if args.user:
+        query["user_id"] = args.user
+    print(f"{db.notes.count_documents(query)} notes with inline text; migrating with {store.codec}"
+          f"{' (dry run)' if args.dry_run else ''}.")
+
+    notes_done, inline_bytes, stored_bytes, identical_raw, skipped = 0, 0, 0, 0, 0
+    started = time.time()
+    last_id = None
+    while args.limit is None or notes_done < args.limit:
+        batch_query = dict(query, **({"_id": {"$gt": last_id}} if last_id is not None else {}))
+        batch_size = args.batch_size if args.limit is None else min(args.batch_size, args.limit - notes_done)
+        batch = list(db.notes.find(batch_query, {"_id": 1, "user_id": 1, "extracted_text": 1, "raw_ocr_text": 1,
+                                                 "updated_date": 1})
+                     .sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        bodies = []
+        for note in batch:
+            text, raw_text = inline_text(note), inline_text(note, raw=True)
+            bodies.append((note["_id"], note.get("user_id"), text, raw_text))
+            inline_bytes += len(text.encode("utf-8")) + len((note.get("raw_ocr_text") or "").encode("utf-8"))
+            stored_bytes += len(compress_text(text, store.codec))
+            if raw_text != text:
+                stored_bytes += len(compress_text(raw_text, store.codec))
+            else:
+                identical_raw += 1
+        if not args.dry_run:
+            written = set(store.put_many(bodies, replace=False))
+            # Bodies already stored (by an interrupted run, or by an edit) count only if they hold the same text
+            existing = [{"_id": note_id} for note_id, _, _, _ in bodies if note_id not in written]
+            stored_texts = store.get_many(existing) if existing else {}
+            stored_raw = store.get_many(existing, raw=True) if existing else {}
+            updated_dates = {note["_id"]: note.get("updated_date") for note in batch}
+            writes = [
+                UpdateOne({"_id": note_id, "extracted_text": {"$exists": True}, "updated_date": updated_dates[note_id]},
+                          {"$set": summary_fields(text), "$unset": {"extracted_text": "", "raw_ocr_text": ""}})
+                for note_id, _, text, raw_text in bodies
+                if note_id in written or (stored_texts.get(note_id) == text and stored_raw.get(note_id) == raw_text)
+            ]
+            slimmed = db.notes.bulk_write(writes, ordered=False).modified_count if writes else 0
+            skipped += len(bodies) - slimmed
+        notes_done += len(batch)
+        print(f"{notes_done} notes | {inline_bytes / 1e6:.1f} MB inline -> {stored_bytes / 1e6:.1f} MB compressed | "
+              f"{notes_done / max(time.time() - started, 1e-9):.1f} notes/s")
+
+    ratio = inline_bytes / stored_bytes if stored_bytes else 0.0
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {notes_done} notes: {inline_bytes / 1e6:.1f} MB of inline "
+          f"text stored as {stored_bytes / 1e6:.1f} MB ({ratio:.1f}x); {identical_raw} raw OCR texts were identical "
+          f"to the note text and are not stored again."
+          + (f" {skipped} notes were edited during the migration and kept their inline text." if skipped else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# backend/model_router.py
+"""
+Model routing, per-user token budgets and per-call usage accounting for LLM calls.
+
+Every LLM call belongs to a task (vision, quiz, rag) and a tier picked from what is being
+processed:
+
+- vision: "typed" for PDF pages with a text layer, "handwritten" for scans and photos
+- quiz: "short" for notes quizzed with one prompt, "long" for map-reduce over sections
+- rag: "simple" or "complex" questions (see question_complexity())
+- every task: "economy", used once a user has spent ECONOMY_FRACTION of their daily budget
+
+The model of each (task, tier) comes from DEFAULT_ROUTES, overridden with MODEL_ROUTES
+(JSON, e.g. {"rag": {"complex": "gpt-4o"}}), so cost and latency are traded by
+configuration. With a daily token budget per user (USER_DAILY_TOKEN_BUDGET), calls beyond it
+are refused with BudgetExceeded until the next UTC day.
+
+Calls made through ModelRouter.client() are recorded in `llm_calls` (task, tier, model,
+tokens, latency, cost) and summed per user and day in `llm_usage_daily`.
+"""
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from pymongo import ASCENDING, DESCENDING
+
+from observability import Counter, current_trace_id, get_logger, register
+
+logger = get_logger("models")
+
+LLM_TOKENS = register(Counter(
+    "noteverse_llm_tokens_total", "LLM tokens by task, model and kind (prompt, completion).", ["task", "model", "kind"]
+))
+LLM_COST = register(Counter(
+    "noteverse_llm_cost_usd_total", "Estimated LLM cost in USD by task and model.", ["task", "model"]
+))
+
+# USD per million tokens (prompt, completion); override or extend with MODEL_PRICES
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-3.5-turbo-1106": (1.00, 2.00),
+}
+
+DEFAULT_ROUTES = {
+    "vision": {"typed": "gpt-4o-mini", "handwritten": "gpt-4o-mini", "economy": "gpt-4o-mini"},
+    "quiz": {"short": "gpt-3.5-turbo-1106", "long": "gpt-3.5-turbo-1106", "economy": "gpt-4o-mini"},
+    "rag": {"simple": "gpt-3.5-turbo", "complex": "gpt-3.5-turbo", "economy": "gpt-4o-mini"},
+}
+
+ECONOMY_FRACTION = 0.8
+COMPLEX_QUESTION_TOKENS = 40
+COMPLEX_CONTEXT_TOKENS = 2500
+REASONING_CUES = re.compile(
+    r"\b(why|how (does|do|did|can|would)|compare|comparison|difference|differ|versus|vs\.?|explain|"
+    r"relationship|relate|analy[sz]e|evaluate|justify|trade-?offs?|pros and cons)\b", re.IGNORECASE
+)
+
+
+class BudgetExceeded(Exception):
+    """The user's daily token budget is spent."""
+
+    def __init__(self, used, budget, retry_after):
+        super().__init__(f"Daily AI usage limit reached ({used} of {budget} tokens); it resets in "
+                         f"{int(retry_after // 3600)}h {int(retry_after % 3600 // 60)}m.")
+        self.used = used
+        self.budget = budget
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Route:
+    task: str
+    tier: str
+    model: str
+
+
+def question_complexity(question, count_tokens, context_tokens=0):
+    """
+    "complex" for long or multi-part questions, questions asking for reasoning (why, compare,
+    explain...) and questions answered from a large context; "simple" otherwise.
+    """
+    if (count_tokens(question) > COMPLEX_QUESTION_TOKENS or question.count("?") > 1
+            or REASONING_CUES.search(question) or context_tokens > COMPLEX_CONTEXT_TOKENS):
+        return "complex"
+    return "simple"
+
+
+def seconds_until_next_day(now=None):
+    now = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+    return (tomorrow - now).total_seconds()
+
+
+def _json_env(name):
+    value = os.getenv(name)
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError as e:
+        logger.error("Ignoring %s: invalid JSON (%s).", name, e)
+        return {}
+
+
+def routes_from_env(defaults=DEFAULT_ROUTES):
+    """DEFAULT_ROUTES with the tiers of MODEL_ROUTES (JSON) overridden."""
+    routes = {task: dict(tiers) for task, tiers in defaults.items()}
+    for task, tiers in _json_env("MODEL_ROUTES").items():
+        routes.setdefault(task, {}).update(tiers)
+    return routes
+
+
+def prices_from_env(defaults=DEFAULT_PRICES):
+    """DEFAULT_PRICES extended with MODEL_PRICES (JSON: {"model": [prompt, completion] USD per 1M tokens})."""
+    prices = dict(defaults)
+    prices.update({model: tuple(price) for model, price in _json_env("MODEL_PRICES").items()})
+    return prices
+
+
+class UsageStore:
+    """Per-call LLM usage records and per-user daily totals in MongoDB."""
+
+    def __init__(self, db):
+        self.calls = db.llm_calls
+        self.daily = db.llm_usage_daily
+
+    def ensure_indexes(self):
+        self.calls.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        self.calls.create_index([("task", ASCENDING), ("created_at", DESCENDING)])
+
+    @staticmethod
+    def day_id(user_id, now=None):
+        day = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc).strftime("%Y-%m-%d")
+        return f"{user_id}:{day}", day
+
+    def tokens_today(self, user_id, now=None):
+        daily = self.daily.find_one({"_id": self.day_id(user_id, now)[0]}, {"tokens": 1})
+        return daily["tokens"] if daily else 0
+
+    def today(self, user_id, now=None):
+        daily = self.daily.find_one({"_id": self.day_id(user_id, now)[0]})
+        return {"tokens": daily.get("tokens", 0) if daily else 0, "cost_usd": daily.get("cost_usd", 0.0) if daily else 0.0,
+                "calls": daily.get("calls", 0) if daily else 0}
+
+    def record(self, call):
+        self.calls.insert_one(call)
+        day_id, day = self.day_id(call["user_id"], call["created_at"])
+        self.daily.update_one(
+            {"_id": day_id},
+            {"$setOnInsert": {"user_id": call["user_id"], "day": day},
+             "$inc": {"tokens": call["total_tokens"], "cost_usd": call["cost_usd"], "calls": 1,
+                      f"by_task.{call['task']}.tokens": call["total_tokens"],
+                      f"by_task.{call['task']}.cost_usd": call["cost_usd"]}},
+            upsert=True
+        )
+
+
+class MeteredClient:
+    """
+    Wraps an OpenAI client (`client.chat.completions.create`) for calls of one route and
+    user, recording tokens, latency and cost of each call.
+    """
+
+    def __init__(self, router, client, route, user_id):
+        self.router = router
+        self.client = client
+        self.route = route
+        self.user_id = user_id
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+
+    def _create_chat_completion(self, **kwargs):
+        kwargs.setdefault("model", self.route.model)
+        started = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(**kwargs)
+        except Exception as e:
+            self.router.record(self.route, self.user_id, kwargs["model"], None, time.perf_counter() - started,
+                               error=type(e).__name__)
+            raise
+        self.router.record(self.route, self.user_id, kwargs["model"], getattr(response, "usage", None),
+                           time.perf_counter() - started)
+        return response
+
+
+class ModelRouter:
+    """Picks the model of each LLM call, enforces daily token budgets and records usage."""
+
+    def __init__(self, routes=None, prices=None, usage=None, daily_token_budget=0, economy_fraction=ECONOMY_FRACTION):
+        self.routes = routes or DEFAULT_ROUTES
+        self.prices = prices or DEFAULT_PRICES
+        self.usage = usage
+        self.daily_token_budget = daily_token_budget # 0: unlimited
+        self.economy_fraction = economy_fraction
+
+    def _budget_tier(self, user_id):
+        """None, or "economy" once the user has spent most of today's budget. Raises BudgetExceeded."""
+        if not self.daily_token_budget or self.usage is None or user_id is None:
+            return None
+        try:
+            used = self.usage.tokens_today(user_id)
+        except Exception as e:
+            logger.warning("Could not read the token usage of user %s: %s", user_id, e)
+            return None
+        if used >= self.daily_token_budget:
+            raise BudgetExceeded(used, self.daily_token_budget, seconds_until_next_day())
+        if used >= self.economy_fraction * self.daily_token_budget:
+            return "economy"
+        return None
+
+    def _route(self, task, tier, budget_tier):
+        tiers = self.routes[task]
+        tier = budget_tier if budget_tier in tiers else tier
+        if tier not in tiers:
+            tier = next(iter(tiers))
+        return Route(task, tier, tiers[tier])
+
+    def route(self, task, tier, user_id=None):
+        """The Route of one call. Raises BudgetExceeded when the user's budget is spent."""
+        return self._route(task, tier, self._budget_tier(user_id))
+
+    def route_many(self, task, tiers, user_id=None):
+        """Routes for several calls of one request (e.g. one per page), with one budget check."""
+        budget_tier = self._budget_tier(user_id)
+        return [self._route(task, tier, budget_tier) for tier in tiers]
+
+    def client(self, client, route, user_id=None):
+        return MeteredClient(self, client, route, user_id)
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+    def record(self, route, user_id, model, usage, seconds, error=None):
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = self.cost(model, prompt_tokens, completion_tokens)
+        LLM_TOKENS.inc(route.task, model, "prompt", amount=prompt_tokens)
+        LLM_TOKENS.inc(route.task, model, "completion", amount=completion_tokens)
+        LLM_COST.inc(route.task, model, amount=cost)
+        if self.usage is None:
+            return
+        try:
+            self.usage.record({
+                "user_id": user_id,
+                "task": route.task,
+                "tier": route.tier,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "cost_usd": round(cost, 6),
+                "latency_ms": round(seconds * 1000.0, 1),
+                "error": error,
+                "trace_id": current_trace_id(),
+                "created_at": time.time()
+            })
+        except Exception as e:
+            logger.warning("Could not record LLM usage for user %s: %s", user_id, e)
@@ -0,0 +1,203 @@
+# backend/note_bodies.py
+"""
+Compressed storage of note texts, separate from the note documents.
+
+A note document in `notes` only keeps metadata plus a short `preview_text` and the
+`text_length`, so listings and other metadata queries scan small documents. The full text
+lives in `note_bodies`, one document per note (same _id), compressed with zstd (zlib when
+the zstandard package is not installed):
+
+    {"_id": note_id, "user_id": ..., "codec": "zstd", "text": {"data": <bytes>},
+     "raw": {"data": <bytes>}, "text_length": ..., "stored_bytes": ...}
+
+`text` is the text shown and indexed; `raw` is the OCR output it was cleaned up from and
+is only stored when it differs from `text`. A compressed variant larger than
+inline_max_bytes goes to GridFS (bucket `note_bodies`) as {"gridfs_id": ...} instead, so
+no body document comes near MongoDB's 16 MB limit.
+
+Notes stored before the body store keep `extracted_text`/`raw_ocr_text` inline until
+migrate_note_bodies.py moves them; every read falls back to those fields.
+"""
+import zlib
+
+from bson.binary import Binary
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+from pymongo import ReplaceOne, UpdateOne
+
+from observability import Counter, register
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PREVIEW_CHARS = 200
+ZSTD_LEVEL = 9 # Note texts are written once and read many times
+ZLIB_LEVEL = 6
+INLINE_MAX_BYTES = 1024 * 1024 # Compressed variants above this go to GridFS
+GRIDFS_BUCKET = "note_bodies"
+
+BODY_BYTES = register(Counter(
+    "noteverse_note_body_bytes_total", "Note text bytes written to the body store, before and after compression.",
+    ["codec", "stage"]
+))
+
+
+def preview_text(text):
+    """The listing preview of a note text."""
+    return text[:PREVIEW_CHARS] + "..." if len(text) > PREVIEW_CHARS else text
+
+
+def summary_fields(text):
+    """Fields kept in the note document in place of the full text."""
+    return {"preview_text": preview_text(text), "text_length": len(text)}
+
+
+def note_preview(note):
+    """preview_text of a note document, computed from the inline text for notes stored before the body store."""
+    if note.get("preview_text") is not None:
+        return note["preview_text"]
+    return preview_text(note.get("extracted_text") or "")
+
+
+def inline_text(note, raw=False):
+    """A text variant kept inline in a note document (notes stored before the body store)."""
+    text = note.get("extracted_text") or ""
+    return note.get("raw_ocr_text") or text if raw else text # A missing or null OCR text is the text itself
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress_text(text, codec):
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise ValueError(f"Unsupported note body codec: {codec}")
+
+
+def decompress_text(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Note body is zstd-compressed but the zstandard package is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    raise ValueError(f"Unsupported note body codec: {codec}")
+
+
+class NoteBodyStore:
+    """Compressed note texts in the `note_bodies` collection (and GridFS for large ones)."""
+
+    def __init__(self, db, codec=None, inline_max_bytes=INLINE_MAX_BYTES):
+        self.bodies = db.note_bodies
+        self.files = GridFSBucket(db, bucket_name=GRIDFS_BUCKET)
+        self.codec = codec or default_codec()
+        if self.codec == "zstd" and zstandard is None:
+            raise RuntimeError("NOTE_BODY_CODEC=zstd requires the zstandard package.")
+        compress_text("", self.codec) # Rejects unknown codecs at startup
+        self.inline_max_bytes = inline_max_bytes
+
+    def _encode(self, note_id, variant, text):
+        """(stored variant, GridFS ids created) for one text variant."""
+        data = compress_text(text, self.codec)
+        BODY_BYTES.inc(self.codec, "raw", amount=len(text.encode("utf-8")))
+        BODY_BYTES.inc(self.codec, "stored", amount=len(data))
+        if len(data) <= self.inline_max_bytes:
+            return {"data": Binary(data)}, []
+        file_id = self.files.upload_from_stream(f"{note_id}.{variant}", data,
+                                                metadata={"note_id": note_id, "codec": self.codec})
+        return {"gridfs_id": file_id}, [file_id]
+
+    def _decode(self, body, variant):
+        stored = body.get(variant)
+        if stored is None:
+            return None
+        data = stored["data"] if "data" in stored else self.files.open_download_stream(stored["gridfs_id"]).read()
+        return decompress_text(bytes(data), body["codec"])
+
+    def put_many(self, bodies, replace=True):
+        """
+        Stores (note_id, user_id, text, raw_text) bodies, replacing earlier versions; raw_text
+        is only kept when it differs from text. Previous GridFS files of the notes are deleted.
+        With replace=False, notes that already have a body keep it. Returns the ids of the
+        notes whose body was written.
+        """
+        if not bodies:
+            return []
+        note_ids = [note_id for note_id, _, _, _ in bodies]
+        previous_files = [file_id for body in self.bodies.find({"_id": {"$in": note_ids}, "gridfs_ids.0": {"$exists": True}},
+                                                               {"gridfs_ids": 1})
+                          for file_id in body["gridfs_ids"]] if replace else []
+        writes, new_files = [], []
+        for note_id, user_id, text, raw_text in bodies:
+            text = text or ""
+            document = {"_id": note_id, "user_id": user_id, "codec": self.codec, "text_length": len(text)}
+            document["text"], gridfs_ids = self._encode(note_id, "text", text)
+            if raw_text is not None and raw_text != text:
+                document["raw"], raw_gridfs_ids = self._encode(note_id, "raw", raw_text)
+                gridfs_ids += raw_gridfs_ids
+            document["stored_bytes"] = sum(len(stored["data"]) for stored in (document["text"], document.get("raw"))
+                                           if stored and "data" in stored)
+            if gridfs_ids:
+                document["gridfs_ids"] = gridfs_ids
+            new_files.append(gridfs_ids)
+            if replace:
+                writes.append(ReplaceOne({"_id": note_id}, document, upsert=True))
+            else:
+                writes.append(UpdateOne({"_id": note_id}, {"$setOnInsert": document}, upsert=True))
+        result = self.bodies.bulk_write(writes, ordered=False)
+        if replace:
+            self._delete_files(previous_files)
+            return note_ids
+        # The files uploaded for bodies that were not inserted are not referenced by anything
+        inserted = result.upserted_ids
+        self._delete_files(file_id for i, files in enumerate(new_files) if i not in inserted for file_id in files)
+        return [note_ids[i] for i in sorted(inserted)]
+
+    def put(self, note_id, user_id, text, raw_text=None):
+        self.put_many([(note_id, user_id, text, raw_text)])
+
+    def get_many(self, notes, raw=False):
+        """
+        Texts of note documents by _id, read with one query. The raw OCR variant is the text
+        itself when it was not stored separately.
+        """
+        texts, stored_ids = {}, []
+        for note in notes:
+            if "extracted_text" in note:
+                texts[note["_id"]] = inline_text(note, raw)
+            else:
+                stored_ids.append(note["_id"])
+        if stored_ids:
+            projection = {"codec": 1, "text": 1, "raw": 1} if raw else {"codec": 1, "text": 1}
+            for body in self.bodies.find({"_id": {"$in": stored_ids}}, projection):
+                text = self._decode(body, "raw") if raw else None
+                texts[body["_id"]] = text if text is not None else self._decode(body, "text")
+        for note_id in stored_ids:
+            texts.setdefault(note_id, "")
+        return texts
+
+    def get(self, note, raw=False):
+        """The text (or raw OCR text) of a note document."""
+        return self.get_many([note], raw)[note["_id"]]
+
+    def _delete_files(self, file_ids):
+        for file_id in file_ids:
+            try:
+                self.files.delete(file_id)
+            except NoFile:
+                pass
+
+    def delete_many(self, note_ids):
+        bodies = list(self.bodies.find({"_id": {"$in": list(note_ids)}}, {"gridfs_ids": 1}))
+        self.bodies.delete_many({"_id": {"$in": [body["_id"] for body in bodies]}})
+        self._delete_files(file_id for body in bodies for file_id in body.get("gridfs_ids", []))
+        return len(bodies)
+
+    def delete(self, note_id):
+        return self.delete_many([note_id])
@@ -0,0 +1,375 @@
+# backend/note_index.py
+"""
+Chunking and ChromaDB indexing helpers for notes.
+
+Notes are chunked along their structure: chunks never cross a page boundary, follow the
+headings found in the extracted text, and are sized in embedding-model tokens. Every chunk
+records its page number and heading.
+
+Every chunk is stored under a deterministic id (`<note_id>_chunk_<i>`) together with a
+hash of its content, so re-indexing a note only re-embeds chunks whose text changed and
+removes chunks that no longer exist instead of duplicating them.
+"""
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+
+from ann import hnsw_settings_from_env
+from observability import span
+
+# Chunk sizes are measured in embedding-model tokens (special tokens included). About the
+# 1000-character chunks used before; paraphrase-multilingual-MiniLM-L12-v2 truncates at 128
+# tokens by default, so its max_seq_length is raised to the chunk size (fit_max_seq_length).
+CHUNK_SIZE = 256
+CHUNK_OVERLAP = 32
+PAGE_SEPARATOR = "\n\n" # How upload_note joins the text of consecutive pages
+
+MARKDOWN_HEADING_PATTERN = re.compile(r'^(#{1,6}\s+\S.*|\*\*[^*]{1,80}\*\*:?)$')
+MAX_PLAIN_HEADING_LENGTH = 60
+
+# The collection the API reads from is recorded in a small pointer file inside the Chroma
+# directory, so a re-index can build a new collection and switch to it in one atomic rename.
+ACTIVE_COLLECTION_FILE = "active_collection.json"
+DEFAULT_COLLECTION = {
+    "collection_name": "langchain", # langchain_chroma's default collection name
+    "embedding_model_name": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+    "chunk_size": CHUNK_SIZE,
+    "chunk_overlap": CHUNK_OVERLAP,
+    "chunk_unit": "tokens"
+}
+# Collections built before chunks were sized in tokens have no chunk_unit in their settings;
+# their chunk_size / chunk_overlap are in characters.
+LEGACY_CHUNK_UNIT = "characters"
+
+
+def load_active_collection(chroma_db_path):
+    """Returns the settings of the collection the API should use (defaults if never re-indexed)."""
+    settings = dict(DEFAULT_COLLECTION)
+    settings.update(hnsw_settings_from_env())
+    pointer_path = os.path.join(chroma_db_path, ACTIVE_COLLECTION_FILE)
+    if os.path.exists(pointer_path):
+        with open(pointer_path, 'r', encoding='utf-8') as f:
+            pointer = json.load(f)
+        pointer.setdefault("chunk_unit", LEGACY_CHUNK_UNIT)
+        settings.update(pointer)
+    return settings
+
+
+def set_active_collection(chroma_db_path, settings):
+    """Atomically points the API at another collection (takes effect on the next server start)."""
+    os.makedirs(chroma_db_path, exist_ok=True)
+    pointer_path = os.path.join(chroma_db_path, ACTIVE_COLLECTION_FILE)
+    temp_path = pointer_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, pointer_path)
+
+
+def chunk_id_for(note_id, chunk_index):
+    """Deterministic ChromaDB id for a chunk of a note."""
+    return f"{note_id}_chunk_{chunk_index}"
+
+
+def content_hash(text):
+    """Stable hash of chunk text, stored in chunk metadata to detect changes."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=4)
+def load_token_counter(model_name):
+    """
+    Returns a function counting the tokens the embedding model sees for a text with its own
+    tokenizer, including the special tokens ([CLS], [SEP]) added around it, which take up
+    part of the model's input window too.
+    """
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=True))
+
+
+def load_chunk_length_function(settings):
+    """The length function chunk_size / chunk_overlap of a collection's settings are measured with."""
+    if settings.get("chunk_unit", LEGACY_CHUNK_UNIT) == LEGACY_CHUNK_UNIT:
+        return len
+    return load_token_counter(settings["embedding_model_name"])
+
+
+def fit_max_seq_length(model, settings):
+    """
+    Raises the max_seq_length of a SentenceTransformer or OnnxEncoder to the chunk size of a
+    collection sized in tokens, so every chunk is embedded whole. Returns the model.
+    """
+    if settings.get("chunk_unit", LEGACY_CHUNK_UNIT) != LEGACY_CHUNK_UNIT:
+        model.max_seq_length = max(model.max_seq_length, int(settings["chunk_size"]))
+    return model
+
+
+def page_offsets_for(pages):
+    """Start offset of each page inside PAGE_SEPARATOR.join(pages), stored with the note."""
+    offsets = []
+    position = 0
+    for page_text in pages:
+        offsets.append(position)
+        position += len(page_text) + len(PAGE_SEPARATOR)
+    return offsets
+
+
+def pages_from_text(text, page_offsets=None):
+    """Splits note text back into (page_number, page_text) pairs. Page numbers are 1-based."""
+    if not page_offsets:
+        return [(None, text)]
+    bounds = list(page_offsets) + [len(text) + len(PAGE_SEPARATOR)]
+    return [
+        (i + 1, text[bounds[i]:bounds[i + 1] - len(PAGE_SEPARATOR)])
+        for i in range(len(page_offsets))
+    ]
+
+
+def _is_heading(line):
+    """Markdown headings, bold-only lines, and short ALL-CAPS lines or lines ending in ':'."""
+    stripped = line.strip()
+    if not stripped:
+        return False
+    if MARKDOWN_HEADING_PATTERN.match(stripped):
+        return True
+    if len(stripped) > MAX_PLAIN_HEADING_LENGTH:
+        return False
+    letters = [c for c in stripped if c.isalpha()]
+    if len(letters) >= 3 and all(c.isupper() for c in letters):
+        return True
+    return stripped.endswith(':') and '.' not in stripped
+
+
+def _heading_text(line):
+    return line.strip().lstrip('#').strip().strip('*').rstrip(':').strip()
+
+
+def split_sections(page_text):
+    """Splits a page into (heading, section_text) pairs at heading lines."""
+    sections = []
+    heading = None
+    lines = []
+    has_body = False
+    for line in page_text.splitlines():
+        if _is_heading(line) and has_body:
+            sections.append((heading, "\n".join(lines).strip()))
+            lines, has_body = [], False
+        if _is_heading(line):
+            # Consecutive headings (title + subtitle) stay together with the body that follows
+            heading = _heading_text(line)
+        elif line.strip():
+            has_body = True
+        lines.append(line)
+    if "\n".join(lines).strip():
+        sections.append((heading, "\n".join(lines).strip()))
+    return sections
+
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len):
+    """
+    Chunks (page_number, page_text) pairs into (chunk_text, page_number, heading) triples.
+
+    Small sections of the same page are packed together up to chunk_size; sections larger than
+    chunk_size are split with overlap. Chunks never span two pages.
+    """
+    oversize_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=length_function
+    )
+    chunks = []
+    last_heading = None
+    for page_number, page_text in pages:
+        buffer, buffer_length, buffer_heading = [], 0, None
+
+        def flush():
+            if buffer:
+                chunks.append(("\n\n".join(buffer), page_number, buffer_heading))
+
+        for heading, section_text in split_sections(page_text):
+            heading = heading or last_heading # A page continuing a section keeps its heading
+            last_heading = heading
+            section_length = length_function(section_text)
+            if section_length > chunk_size:
+                flush()
+                buffer, buffer_length, buffer_heading = [], 0, None
+                for piece in oversize_splitter.split_text(section_text):
+                    chunks.append((piece, page_number, heading))
+                continue
+            if buffer and buffer_length + section_length > chunk_size:
+                flush()
+                buffer, buffer_length, buffer_heading = [], 0, None
+            if not buffer:
+                buffer_heading = heading
+            buffer.append(section_text)
+            buffer_length += section_length
+        flush()
+    return chunks
+
+
+def build_chunk_documents(note_id, text, base_metadata, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                          page_offsets=None, length_function=len):
+    """
+    Chunks a note and returns (ids, documents) ready for ChromaDB.
+    base_metadata is copied into every chunk (user_id, original_filename, upload_date...).
+    page_offsets (from page_offsets_for) restores page boundaries; length_function measures
+    chunk_size/chunk_overlap, normally the one load_chunk_length_function returns.
+    """
+    note_id = str(note_id)
+    ids = []
+    documents = []
+    chunks = chunk_pages(pages_from_text(text, page_offsets), chunk_size, chunk_overlap, length_function)
+    for i, (chunk_content, page_number, heading) in enumerate(chunks):
+        chunk_metadata = dict(base_metadata)
+        chunk_metadata.update({
+            "note_id": note_id,
+            "chunk_index": i,
+            "chunk_id": chunk_id_for(note_id, i),
+            "content_hash": content_hash(chunk_content)
+        })
+        # ChromaDB metadata cannot hold None values
+        if page_number is not None:
+            chunk_metadata["page_number"] = page_number
+        if heading:
+            chunk_metadata["heading"] = heading[:200]
+        ids.append(chunk_metadata["chunk_id"])
+        documents.append(Document(page_content=chunk_content, metadata=chunk_metadata))
+    return ids, documents
+
+
+def _existing_chunks(vectorstore, note_ids):
+    """Stored chunks of the given notes: {note_id: {chunk_id: {metadata, hash, embedding}}}."""
+    note_ids = [str(note_id) for note_id in note_ids]
+    existing = vectorstore.get(
+        where={"note_id": note_ids[0]} if len(note_ids) == 1 else {"note_id": {"$in": note_ids}},
+        include=["metadatas", "documents", "embeddings"]
+    )
+    chunks = {note_id: {} for note_id in note_ids}
+    embeddings = existing.get("embeddings")
+    for i, chunk_id in enumerate(existing.get("ids", [])):
+        metadata = existing["metadatas"][i] or {}
+        text = existing["documents"][i] or ""
+        chunks.setdefault(str(metadata.get("note_id")), {})[chunk_id] = {
+            "metadata": metadata,
+            # Chunks indexed before content hashes were recorded are hashed on the fly
+            "hash": metadata.get("content_hash") or content_hash(text),
+            "embedding": list(embeddings[i]) if embeddings is not None else None
+        }
+    return chunks
+
+
+def sync_note_chunks(vectorstore, note_id, ids, documents):
+    """
+    Makes the ChromaDB chunks of a note match `documents`.
+
+    - unchanged chunks (same id and content hash) are left alone (metadata refreshed if needed)
+    - chunks whose text already exists elsewhere in the note reuse the stored embedding
+    - only genuinely new text is sent through the embedding model
+    - chunks that no longer exist are deleted
+
+    Returns a dict of counts (embedded, reused, unchanged, deleted) plus `mean_embedding`, the
+    mean of all chunk vectors of the note (None if some stored vector was unavailable), which
+    the keyword service uses as the document embedding.
+    """
+    return sync_notes_chunks(vectorstore, [(note_id, ids, documents)])[0]
+
+
+def sync_notes_chunks(vectorstore, notes):
+    """
+    sync_note_chunks() for several notes at once, given as (note_id, ids, documents) tuples:
+    one ChromaDB read, one embedding call for the new text of all notes, and one write.
+    Returns the stats of each note, in order.
+    """
+    if not notes:
+        return []
+    existing_by_note = _existing_chunks(vectorstore, [note_id for note_id, _, _ in notes])
+
+    plans = []
+    texts_to_embed = {} # content hash -> text, so text shared between notes is embedded once
+    unchanged_ids, unchanged_metadatas = [], []
+    for note_id, ids, documents in notes:
+        existing = existing_by_note.get(str(note_id), {})
+        embedding_by_hash = {
+            chunk["hash"]: chunk["embedding"] for chunk in existing.values() if chunk["embedding"] is not None
+        }
+        plan = {"ids": ids, "existing": existing, "reuse": [], "embed": []}
+        for chunk_id, doc in zip(ids, documents):
+            chunk_hash = doc.metadata["content_hash"]
+            current = existing.get(chunk_id)
+            if current is not None and current["hash"] == chunk_hash:
+                if current["metadata"] != doc.metadata:
+                    unchanged_ids.append(chunk_id)
+                    unchanged_metadatas.append(doc.metadata)
+                continue
+            if chunk_hash in embedding_by_hash:
+                plan["reuse"].append((chunk_id, doc, embedding_by_hash[chunk_hash]))
+            else:
+                plan["embed"].append((chunk_id, doc))
+                texts_to_embed.setdefault(chunk_hash, doc.page_content)
+        plans.append(plan)
+
+    new_embedding_by_hash = {}
+    if texts_to_embed:
+        with span("embedding"):
+            new_embeddings = vectorstore.embeddings.embed_documents(list(texts_to_embed.values()))
+        new_embedding_by_hash = dict(zip(texts_to_embed.keys(), new_embeddings))
+
+    upsert_ids, upsert_docs, upsert_embeddings, stale_ids, results = [], [], [], [], []
+    for plan in plans:
+        ids, existing = plan["ids"], plan["existing"]
+        embedding_by_id = {chunk_id: embedding for chunk_id, _, embedding in plan["reuse"]}
+        for chunk_id, doc in plan["embed"]:
+            embedding_by_id[chunk_id] = new_embedding_by_hash[doc.metadata["content_hash"]]
+        for chunk_id, doc in plan["reuse"] + [(chunk_id, doc, None) for chunk_id, doc in plan["embed"]]:
+            upsert_ids.append(chunk_id)
+            upsert_docs.append(doc)
+            upsert_embeddings.append(list(embedding_by_id[chunk_id]))
+        for chunk_id in ids:
+            if chunk_id not in embedding_by_id and existing.get(chunk_id, {}).get("embedding") is not None:
+                embedding_by_id[chunk_id] = existing[chunk_id]["embedding"]
+        mean_embedding = None
+        if ids and len(embedding_by_id) == len(ids):
+            mean_embedding = np.mean(np.asarray([embedding_by_id[chunk_id] for chunk_id in ids], dtype=np.float32), axis=0)
+        wanted_ids = set(ids)
+        note_stale_ids = [chunk_id for chunk_id in existing if chunk_id not in wanted_ids]
+        stale_ids.extend(note_stale_ids)
+        results.append({
+            "embedded": len(plan["embed"]),
+            "reused": len(plan["reuse"]),
+            "unchanged": len(ids) - len(plan["embed"]) - len(plan["reuse"]),
+            "deleted": len(note_stale_ids),
+            "mean_embedding": mean_embedding
+        })
+
+    collection = vectorstore._collection
+    with span("chroma_write"):
+        if unchanged_ids:
+            collection.update(ids=unchanged_ids, metadatas=unchanged_metadatas)
+        if upsert_ids:
+            # Upsert on the deterministic ids, so re-processing a note overwrites instead of duplicating
+            collection.upsert(
+                ids=upsert_ids,
+                embeddings=upsert_embeddings,
+                documents=[doc.page_content for doc in upsert_docs],
+                metadatas=[doc.metadata for doc in upsert_docs]
+            )
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+    return results
+
+
+def delete_note_chunks(vectorstore, note_id):
+    """Removes every chunk of a note from ChromaDB. Returns the number of chunks deleted."""
+    existing = vectorstore.get(where={"note_id": str(note_id)}, include=[])
+    chunk_ids = existing.get("ids", [])
+    if chunk_ids:
+        vectorstore.delete(ids=chunk_ids)
+    return len(chunk_ids)
@@ -0,0 +1,226 @@
+# backend/observability.py
+"""
+Logging, trace ids and stage timing metrics.
+
+- `logger` is the leveled application logger (LOG_LEVEL, LOG_FORMAT=json|text), set up by
+  configure(). Every record carries the trace id of the request it belongs to.
+- `span("stage")` times a block of work and records it in a Prometheus histogram; with
+  METRICS_ENABLED=false it is a no-op.
+- `render_prometheus()` produces the text exposition format served on /metrics.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+METRICS_ENABLED = True # Set from the environment by configure()
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# --- Trace ids ---
+
+def new_trace_id(incoming=None):
+    """Starts a trace for the current request/job (reusing an incoming id when given)."""
+    trace_id = (incoming or uuid.uuid4().hex)[:64]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+# --- Logging ---
+
+class _TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+logger = logging.getLogger("noteverse")
+
+
+def configure(app=None):
+    """
+    Sets up logging (LOG_LEVEL, LOG_FORMAT) and metrics (METRICS_ENABLED) from the environment.
+    Call after load_dotenv(). With a Flask app, also installs per-request tracing.
+    """
+    global METRICS_ENABLED
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+    _configure_logging()
+    if app is not None:
+        _init_app(app)
+    return logger
+
+
+def _configure_logging():
+    root = logger
+    if root.handlers:
+        return root
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        handler.setFormatter(_JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+    handler.addFilter(_TraceIdFilter())
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.propagate = False
+    return root
+
+
+def get_logger(name):
+    """Child logger of 'noteverse' for a module."""
+    return logger.getChild(name)
+
+
+# --- Metrics ---
+
+class Histogram:
+    """Minimal thread-safe Prometheus histogram with labels."""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(labels, list(series)) for labels, series in items]
+        for labelvalues, series in items:
+            labels = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """Minimal thread-safe Prometheus counter with labels."""
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            labels = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(self.labelnames, labelvalues))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+STAGE_SECONDS = register(Histogram(
+    "noteverse_stage_duration_seconds", "Time spent in each processing stage.", ["stage"]
+))
+REQUEST_SECONDS = register(Histogram(
+    "noteverse_http_request_duration_seconds", "HTTP request latency by endpoint.", ["endpoint", "method", "status"]
+))
+STAGE_ERRORS = register(Counter(
+    "noteverse_stage_errors_total", "Processing stages that raised an exception.", ["stage"]
+))
+
+
+@contextmanager
+def span(stage):
+    """Times a processing stage: `with span("embedding"): ...`."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("stage %s took %.1f ms", stage, elapsed * 1000.0)
+
+
+def render_prometheus():
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def _init_app(app):
+    """Per-request trace ids (X-Request-ID in, X-Trace-Id out) and request latency histograms."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        g.trace_id = new_trace_id(request.headers.get("X-Request-ID"))
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_trace(response):
+        response.headers["X-Trace-Id"] = g.get("trace_id", current_trace_id())
+        started = g.get("request_started")
+        if METRICS_ENABLED and started is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, request.url_rule.rule if request.url_rule else "unmatched",
+                                    request.method, str(response.status_code))
+        return response
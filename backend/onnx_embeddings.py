@@ -0,0 +1,332 @@
+# backend/onnx_embeddings.py
+"""
+ONNX Runtime inference for the sentence-transformers embedding model, optionally int8-quantized.
+
+The PyTorch model (transformer + mean pooling) is exported once to ONNX, with pooling inside
+the graph, and quantized with dynamic int8 quantization of its weights. On CPU the int8 model
+needs about a quarter of the memory and noticeably less time per chunk. With
+EMBEDDING_BACKEND=onnx the API uses it for both the ChromaDB embedding function
+(OnnxEmbeddings) and KeyBERT (keybert_backend()), which share one session per process.
+
+Export writes to onnx_models/<model>/ (model.onnx, model.int8.onnx, the tokenizer and
+onnx_config.json), then checks the exported models against the PyTorch embeddings; an int8
+model whose embeddings drift too far from them is marked as failed and the fp32 one is used.
+
+Examples:
+    python onnx_embeddings.py export --model paraphrase-multilingual-MiniLM-L12-v2
+    python onnx_embeddings.py check --model-dir onnx_models/paraphrase-multilingual-MiniLM-L12-v2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from observability import get_logger
+
+logger = get_logger("onnx")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODELS_DIR = os.path.join(BACKEND_DIR, "onnx_models")
+CONFIG_FILE = "onnx_config.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+BATCH_SIZE = 32
+MIN_COSINE = 0.98 # Lowest acceptable cosine similarity to the PyTorch embedding of a text
+MIN_NEIGHBOUR_OVERLAP = 0.9 # Mean overlap of the top-10 nearest neighbours with PyTorch's
+
+# Check texts: note-like sentences in the languages the notes are written in
+CHECK_TEXTS = [
+    "A process scheduler decides which ready process runs next on the CPU.",
+    "Round robin gives every process a fixed time quantum.",
+    "Shortest job first minimises the average waiting time.",
+    "The page table maps virtual pages to physical frames.",
+    "A TLB caches recent address translations to avoid extra memory lookups.",
+    "Starvation: a process waits indefinitely because others are always preferred.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The mitochondria is the powerhouse of the cell.",
+    "Newton's second law: force equals mass times acceleration.",
+    "An ideal gas obeys PV = nRT at low pressure and high temperature.",
+    "Supply and demand determine the market price of a good.",
+    "The French Revolution began in 1789 with the storming of the Bastille.",
+    "Binary search halves the search interval at every step: O(log n).",
+    "A hash table maps keys to buckets with a hash function.",
+    "Dijkstra's algorithm finds shortest paths from a single source with non-negative weights.",
+    "Derivative of sin(x) is cos(x); integral of 1/x is ln|x|.",
+    "प्रकाश संश्लेषण में पौधे सूर्य के प्रकाश से भोजन बनाते हैं।",
+    "ऑपरेटिंग सिस्टम प्रोसेस और मेमोरी का प्रबंधन करता है।",
+    "भारत का संविधान 26 जनवरी 1950 को लागू हुआ।",
+    "न्यूटन के गति के तीन नियम हैं।",
+    "प्रकाशसंश्लेषण ही वनस्पतींची अन्न तयार करण्याची प्रक्रिया आहे.",
+    "संगणकातील मेमरीचे व्यवस्थापन ऑपरेटिंग सिस्टम करते.",
+    "scheduling", "paging", "deadlock", "memory", "kernel", "threads", "photosynthesis", "democracy",
+]
+
+
+def default_model_dir(model_name):
+    return os.path.join(DEFAULT_MODELS_DIR, model_name.split('/')[-1])
+
+
+def _same_model(a, b):
+    return a.split('/')[-1] == b.split('/')[-1]
+
+
+# --- Inference ---
+
+class OnnxEncoder:
+    """Sentence embeddings from an exported model with ONNX Runtime (thread-safe)."""
+
+    def __init__(self, model_dir, quantized=True, threads=0, batch_size=BATCH_SIZE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.config = load_config(model_dir)
+        self.model_name = self.config["model_name"]
+        self.max_seq_length = self.config["max_seq_length"]
+        self.input_names = self.config["input_names"]
+        self.batch_size = batch_size
+        # The int8 model is skipped if it failed the accuracy check
+        use_int8 = quantized and self.config.get("quantized") and self.config.get("int8_passed") is not False
+        model_file = INT8_FILE if use_int8 else FP32_FILE
+        self.model_file = model_file
+        self.quantized = model_file == INT8_FILE
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def encode(self, texts, batch_size=None):
+        """Embeddings of texts as a float32 array, one row per text."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.config.get("dimension", 0)), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+        # Batches of similar lengths need less padding
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        embeddings = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            indexes = order[start:start + batch_size]
+            encoded = self.tokenizer([texts[i] for i in indexes], padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors="np")
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            for i, vector in zip(indexes, self.session.run(None, feeds)[0]):
+                embeddings[i] = vector
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def load_encoder(model_dir, model_name=None, quantized=True, threads=0):
+    """
+    The process-wide OnnxEncoder of a model directory (the embedding function and KeyBERT
+    share it). Raises ValueError if the directory holds another model than model_name.
+    """
+    key = (os.path.abspath(model_dir), quantized)
+    with _encoders_lock:
+        encoder = _encoders.get(key)
+        if encoder is None:
+            encoder = _encoders[key] = OnnxEncoder(model_dir, quantized=quantized, threads=threads)
+            logger.info("ONNX model '%s' loaded from %s (%s).",
+                        encoder.model_name, model_dir, 'int8' if encoder.quantized else 'fp32')
+    if model_name and not _same_model(model_name, encoder.model_name):
+        raise ValueError(f"{model_dir} holds '{encoder.model_name}', not '{model_name}'.")
+    return encoder
+
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError: # Only needed by the API; export/check run without LangChain
+    Embeddings = object
+
+
+class OnnxEmbeddings(Embeddings):
+    """LangChain embedding function (for Chroma) over an OnnxEncoder."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.model_name = encoder.model_name
+
+    def embed_documents(self, texts):
+        # As HuggingFaceEmbeddings, which the collections were built with
+        return self.encoder.encode([text.replace("\n", " ") for text in texts]).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def keybert_backend(encoder):
+    """A KeyBERT embedding backend over an OnnxEncoder: `KeyBERT(model=keybert_backend(encoder))`."""
+    from keybert.backend import BaseEmbedder
+
+    class OnnxKeyBERTBackend(BaseEmbedder):
+        def __init__(self):
+            super().__init__()
+            self.embedding_model = encoder
+
+        def embed(self, documents, verbose=False):
+            return encoder.encode(list(documents))
+
+    return OnnxKeyBERTBackend()
+
+
+# --- Export and accuracy check ---
+
+def export(model_name, output_dir, opset=14, quantize=True):
+    """Exports the model (with pooling) to ONNX and, with quantize, an int8 copy. Returns the config."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    pooling = model[1].get_config_dict() if len(model) > 1 else {}
+    if pooling and not pooling.get("pooling_mode_mean_tokens"):
+        raise ValueError(f"Only mean-pooling models are supported (pooling of {model_name}: {pooling}).")
+    normalize = any(type(module).__name__ == "Normalize" for module in model)
+    tokenizer = model.tokenizer
+    sample = tokenizer(["Export sample text.", "A second, longer export sample text."], padding=True,
+                       return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class PooledModel(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            inputs = dict(zip(input_names, inputs))
+            hidden = self.transformer(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(pooled, p=2, dim=1) if normalize else pooled
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    with torch.no_grad():
+        torch.onnx.export(PooledModel(), tuple(sample[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=["sentence_embedding"],
+                          dynamic_axes={**axes, "sentence_embedding": {0: "batch"}},
+                          opset_version=opset, do_constant_folding=True)
+    tokenizer.save_pretrained(output_dir)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(output_dir, INT8_FILE), weight_type=QuantType.QInt8)
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "normalize": normalize,
+        "input_names": input_names,
+        "opset": opset,
+        "quantized": quantize
+    }
+    write_config(output_dir, config)
+    return config
+
+
+def load_config(model_dir):
+    with open(os.path.join(model_dir, CONFIG_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_config(model_dir, config):
+    with open(os.path.join(model_dir, CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+
+def _normalize_rows(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def compare_embeddings(reference, candidate, k=10):
+    """Cosine similarity per text and top-k nearest-neighbour overlap between two embeddings of the same texts."""
+    reference, candidate = _normalize_rows(reference), _normalize_rows(candidate)
+    cosines = np.sum(reference * candidate, axis=1)
+    k = min(k, len(reference) - 1)
+    overlaps = []
+    if k > 0:
+        reference_neighbours = np.argsort(-(reference @ reference.T), axis=1)[:, 1:k + 1]
+        candidate_neighbours = np.argsort(-(candidate @ candidate.T), axis=1)[:, 1:k + 1]
+        overlaps = [len(set(a) & set(b)) / k for a, b in zip(reference_neighbours, candidate_neighbours)]
+    return {
+        "mean_cosine": round(float(np.mean(cosines)), 5),
+        "min_cosine": round(float(np.min(cosines)), 5),
+        "neighbour_overlap": round(float(np.mean(overlaps)), 4) if overlaps else 1.0
+    }
+
+
+def check(model_dir, texts=None):
+    """Compares the fp32 and int8 ONNX embeddings with PyTorch's. Returns {variant: metrics, ..., "passed": bool}."""
+    from sentence_transformers import SentenceTransformer
+
+    config = load_config(model_dir)
+    texts = texts or CHECK_TEXTS
+    reference = SentenceTransformer(config["model_name"], device="cpu").encode(texts, convert_to_numpy=True)
+    results = {}
+    for variant, quantized in (("fp32", False), ("int8", True)):
+        if quantized and not config.get("quantized"):
+            continue
+        results[variant] = compare_embeddings(reference, OnnxEncoder(model_dir, quantized=quantized).encode(texts))
+    results["passed"] = all(metrics["min_cosine"] >= MIN_COSINE and metrics["neighbour_overlap"] >= MIN_NEIGHBOUR_OVERLAP
+                            for variant, metrics in results.items())
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the embedding model to (int8) ONNX and check its accuracy.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export, quantize and check a model.")
+    export_parser.add_argument("--model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    export_parser.add_argument("--output", default=None, help="Model directory (default: onnx_models/<model>).")
+    export_parser.add_argument("--opset", type=int, default=14)
+    export_parser.add_argument("--no-quantize", action="store_true", help="Only export the fp32 model.")
+    check_parser = subparsers.add_parser("check", help="Compare an exported model's embeddings with PyTorch's.")
+    check_parser.add_argument("--model-dir", required=True)
+    check_parser.add_argument("--texts", default=None, help="File with one text per line (default: built-in samples).")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "export":
+        model_dir = args.output or default_model_dir(args.model)
+        print(f"Exporting '{args.model}' to {model_dir}...")
+        config = export(args.model, model_dir, opset=args.opset, quantize=not args.no_quantize)
+        texts = None
+    else:
+        model_dir = args.model_dir
+        config = load_config(model_dir)
+        texts = None
+        if args.texts:
+            with open(args.texts, 'r', encoding='utf-8') as f:
+                texts = [line.strip() for line in f if line.strip()]
+
+    results = check(model_dir, texts)
+    for variant in ("fp32", "int8"):
+        if variant in results:
+            metrics = results[variant]
+            size_mb = os.path.getsize(os.path.join(model_dir, FP32_FILE if variant == "fp32" else INT8_FILE)) / 1e6
+            print(f"{variant}: {size_mb:.0f} MB, cosine to PyTorch mean {metrics['mean_cosine']:.4f} "
+                  f"min {metrics['min_cosine']:.4f}, top-10 neighbour overlap {metrics['neighbour_overlap']:.2f}")
+    config["check"] = results
+    if "int8" in results:
+        metrics = results["int8"]
+        config["int8_passed"] = metrics["min_cosine"] >= MIN_COSINE and metrics["neighbour_overlap"] >= MIN_NEIGHBOUR_OVERLAP
+        if not config["int8_passed"]:
+            # The API then loads the fp32 ONNX model instead
+            print(f"int8 model below the accuracy thresholds (cosine >= {MIN_COSINE}, overlap >= "
+                  f"{MIN_NEIGHBOUR_OVERLAP}); the fp32 ONNX model will be used.")
+    write_config(model_dir, config)
+    return 0 if results.get("fp32", {}).get("min_cosine", 0) >= MIN_COSINE else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
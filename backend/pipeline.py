@@ -0,0 +1,323 @@
+# backend/pipeline.py
+"""
+Note ingestion stages shared by the API (upload_note) and the offline evaluator (evaluate.py).
+Keyword extraction lives in keywords.py.
+
+Each stage takes its model/client explicitly so it can run inside the Flask process or in a
+separate evaluation worker process.
+"""
+import base64
+import io
+import os
+
+import cv2
+import fitz # PyMuPDF, for PDF text layers
+import numpy as np
+from pdf2image import convert_from_bytes, convert_from_path
+
+from observability import span
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png')
+
+VISION_EXTRACTION_PROMPT = (
+    "Extract all text from this image as accurately as possible. Pay close attention to handwritten "
+    "content and formatting. Do not add any new information."
+)
+OCR_CLEANUP_PROMPT = (
+    "You are a highly accurate text corrector and interpreter. Your task is to take raw, potentially erroneous "
+    "OCR text, correct typos, fix grammar, make it readable, and infer contextually accurate words where the OCR "
+    "failed. **Crucially, you must preserve the original language of the input text.** Do not translate. If the "
+    "input is Hindi, your output must be in Hindi. If the input is Marathi, output in Marathi. If English, output "
+    "in English. Do not add new information not present in the original text. Maintain the original meaning. "
+    "Respond only with the corrected text."
+)
+
+
+def encode_image(image_path):
+    """Reads an image file and returns it as a Base64 string."""
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+
+def encode_pil_image(image, format='JPEG'):
+    """Encodes a PIL image to a Base64 string in memory."""
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def rasterize_pdf(file_path, dpi=300, data=None, **options):
+    """
+    Converts PDF pages to PIL images (requires Poppler). `data` holds the file in memory;
+    other options (first_page, last_page...) are passed to pdf2image.
+    """
+    poppler_path = os.getenv("POPPLER_PATH")
+    if poppler_path and not os.path.exists(poppler_path):
+        poppler_path = None # Allow pdf2image to search system PATH
+    if data is not None:
+        return convert_from_bytes(data, dpi=dpi, poppler_path=poppler_path, **options)
+    return convert_from_path(file_path, dpi=dpi, poppler_path=poppler_path, **options)
+
+
+# The file_to_* loaders take the file's bytes as `data` when the upload is still in memory;
+# file_path then only provides the extension and nothing is read from disk.
+
+def file_to_base64_images(file_path, dpi=300, data=None):
+    """Returns one Base64 JPEG/PNG per page of a PDF or image file."""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == '.pdf':
+        with span("rasterization"):
+            pages = rasterize_pdf(file_path, dpi=dpi, data=data)
+        with span("base64_encoding"):
+            return [encode_pil_image(page_img) for page_img in pages]
+    if file_extension in ('.jpg', '.jpeg', '.png'):
+        with span("base64_encoding"):
+            if data is not None:
+                return [base64.b64encode(data).decode('utf-8')]
+            return [encode_image(file_path)]
+    raise ValueError(f"Unsupported file type: {file_extension}. Only JPG, PNG, and PDF are supported.")
+
+
+# --- Image preprocessing for the vision model ---
+# The vision model downsizes every image so that its short side is at most 768 px (and its long
+# side at most 2048 px) before reading it, so sending more pixels than that only costs upload
+# bytes. Preprocessing straightens and crops the page, drops colour, resizes it to that
+# resolution and re-encodes it as a compact JPEG; pages much taller than wide (long scans,
+# phone screenshots) are split into overlapping tiles so each tile keeps its own resolution.
+DEFAULT_PREPROCESS = {
+    "dpi": 200, # PDF rasterization resolution; A4 at 200 DPI is still ~2x the model's resolution
+    "grayscale": True,
+    "deskew": True,
+    "max_skew_degrees": 5.0,
+    "crop_margins": True,
+    "max_short_side": 768,
+    "max_long_side": 2048,
+    "tile_aspect": 2.0, # Pages taller than tile_aspect x their width are tiled
+    "jpeg_quality": 80,
+}
+
+
+def preprocess_options_from_env():
+    """DEFAULT_PREPROCESS overridden by VISION_* environment variables; None if VISION_PREPROCESS=false."""
+    if os.getenv("VISION_PREPROCESS", "true").lower() in ("0", "false", "no"):
+        return None
+    options = dict(DEFAULT_PREPROCESS)
+    options["jpeg_quality"] = int(os.getenv("VISION_JPEG_QUALITY", options["jpeg_quality"]))
+    options["max_short_side"] = int(os.getenv("VISION_MAX_SHORT_SIDE", options["max_short_side"]))
+    options["max_long_side"] = int(os.getenv("VISION_MAX_LONG_SIDE", options["max_long_side"]))
+    options["tile_aspect"] = float(os.getenv("VISION_TILE_ASPECT", options["tile_aspect"]))
+    options["grayscale"] = os.getenv("VISION_GRAYSCALE", "true").lower() not in ("0", "false", "no")
+    return options
+
+
+def _ink_mask(gray):
+    """Binary mask (255 = ink) of a grayscale page, robust to uneven paper tone."""
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return mask
+
+
+def rotate_image(image, angle, border_value=255):
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border_value)
+
+
+def estimate_skew(gray, max_angle=5.0, step=0.25):
+    """
+    Skew angle (degrees, to pass to rotate_image) that best aligns text lines horizontally:
+    the rotation whose row ink profile has the highest variance (sharpest line/gap contrast).
+    Works on a small copy of the page, so it costs a few milliseconds.
+    """
+    scale = min(1.0, 800.0 / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    mask = _ink_mask(small)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        profile = rotate_image(mask, float(angle), border_value=0).sum(axis=1, dtype=np.float64)
+        score = float(np.var(profile))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def content_bounds(gray, padding=16, min_ink_fraction=0.002):
+    """(top, bottom, left, right) of the rows/columns containing ink, plus some padding."""
+    mask = _ink_mask(gray)
+    height, width = mask.shape
+    rows = np.flatnonzero(mask.sum(axis=1) > 255 * width * min_ink_fraction)
+    columns = np.flatnonzero(mask.sum(axis=0) > 255 * height * min_ink_fraction)
+    if rows.size == 0 or columns.size == 0:
+        return 0, height, 0, width # Blank page: nothing to crop to
+    return (max(0, rows[0] - padding), min(height, rows[-1] + 1 + padding),
+            max(0, columns[0] - padding), min(width, columns[-1] + 1 + padding))
+
+
+def resize_for_vision(image, max_short_side=768, max_long_side=2048):
+    """Downscales (never upscales) so both sides fit the model's effective resolution."""
+    height, width = image.shape[:2]
+    scale = min(1.0, max_short_side / min(height, width), max_long_side / max(height, width))
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def split_tiles(image, tile_aspect=2.0, overlap=0.05):
+    """Splits a page taller than tile_aspect x its width into vertically overlapping tiles."""
+    height, width = image.shape[:2]
+    if not tile_aspect or height <= width * tile_aspect:
+        return [image]
+    tile_height = int(width * tile_aspect * 0.75) # Aim for ~1.5:1 tiles
+    step = max(1, int(tile_height * (1.0 - overlap)))
+    tiles = []
+    for top in range(0, height, step):
+        tiles.append(image[top:top + tile_height])
+        if top + tile_height >= height:
+            break
+    return tiles
+
+
+def encode_jpeg(image, quality=80):
+    """Encodes an OpenCV image (gray or BGR) as a Base64 JPEG string."""
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("OpenCV failed to encode the page image.")
+    return base64.b64encode(buffer.tobytes()).decode('utf-8')
+
+
+def preprocess_page(rgb_image, options=None):
+    """Deskew, crop, grayscale, downscale and tile one page. Returns its Base64 JPEG tiles."""
+    options = options or DEFAULT_PREPROCESS
+    gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+    if options.get("deskew"):
+        angle = estimate_skew(gray, options.get("max_skew_degrees", 5.0))
+        if abs(angle) >= 0.25:
+            gray = rotate_image(gray, angle)
+            if not options.get("grayscale"):
+                rgb_image = rotate_image(rgb_image, angle, border_value=(255, 255, 255))
+    page = gray if options.get("grayscale") else cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+    if options.get("crop_margins"):
+        top, bottom, left, right = content_bounds(gray)
+        page = page[top:bottom, left:right]
+    tiles = []
+    for tile in split_tiles(page, options.get("tile_aspect")):
+        tile = resize_for_vision(tile, options["max_short_side"], options["max_long_side"])
+        tiles.append(encode_jpeg(tile, options["jpeg_quality"]))
+    return tiles
+
+
+def file_to_vision_pages(file_path, options=None, data=None):
+    """
+    Returns, per page of a PDF or image file, the list of preprocessed Base64 JPEG tiles to
+    send to the vision model (usually one tile per page).
+    """
+    options = options or DEFAULT_PREPROCESS
+    with span("rasterization"):
+        rgb_images = file_to_rgb_images(file_path, dpi=options.get("dpi", 200), data=data)
+    with span("preprocessing"):
+        return [preprocess_page(rgb_image, options) for rgb_image in rgb_images]
+
+
+def pdf_text_layer_pages(file_path, data=None, min_chars=50):
+    """
+    Per page of a PDF, whether it has a text layer of at least min_chars characters, i.e. is
+    a typed/digital page rather than a scan. Returns None for other files.
+    """
+    if os.path.splitext(file_path)[1].lower() != '.pdf':
+        return None
+    with fitz.open(stream=data, filetype="pdf") if data is not None else fitz.open(file_path) as doc:
+        return [len(page.get_text().strip()) >= min_chars for page in doc]
+
+
+def extract_text_with_vision(openai_client, base64_images, model="gpt-4o-mini"):
+    """
+    Transcribes each page image with an LLM vision model. Returns one text per page.
+    An entry may also be a list of tiles of the same page (see file_to_vision_pages),
+    which are sent together in one request.
+    """
+    pages = []
+    for page_images in base64_images:
+        tiles = [page_images] if isinstance(page_images, str) else list(page_images)
+        prompt = VISION_EXTRACTION_PROMPT
+        if len(tiles) > 1:
+            prompt += " The images are consecutive, slightly overlapping parts of one page, top to bottom; transcribe the page once."
+        content = [{"type": "text", "text": prompt}]
+        content += [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{tile}"}} for tile in tiles]
+        with span("vision_call"):
+            llm_response = openai_client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": content}],
+                temperature=0.1,
+                max_tokens=4000
+            )
+        pages.append(llm_response.choices[0].message.content.strip())
+    return pages
+
+
+def payload_bytes(base64_images):
+    """Total Base64 bytes of pages/tiles as sent to the vision model."""
+    return sum(len(tile) for page in base64_images for tile in ([page] if isinstance(page, str) else page))
+
+
+def file_to_rgb_images(file_path, dpi=300, data=None):
+    """Loads every page of a PDF or image file as an RGB numpy array."""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == '.pdf':
+        return [np.array(page_img.convert('RGB')) for page_img in rasterize_pdf(file_path, dpi=dpi, data=data)]
+    if data is not None:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        image = cv2.imread(file_path)
+    if image is None:
+        raise ValueError("OpenCV failed to read the image file.")
+    return [cv2.cvtColor(image, cv2.COLOR_BGR2RGB)]
+
+
+def make_thumbnail(file_path, data=None, max_side=320, quality=70):
+    """JPEG bytes of a small preview of the first page, for note listings."""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == '.pdf':
+        first_page = rasterize_pdf(file_path, dpi=48, data=data, first_page=1, last_page=1)[0]
+        image = cv2.cvtColor(np.array(first_page.convert('RGB')), cv2.COLOR_RGB2BGR)
+    elif data is not None:
+        # Decoding at a quarter of the resolution is much faster for large scans
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_4)
+    else:
+        image = cv2.imread(file_path, cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        raise ValueError("OpenCV failed to read the image file.")
+    height, width = image.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("OpenCV failed to encode the thumbnail.")
+    return buffer.tobytes()
+
+
+def extract_text_with_easyocr(reader, rgb_images):
+    """Runs EasyOCR on grayscale versions of the pages. Returns one text per page."""
+    pages = []
+    for rgb_image in rgb_images:
+        gray_img = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+        results = reader.readtext(gray_img)
+        pages.append("".join(result[1] + "\n" for result in results))
+    return pages
+
+
+def clean_text_with_llm(openai_client, raw_text, model="gpt-3.5-turbo"):
+    """LLM post-processing of raw OCR text (typo/grammar fixes, same language)."""
+    llm_response = openai_client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": OCR_CLEANUP_PROMPT},
+            {"role": "user", "content": f"Here is the OCR output. Please clean it up and make it coherent, preserving the original language:\n\n{raw_text}"}
+        ],
+        temperature=0.1,
+        max_tokens=1000
+    )
+    return llm_response.choices[0].message.content.strip()
+
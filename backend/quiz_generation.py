@@ -0,0 +1,227 @@
+# backend/quiz_generation.py
+"""
+Multiple-choice quiz generation with an LLM.
+
+- generate_single() sends the whole note text in one prompt (short notes).
+- generate_map_reduce() handles notes of any length. The note's chunks (the same chunks that
+  are indexed in ChromaDB) are grouped in order into sections of up to SECTION_TOKENS LLM
+  tokens; at most MAX_SECTIONS sections, spread evenly over the note, are sent to the LLM
+  concurrently for a few candidate questions each (map). The final quiz is then selected
+  from all candidates (reduce): malformed and near-duplicate questions are dropped, and MMR
+  over the question embeddings picks questions that are relevant to the note and different
+  from each other.
+"""
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from keywords import mmr
+from observability import get_logger, span
+from rag_context import count_tokens, merge_adjacent_chunks
+from upstreams import UpstreamUnavailable
+
+logger = get_logger("quiz")
+
+QUIZ_MODEL = "gpt-3.5-turbo-1106"
+SECTION_TOKENS = 1500 # LLM tokens of note text per map prompt
+MAX_SECTIONS = 12 # Map prompts per quiz, so latency and cost stay bounded for any note length
+QUESTIONS_PER_SECTION = 3
+MAP_WORKERS = 4
+DUPLICATE_SIMILARITY = 0.92 # Candidates more similar than this to a kept question are duplicates
+DIVERSITY = 0.6
+
+SYSTEM_PROMPT = """You are an expert educator and quiz generator. Your task is to create multiple-choice questions (MCQs) based on the provided text.
+
+            Strictly adhere to the following format and rules:
+
+            Generate exactly {count} MCQs.
+
+            Each MCQ must have:
+
+                A 'question' field (string).
+
+                An 'options' field (an array of 4 strings).
+
+                A 'correct_answer' field (string, one of the options).
+
+            Ensure the questions are clear, directly related to the text, and have one unambiguous correct answer.
+
+            The output MUST be a JSON array of MCQ objects, and nothing else. Do NOT wrap the array in any other object (e.g., no {{"quiz": [...]}}). Do NOT add any introductory or concluding text, or conversational filler.
+
+            All output text must be in English.
+
+            Example JSON format (Note: this is just an example of one MCQ in the array):
+            [
+            {{
+            "question": "What is the capital of France?",
+            "options": ["Berlin", "Madrid", "Paris", "Rome"],
+            "correct_answer": "Paris"
+            }}
+            ]
+            """
+
+
+def parse_mcqs(content):
+    """
+    Parses the LLM's JSON response into a list of MCQs. Raises json.JSONDecodeError or
+    ValueError for responses that are not in a quiz format.
+    """
+    # response_format={"type": "json_object"} makes the model return a single JSON object,
+    # so the array the prompt asks for often arrives wrapped or as a lone MCQ
+    parsed = json.loads(content)
+    if isinstance(parsed, list):
+        mcqs = parsed
+    elif isinstance(parsed, dict) and "question" in parsed and "options" in parsed:
+        mcqs = [parsed]
+    elif isinstance(parsed, dict):
+        wrapped = parsed.get("quiz", parsed.get("questions", parsed.get("mcqs")))
+        if isinstance(wrapped, list):
+            mcqs = wrapped
+        elif isinstance(wrapped, dict):
+            mcqs = [wrapped]
+        else:
+            raise ValueError("LLM response not in expected quiz format. It's not a list, an object with a 'quiz' key, or a single MCQ object.")
+    else:
+        raise ValueError("LLM response not in expected quiz format.")
+    if not mcqs:
+        raise ValueError("Generated MCQs list is empty after parsing.")
+    return mcqs
+
+
+def is_valid_mcq(mcq):
+    """A question with 4 distinct options, one of which is the correct answer."""
+    if not isinstance(mcq, dict):
+        return False
+    options = mcq.get("options")
+    return (
+        isinstance(mcq.get("question"), str) and mcq["question"].strip() != ""
+        and isinstance(options, list) and len(options) == 4 and len(set(map(str, options))) == 4
+        and mcq.get("correct_answer") in options
+    )
+
+
+def request_mcqs(client, text, count, model=QUIZ_MODEL, max_tokens=1500, temperature=0.5):
+    """One chat completion asking for `count` MCQs (e.g. 3 or "3 to 5") about text."""
+    llm_response = client.chat.completions.create(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT.format(count=count)},
+            {"role": "user", "content": f"Generate MCQs based on the following text:\n\n{text}"}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    content = llm_response.choices[0].message.content.strip()
+    logger.debug("Raw LLM response from OpenAI (first 500 chars): %s...", content[:500])
+    return parse_mcqs(content)
+
+
+def generate_single(client, note_text, model=QUIZ_MODEL):
+    """3 to 5 MCQs from one prompt over the whole note text."""
+    with span("quiz_llm"):
+        return request_mcqs(client, note_text, "3 to 5", model=model)
+
+
+def build_sections(docs, section_tokens=SECTION_TOKENS, max_sections=MAX_SECTIONS):
+    """
+    Groups consecutive chunks (Documents with chunk_index metadata) into section texts of up
+    to section_tokens LLM tokens, then keeps at most max_sections of them spread evenly over
+    the note.
+    """
+    docs = sorted(docs, key=lambda doc: doc.metadata.get("chunk_index", 0))
+    groups, current, current_tokens = [], [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if current and current_tokens + tokens > section_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(doc)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    # Adjacent chunks of a group are merged back into one passage without their overlap
+    sections = ["\n".join(passage.page_content for passage in merge_adjacent_chunks(group)) for group in groups]
+    if len(sections) > max_sections:
+        picked = np.linspace(0, len(sections) - 1, max_sections).round().astype(int)
+        sections = [sections[i] for i in sorted(set(picked.tolist()))]
+    return sections
+
+
+def _normalize_rows(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def select_questions(mcqs, embed=None, count=5, note_embedding=None, duplicate_similarity=DUPLICATE_SIMILARITY,
+                     diversity=DIVERSITY):
+    """
+    Picks `count` questions from the candidates. Without an embedding function, exact
+    duplicates are dropped and the first candidates kept.
+    """
+    unique, seen = [], set()
+    for mcq in mcqs:
+        key = " ".join(mcq["question"].lower().split())
+        if key not in seen:
+            seen.add(key)
+            unique.append(mcq)
+    if embed is None or len(unique) <= 1:
+        return unique[:count]
+
+    # The answer is part of what a question tests: the same question about another fact is not a duplicate
+    vectors = _normalize_rows(np.asarray(
+        embed([f"{mcq['question']} {mcq['correct_answer']}" for mcq in unique]), dtype=np.float32
+    ))
+    kept = []
+    for i in range(len(unique)):
+        if not kept or float(np.max(vectors[kept] @ vectors[i])) < duplicate_similarity:
+            kept.append(i)
+    if len(kept) <= count:
+        return [unique[i] for i in kept]
+
+    if note_embedding is None:
+        note_embedding = vectors[kept].mean(axis=0)
+    note_vector = _normalize_rows(np.asarray(note_embedding, dtype=np.float32)[None, :])[0]
+    selected = mmr(note_vector, vectors[kept], kept, top_n=count, diversity=diversity)
+    # Present the questions in note order (sections are generated in order)
+    return [unique[i] for i in sorted(index for index, _ in selected)]
+
+
+def generate_map_reduce(client, docs, embed=None, count=5, note_embedding=None, model=QUIZ_MODEL,
+                        questions_per_section=QUESTIONS_PER_SECTION, section_tokens=SECTION_TOKENS,
+                        max_sections=MAX_SECTIONS, workers=MAP_WORKERS):
+    """
+    `count` MCQs from the chunks of a note (see the module docstring). embed maps a list of
+    texts to vectors (the index's embedding function); note_embedding is the mean chunk
+    vector of the note, if known. Sections whose generation fails are skipped; ValueError is
+    raised if no section produced a valid question (UpstreamUnavailable if the LLM's circuit
+    breaker opened before any did).
+    """
+    sections = build_sections(docs, section_tokens, max_sections)
+    if not sections:
+        raise ValueError("Note has no text to generate questions from.")
+    per_section = max(questions_per_section, -(-count // len(sections))) # Enough candidates even for few sections
+
+    def generate(section):
+        return request_mcqs(client, section, per_section, model=model, max_tokens=250 * per_section + 200)
+
+    with span("quiz_map"):
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sections)))) as executor:
+            # Each call runs in a copy of the request context, so its logs keep the trace id
+            futures = [executor.submit(contextvars.copy_context().run, generate, section) for section in sections]
+            candidates, unavailable = [], None
+            for i, future in enumerate(futures):
+                try:
+                    candidates.extend(mcq for mcq in future.result() if is_valid_mcq(mcq))
+                except UpstreamUnavailable as e:
+                    unavailable = e
+                except Exception as e:
+                    logger.warning("Quiz generation failed for section %d of %d: %s", i + 1, len(sections), e)
+    if not candidates and unavailable is not None:
+        raise unavailable
+    if not candidates:
+        raise ValueError("No valid questions were generated for any section of the note.")
+    logger.info("Generated %d candidate questions from %d sections.", len(candidates), len(sections))
+    with span("quiz_reduce"):
+        return select_questions(candidates, embed, count, note_embedding)
@@ -0,0 +1,165 @@
+# backend/rag_context.py
+"""
+Context assembly for RAG queries.
+
+Turns the raw chunks returned by the vectorstore into a compact prompt context:
+overlapping/duplicate chunk text is removed, adjacent chunks of the same note are
+merged back together, chunks are optionally re-ranked with a cross-encoder, and the
+result is packed into a fixed token budget.
+"""
+from langchain.schema import Document
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base") # Tokenizer used by gpt-3.5-turbo / gpt-4o family
+except Exception:
+    _encoding = None # Fall back to a character-based estimate
+
+# Chunk overlap is at most a few hundred characters (200 for notes chunked by character count,
+# far less for token-sized chunks), so never search further than this for a shared suffix/prefix.
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 20
+
+
+def count_tokens(text):
+    """Counts LLM tokens in text (approximate when tiktoken is not installed)."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4) # ~4 characters per token for English text
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text down to at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _overlap_length(left, right):
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    limit = min(len(left), len(right), MAX_OVERLAP_CHARS)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _normalize(text):
+    return " ".join(text.split()).lower()
+
+
+def deduplicate_chunks(docs):
+    """
+    Drops chunks whose text is identical to, or fully contained in, a higher-ranked chunk.
+    Input order is treated as rank order and is preserved.
+    """
+    kept = []
+    kept_normalized = []
+    for doc in docs:
+        normalized = _normalize(doc.page_content)
+        if not normalized:
+            continue
+        if any(normalized in other for other in kept_normalized):
+            continue
+        kept.append(doc)
+        kept_normalized.append(normalized)
+    return kept
+
+
+def merge_adjacent_chunks(docs):
+    """
+    Merges consecutive chunks (by chunk_index) of the same note into one passage,
+    stripping the text they share because of the splitter overlap.
+    Each merged passage keeps the rank of its best-ranked chunk.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        note_id = doc.metadata.get('note_id')
+        chunk_index = doc.metadata.get('chunk_index')
+        if note_id is None or chunk_index is None:
+            groups[("__unmerged__", rank)] = [(rank, doc)]
+            continue
+        groups.setdefault(note_id, []).append((rank, doc))
+
+    passages = []
+    for members in groups.values():
+        members.sort(key=lambda item: item[1].metadata.get('chunk_index', 0))
+        current = None
+        for rank, doc in members:
+            index = doc.metadata.get('chunk_index')
+            if current is not None and index is not None and index == current["last_index"] + 1:
+                overlap = _overlap_length(current["text"], doc.page_content)
+                current["text"] += ("" if overlap else "\n") + doc.page_content[overlap:]
+                current["last_index"] = index
+                current["rank"] = min(current["rank"], rank)
+                current["chunk_ids"].append(doc.metadata.get('chunk_id'))
+                if doc.metadata.get('page_number') not in current["page_numbers"]:
+                    current["page_numbers"].append(doc.metadata.get('page_number'))
+                continue
+            if current is not None:
+                passages.append(current)
+            current = {
+                "text": doc.page_content,
+                "last_index": index,
+                "rank": rank,
+                "metadata": dict(doc.metadata),
+                "chunk_ids": [doc.metadata.get('chunk_id')],
+                "page_numbers": [doc.metadata.get('page_number')],
+            }
+        if current is not None:
+            passages.append(current)
+
+    passages.sort(key=lambda passage: passage["rank"])
+    merged = []
+    for passage in passages:
+        metadata = passage["metadata"]
+        metadata["chunk_ids"] = passage["chunk_ids"]
+        metadata["page_numbers"] = [page for page in passage["page_numbers"] if page is not None]
+        merged.append(Document(page_content=passage["text"], metadata=metadata))
+    return merged
+
+
+def rerank_chunks(question, docs, cross_encoder):
+    """Re-orders docs by cross-encoder relevance to the question (highest first)."""
+    if cross_encoder is None or len(docs) < 2:
+        return docs
+    scores = cross_encoder.predict([(question, doc.page_content) for doc in docs])
+    ranked = sorted(zip(scores, range(len(docs)), docs), key=lambda item: (-float(item[0]), item[1]))
+    return [doc for _, _, doc in ranked]
+
+
+def build_context(question, docs, token_budget, cross_encoder=None, separator="\n\n"):
+    """
+    Builds the context string for a RAG prompt.
+
+    Returns (context_text, used_docs) where used_docs are the merged passages that made it
+    into the context, in the order they appear.
+    """
+    docs = deduplicate_chunks(docs)
+    docs = rerank_chunks(question, docs, cross_encoder)
+    docs = merge_adjacent_chunks(docs)
+
+    separator_tokens = count_tokens(separator)
+    remaining = token_budget
+    parts = []
+    used_docs = []
+    for doc in docs:
+        cost = count_tokens(doc.page_content) + (separator_tokens if parts else 0)
+        if cost <= remaining:
+            parts.append(doc.page_content)
+            used_docs.append(doc)
+            remaining -= cost
+        elif not parts:
+            # The best passage alone exceeds the budget: keep as much of it as fits
+            parts.append(truncate_to_tokens(doc.page_content, remaining))
+            used_docs.append(doc)
+            remaining = 0
+        if remaining <= 0:
+            break
+
+    return separator.join(parts), used_docs
@@ -0,0 +1,330 @@
+# backend/reindex.py
+"""
+Offline bulk re-index of every note into a fresh ChromaDB collection.
+
+Used when switching the embedding model or the chunking parameters: notes are streamed
+from MongoDB in batches, re-chunked (page/heading aware, sized in model tokens), embedded in large batches (optionally across several
+processes) and written to a new collection. When every note is done, the notes uploaded,
+edited or deleted since the run started are replayed into the new collection (repeated until
+a pass finds no more changes), and then the API's collection pointer is swapped atomically;
+restart the API servers to pick it up. Until they restart they keep writing to the old
+collection, so run the same command with --resume <checkpoint> afterwards to replay the
+changes made in between.
+
+Progress is checkpointed after every batch, so an interrupted run continues with --resume.
+
+Example:
+    python reindex.py --embedding-model sentence-transformers/all-MiniLM-L6-v2 --workers 4
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from bson.objectid import ObjectId
+import chromadb
+from sentence_transformers import SentenceTransformer
+
+from note_index import (
+    CHUNK_SIZE, CHUNK_OVERLAP, build_chunk_documents, fit_max_seq_length, load_active_collection,
+    load_chunk_length_function, set_active_collection
+)
+from ann import hnsw_collection_metadata, hnsw_settings_from_env
+from note_bodies import NoteBodyStore
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CHROMA_PATH = os.path.join(BACKEND_DIR, "chroma_db")
+MIN_INDEXED_TEXT_LENGTH = 100 # Same threshold upload_note uses before chunking
+RECONCILE_MARGIN_SECONDS = 60 # Allowance for clock skew between the API servers and this machine
+RECONCILE_MAX_PASSES = 5
+
+
+def parse_args():
+    # The defaults come from the pointer of the store being re-indexed
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--chroma-path", default=DEFAULT_CHROMA_PATH)
+    current = load_active_collection(pre_parser.parse_known_args()[0].chroma_path)
+    # CHROMA_HNSW_* take effect here: the new collection is created with them
+    hnsw = hnsw_settings_from_env(current)
+    parser = argparse.ArgumentParser(description="Re-chunk and re-embed all notes into a new ChromaDB collection.")
+    parser.add_argument("--embedding-model", default=current["embedding_model_name"],
+                        help="Sentence-transformers model to embed with (default: the active one).")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Maximum chunk length in model tokens.")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP, help="Overlap in model tokens.")
+    parser.add_argument("--hnsw-m", type=int, default=hnsw["hnsw_m"])
+    parser.add_argument("--hnsw-ef-construction", type=int, default=hnsw["hnsw_construction_ef"])
+    parser.add_argument("--hnsw-ef-search", type=int, default=hnsw["hnsw_search_ef"])
+    parser.add_argument("--collection", default=None,
+                        help="Name of the collection to build (default: derived from model and time).")
+    parser.add_argument("--chroma-path", default=DEFAULT_CHROMA_PATH)
+    parser.add_argument("--batch-size", type=int, default=64, help="Notes fetched from MongoDB per batch.")
+    parser.add_argument("--encode-batch-size", type=int, default=64, help="Chunks per forward pass of the encoder.")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Encoder processes (0 = encode in this process).")
+    parser.add_argument("--onnx-model-dir", default=None,
+                        help="Encode with this exported ONNX model (onnx_embeddings.py export) instead of PyTorch.")
+    parser.add_argument("--user", default=None, help="Only re-index notes of this user id (no swap).")
+    parser.add_argument("--resume", metavar="CHECKPOINT", default=None,
+                        help="Continue an interrupted run from its checkpoint file.")
+    parser.add_argument("--no-swap", action="store_true", help="Build the collection but keep the current one active.")
+    return parser.parse_args()
+
+
+def default_collection_name(model_name):
+    slug = re.sub(r'[^a-zA-Z0-9]+', '-', model_name.split('/')[-1]).strip('-').lower()[:40]
+    return f"notes-{slug}-{int(time.time())}"
+
+
+def load_checkpoint(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_path, path)
+
+
+class BatchEncoder:
+    """
+    Wraps a SentenceTransformer, encoding either in-process or with a multi-process pool, or
+    the exported ONNX model in onnx_model_dir (see onnx_embeddings.py), with an input window
+    that fits the chunks of the collection settings.
+    """
+
+    def __init__(self, settings, workers, batch_size, onnx_model_dir=None):
+        model_name = settings["embedding_model_name"]
+        self.batch_size = batch_size
+        self.pool = None
+        self.onnx = None
+        if onnx_model_dir:
+            from onnx_embeddings import load_encoder
+            self.onnx = fit_max_seq_length(load_encoder(onnx_model_dir, model_name=model_name), settings)
+            return
+        self.model = fit_max_seq_length(SentenceTransformer(model_name), settings)
+        if workers and workers > 1:
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+    def encode(self, texts):
+        # Match HuggingFaceEmbeddings.embed_documents, which is what the API embeds queries against
+        texts = [text.replace("\n", " ") for text in texts]
+        if self.onnx is not None:
+            embeddings = self.onnx.encode(texts, batch_size=self.batch_size)
+        elif self.pool is not None:
+            embeddings = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        else:
+            embeddings = self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False)
+        return embeddings.tolist()
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def iter_note_batches(notes_collection, query, batch_size):
+    """Streams notes ordered by _id so a checkpointed _id is a valid resume position."""
+    # extracted_text is only inline for notes stored before the body store
+    cursor = notes_collection.find(
+        query,
+        {"_id": 1, "user_id": 1, "original_filename": 1, "upload_date": 1, "extracted_text": 1, "page_offsets": 1}
+    ).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    for note in cursor:
+        batch.append(note)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def index_batch(batch, note_bodies, collection, encoder, settings, length_function, replace=False):
+    """
+    Chunks and embeds a batch of notes into the collection. With replace, chunks a note no
+    longer has (after an edit, or because its text became too short) are deleted.
+    Returns the number of chunks written.
+    """
+    texts = note_bodies.get_many(batch)
+    ids, documents = [], []
+    for note in batch:
+        text = texts[note["_id"]]
+        if len(text.strip()) <= MIN_INDEXED_TEXT_LENGTH:
+            continue
+        note_ids, note_documents = build_chunk_documents(note["_id"], text, {
+            "user_id": note.get("user_id"),
+            "original_filename": note.get("original_filename"),
+            "upload_date": note.get("upload_date")
+        }, chunk_size=settings["chunk_size"], chunk_overlap=settings["chunk_overlap"],
+            page_offsets=note.get("page_offsets"), length_function=length_function)
+        ids.extend(note_ids)
+        documents.extend(note_documents)
+
+    if replace:
+        note_ids = [str(note["_id"]) for note in batch]
+        stored = collection.get(where={"note_id": {"$in": note_ids}}, include=[])["ids"]
+        stale = sorted(set(stored) - set(ids))
+        if stale:
+            collection.delete(ids=stale)
+    if documents:
+        embeddings = encoder.encode([doc.page_content for doc in documents])
+        collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=[doc.page_content for doc in documents],
+            metadatas=[doc.metadata for doc in documents]
+        )
+    return len(documents)
+
+
+def delete_removed_notes(db, collection, scope, page_size=5000):
+    """Deletes the chunks of notes that no longer exist in MongoDB. Returns the number of notes."""
+    indexed, offset = set(), 0
+    while True:
+        # Chunks of notes outside the scope (other users') are not looked up, so must not be listed either
+        page = collection.get(where=dict(scope) or None, include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        indexed.update((metadata or {}).get("note_id") for metadata in page["metadatas"])
+        offset += len(page["ids"])
+    indexed = [note_id for note_id in indexed if note_id and ObjectId.is_valid(note_id)]
+    existing = set()
+    for start in range(0, len(indexed), 1000):
+        existing.update(str(note["_id"]) for note in db.notes.find(
+            dict(scope, _id={"$in": [ObjectId(note_id) for note_id in indexed[start:start + 1000]]}), {"_id": 1}))
+    removed = [note_id for note_id in indexed if note_id not in existing]
+    for start in range(0, len(removed), 1000):
+        collection.delete(where={"note_id": {"$in": removed[start:start + 1000]}})
+    return len(removed)
+
+
+def reconcile(db, note_bodies, collection, encoder, settings, length_function, scope, since, batch_size):
+    """
+    Replays the notes uploaded or edited since `since` (re-chunked, stale chunks removed) and
+    removes the chunks of deleted notes, until a pass finds nothing changed. Returns the time
+    the last pass started, from which a later run continues.
+    """
+    for pass_number in range(1, RECONCILE_MAX_PASSES + 1):
+        pass_started = time.time()
+        changed_query = dict(scope, **{"$or": [{"upload_date": {"$gte": since - RECONCILE_MARGIN_SECONDS}},
+                                               {"updated_date": {"$gte": since - RECONCILE_MARGIN_SECONDS}}]})
+        notes_changed, chunks = 0, 0
+        for batch in iter_note_batches(db.notes, changed_query, batch_size):
+            chunks += index_batch(batch, note_bodies, collection, encoder, settings, length_function, replace=True)
+            notes_changed += len(batch)
+        notes_removed = delete_removed_notes(db, collection, scope)
+        print(f"Catch-up pass {pass_number}: {notes_changed} notes changed since the last pass ({chunks} chunks), "
+              f"{notes_removed} deleted notes removed.")
+        since = pass_started
+        changed_during_pass = db.notes.count_documents(dict(scope, **{"$or": [
+            {"upload_date": {"$gte": pass_started}}, {"updated_date": {"$gte": pass_started}}]}))
+        if notes_removed == 0 and changed_during_pass == 0:
+            break
+    return since
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        raise SystemExit("Error: MONGO_URI is not set in .env.")
+    db = MongoClient(mongo_uri)[os.getenv("MONGO_DB_NAME", "NoteVerseDB")]
+    note_bodies = NoteBodyStore(db, codec=os.getenv("NOTE_BODY_CODEC"))
+
+    if args.resume:
+        checkpoint_path = args.resume
+        checkpoint = load_checkpoint(checkpoint_path)
+        print(f"Resuming re-index into '{checkpoint['settings']['collection_name']}' "
+              f"after note {checkpoint['last_note_id']} ({checkpoint['notes_done']} notes done).")
+    else:
+        settings = {
+            "collection_name": args.collection or default_collection_name(args.embedding_model),
+            "embedding_model_name": args.embedding_model,
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "chunk_unit": "tokens",
+            "hnsw_m": args.hnsw_m,
+            "hnsw_construction_ef": args.hnsw_ef_construction,
+            "hnsw_search_ef": args.hnsw_ef_search
+        }
+        checkpoint_path = os.path.join(args.chroma_path, f"reindex_{settings['collection_name']}.json")
+        checkpoint = {
+            "settings": settings,
+            "user": args.user,
+            "last_note_id": None,
+            "notes_done": 0,
+            "chunks_done": 0,
+            "elapsed_seconds": 0.0,
+            "started_at": time.time(), # Changes from here on are replayed before the swap
+            "completed": False
+        }
+        os.makedirs(args.chroma_path, exist_ok=True)
+        save_checkpoint(checkpoint_path, checkpoint)
+    settings = checkpoint["settings"]
+
+    client = chromadb.PersistentClient(path=args.chroma_path)
+    collection = client.get_or_create_collection(
+        name=settings["collection_name"],
+        metadata=hnsw_collection_metadata(settings)
+    )
+    encoder = BatchEncoder(settings, args.workers, args.encode_batch_size, args.onnx_model_dir)
+    length_function = load_chunk_length_function(settings)
+
+    scope = {"user_id": checkpoint["user"]} if checkpoint.get("user") else {}
+    query = dict(scope)
+    if checkpoint["last_note_id"]:
+        query["_id"] = {"$gt": ObjectId(checkpoint["last_note_id"])}
+
+    print(f"Re-indexing notes into '{settings['collection_name']}' with '{settings['embedding_model_name']}' "
+          f"(chunk_size={settings['chunk_size']}, chunk_overlap={settings['chunk_overlap']}).")
+    run_started = time.time()
+    elapsed_before = checkpoint["elapsed_seconds"]
+    try:
+        for batch in iter_note_batches(db.notes, query, args.batch_size):
+            batch_started = time.time()
+            chunks = index_batch(batch, note_bodies, collection, encoder, settings, length_function)
+
+            checkpoint["last_note_id"] = str(batch[-1]["_id"])
+            checkpoint["notes_done"] += len(batch)
+            checkpoint["chunks_done"] += chunks
+            checkpoint["elapsed_seconds"] = elapsed_before + (time.time() - run_started)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            batch_seconds = time.time() - batch_started
+            total_seconds = max(checkpoint["elapsed_seconds"], 1e-9)
+            print(f"{checkpoint['notes_done']} notes / {checkpoint['chunks_done']} chunks | "
+                  f"batch: {len(batch) / batch_seconds:.1f} notes/s, {chunks / batch_seconds:.1f} chunks/s | "
+                  f"overall: {checkpoint['chunks_done'] / total_seconds:.1f} chunks/s")
+
+        # Notes uploaded, edited or deleted while the collection was being built
+        # (checkpoints written before catch-up existed replay from the first batch's time)
+        since = checkpoint.get("reconciled_at") or checkpoint.get("started_at") or run_started - elapsed_before
+        checkpoint["reconciled_at"] = reconcile(db, note_bodies, collection, encoder, settings, length_function, scope,
+                                                since, args.batch_size)
+    finally:
+        encoder.close()
+
+    checkpoint["completed"] = True
+    save_checkpoint(checkpoint_path, checkpoint)
+    print(f"Re-index complete: {checkpoint['notes_done']} notes, {checkpoint['chunks_done']} chunks "
+          f"in {checkpoint['elapsed_seconds']:.1f}s. Collection holds {collection.count()} chunks.")
+
+    if args.no_swap or checkpoint.get("user"):
+        print("Active collection left unchanged.")
+        return
+    previous = load_active_collection(args.chroma_path)
+    set_active_collection(args.chroma_path, settings)
+    print(f"Active collection switched from '{previous['collection_name']}' to '{settings['collection_name']}'. "
+          "Restart the API servers to use it, then replay the changes made until the restart with "
+          f"`python reindex.py --resume {checkpoint_path}`. The old collection is kept for rollback.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# backend/related_notes.py
+"""
+Precomputed "related notes" of every note: its top-k most similar notes of the same user.
+
+A note's vector is the mean of its chunk vectors, which indexing into ChromaDB computes
+anyway. Vectors are kept in `note_vectors` (float32, per user and embedding model), and every
+note document carries `related_notes`, its top-k list sorted by cosine similarity, so
+NoteDetail reads it with the note instead of running a similarity search per view.
+
+The lists are maintained incrementally:
+- adding a note compares its vector with the user's other note vectors (one matrix-vector
+  product), writes its own list, and inserts it into the lists it now ranks in with an atomic
+  $push/$sort/$slice,
+- re-embedding or removing a note recomputes only the lists that contained it,
+- rebuild() recomputes all lists of a user (after a re-index with another model).
+
+Updates run on one background thread (BackgroundUpdater), off the request path. Backfill
+notes indexed before this existed with:
+
+    python related_notes.py
+    python related_notes.py --user <uid>
+"""
+import argparse
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from observability import Histogram, get_logger, register
+
+logger = get_logger("related")
+
+RELATED_UPDATE_SECONDS = register(Histogram(
+    "noteverse_related_notes_update_seconds", "Time to update related-notes lists.", ["operation"]
+))
+
+RELATED_K = 5
+MIN_SCORE = 0.3 # Notes less similar than this are not "related", even when there are fewer than k
+REBUILD_BLOCK_ROWS = 512 # Rows of the similarity matrix computed at a time by rebuild()
+
+
+def vector_bytes(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def _unit_rows(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+class RelatedNotesStore:
+    """Note vectors and the related-notes lists of the note documents."""
+
+    def __init__(self, db, k=RELATED_K, min_score=MIN_SCORE):
+        self.notes = db.notes
+        self.vectors = db.note_vectors
+        self.k = k
+        self.min_score = min_score
+
+    def ensure_indexes(self):
+        self.vectors.create_index([("user_id", ASCENDING), ("model", ASCENDING)])
+        # Finds the lists a re-embedded, renamed or removed note appears in
+        self.notes.create_index([("related_notes.note_id", ASCENDING)], sparse=True)
+
+    def _user_vectors(self, user_id, model):
+        """(note ids, filenames, unit vectors as an N x d matrix) of a user's notes embedded with model."""
+        ids, names, rows = [], [], []
+        for doc in self.vectors.find({"user_id": user_id, "model": model}, {"vector": 1, "original_filename": 1}):
+            ids.append(doc["_id"])
+            names.append(doc.get("original_filename"))
+            rows.append(np.frombuffer(doc["vector"], dtype=np.float32))
+        if not rows:
+            return ids, names, np.zeros((0, 0), dtype=np.float32)
+        return ids, names, _unit_rows(np.vstack(rows))
+
+    def _top(self, ids, names, scores, exclude):
+        """The related-notes list for one row of similarity scores."""
+        entries = []
+        for j in np.argsort(-scores, kind="stable"):
+            if len(entries) == self.k or scores[j] < self.min_score:
+                break
+            if ids[j] != exclude:
+                entries.append({"note_id": ids[j], "original_filename": names[j], "score": round(float(scores[j]), 4)})
+        return entries
+
+    def _set_lists(self, lists, now):
+        if lists:
+            self.notes.bulk_write([
+                UpdateOne({"_id": note_id}, {"$set": {"related_notes": entries, "related_updated_at": now}})
+                for note_id, entries in lists.items()
+            ], ordered=False)
+
+    def add(self, user_id, model, notes):
+        """
+        Adds or re-embeds notes of a user, given as (note_id, original_filename, vector) tuples,
+        and updates every list they belong in.
+        """
+        started = time.perf_counter()
+        now = time.time()
+        added = [note_id for note_id, _, _ in notes]
+        self.vectors.bulk_write([
+            ReplaceOne({"_id": note_id}, {"_id": note_id, "user_id": user_id, "model": model,
+                                          "original_filename": name, "vector": vector_bytes(vector),
+                                          "updated_at": now}, upsert=True)
+            for note_id, name, vector in notes
+        ], ordered=False)
+
+        # Lists holding a previous vector of a re-embedded note are recomputed from scratch
+        stale = {doc["_id"] for doc in self.notes.find(
+            {"user_id": user_id, "related_notes.note_id": {"$in": added}}, {"_id": 1})} - set(added)
+
+        ids, names, matrix = self._user_vectors(user_id, model)
+        position = {note_id: j for j, note_id in enumerate(ids)}
+        rows = [position[note_id] for note_id in added if note_id in position]
+        scores = matrix[rows] @ matrix.T if rows else np.zeros((0, len(ids)), dtype=np.float32) # len(added) x N
+        lists = {ids[row]: self._top(ids, names, scores[i], ids[row]) for i, row in enumerate(rows)}
+        for note_id in stale:
+            if note_id in position:
+                lists[note_id] = self._top(ids, names, matrix @ matrix[position[note_id]], note_id)
+        self._set_lists(lists, now)
+
+        # The other notes get the added notes that beat the k-th entry of their lists
+        floors = {}
+        for doc in self.notes.find({"user_id": user_id, "_id": {"$nin": list(lists)}}, {"related_notes.score": 1}):
+            entries = doc.get("related_notes") or []
+            floors[doc["_id"]] = entries[-1]["score"] if len(entries) >= self.k else self.min_score
+        pushes = []
+        for note_id, floor in floors.items():
+            j = position.get(note_id)
+            if j is None:
+                continue
+            candidates = [{"note_id": ids[row], "original_filename": names[row], "score": round(float(scores[i, j]), 4)}
+                          for i, row in enumerate(rows) if scores[i, j] > floor]
+            if candidates:
+                pushes.append(UpdateOne({"_id": note_id}, {
+                    "$push": {"related_notes": {"$each": candidates, "$sort": {"score": -1}, "$slice": self.k}},
+                    "$set": {"related_updated_at": now}
+                }))
+        if pushes:
+            self.notes.bulk_write(pushes, ordered=False)
+        RELATED_UPDATE_SECONDS.observe(time.perf_counter() - started, "add")
+        logger.info("Related notes of user %s updated for %d added note(s): %d lists recomputed, %d extended.",
+                    user_id, len(added), len(lists), len(pushes))
+
+    def remove(self, user_id, model, note_id):
+        """Removes a note's vector and recomputes the lists it was in."""
+        started = time.perf_counter()
+        self.vectors.delete_one({"_id": note_id})
+        affected = [doc["_id"] for doc in self.notes.find(
+            {"user_id": user_id, "related_notes.note_id": note_id}, {"_id": 1})]
+        if affected:
+            ids, names, matrix = self._user_vectors(user_id, model)
+            position = {vector_id: j for j, vector_id in enumerate(ids)}
+            self._set_lists({
+                other: self._top(ids, names, matrix @ matrix[position[other]], other) if other in position else []
+                for other in affected
+            }, time.time())
+        RELATED_UPDATE_SECONDS.observe(time.perf_counter() - started, "remove")
+
+    def rename(self, note_id, original_filename):
+        """Keeps the filenames shown in other notes' lists current."""
+        self.vectors.update_one({"_id": note_id}, {"$set": {"original_filename": original_filename}})
+        self.notes.update_many(
+            {"related_notes.note_id": note_id},
+            {"$set": {"related_notes.$[entry].original_filename": original_filename}},
+            array_filters=[{"entry.note_id": note_id}]
+        )
+
+    def rebuild(self, user_id, model):
+        """Recomputes every list of a user from the stored vectors. Returns the number of notes."""
+        started = time.perf_counter()
+        ids, names, matrix = self._user_vectors(user_id, model)
+        now = time.time()
+        for start in range(0, len(ids), REBUILD_BLOCK_ROWS):
+            block = matrix[start:start + REBUILD_BLOCK_ROWS] @ matrix.T
+            self._set_lists({ids[start + i]: self._top(ids, names, block[i], ids[start + i])
+                             for i in range(len(block))}, now)
+        # Notes without a vector (too short to index) have no related notes
+        self.notes.update_many({"user_id": user_id, "_id": {"$nin": ids}, "related_notes.0": {"$exists": True}},
+                               {"$set": {"related_notes": [], "related_updated_at": now}})
+        RELATED_UPDATE_SECONDS.observe(time.perf_counter() - started, "rebuild")
+        return len(ids)
+
+    def related(self, note_id, user_id):
+        """The precomputed list of a note (one document read), or None if the note does not exist."""
+        note = self.notes.find_one({"_id": note_id, "user_id": user_id}, {"related_notes": 1, "related_updated_at": 1})
+        if note is None:
+            return None
+        return note.get("related_notes", []), note.get("related_updated_at")
+
+
+class BackgroundUpdater:
+    """
+    Runs store updates one at a time on a background thread, so requests never wait for them
+    and the updates of one process never race each other.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def submit(self, method, *args):
+        # The update keeps the trace id of the request that caused it
+        return self._executor.submit(contextvars.copy_context().run, self._run, method, *args)
+
+    def _run(self, method, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception:
+            logger.exception("%s update '%s' failed", self.name, method)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# --- Backfill ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute note vectors and related-notes lists from ChromaDB.")
+    parser.add_argument("--user", default=None, help="Only this user id (default: every user with notes).")
+    parser.add_argument("--k", type=int, default=RELATED_K)
+    parser.add_argument("--chroma-path", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"))
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from bson.objectid import ObjectId
+
+    from note_index import load_active_collection
+
+    args = parse_args()
+    load_dotenv()
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        raise SystemExit("Error: MONGO_URI is not set in .env.")
+    db = MongoClient(mongo_uri)[os.getenv("MONGO_DB_NAME", "NoteVerseDB")]
+    store = RelatedNotesStore(db, k=args.k, min_score=float(os.getenv("RELATED_NOTES_MIN_SCORE", MIN_SCORE)))
+    store.ensure_indexes()
+
+    settings = load_active_collection(args.chroma_path)
+    model = settings["embedding_model_name"]
+    collection = chromadb.PersistentClient(path=args.chroma_path).get_collection(settings["collection_name"])
+    users = [args.user] if args.user else db.notes.distinct("user_id")
+    print(f"Computing related notes of {len(users)} user(s) from '{settings['collection_name']}' ({model}).")
+
+    started = time.time()
+    for user_id in users:
+        chunks = collection.get(where={"user_id": user_id}, include=["embeddings", "metadatas"])
+        by_note = {}
+        for embedding, metadata in zip(chunks["embeddings"], chunks["metadatas"]):
+            note_id = (metadata or {}).get("note_id")
+            if note_id and ObjectId.is_valid(note_id):
+                by_note.setdefault(ObjectId(note_id), []).append(embedding)
+        names = {note["_id"]: note.get("original_filename") for note in db.notes.find(
+            {"user_id": user_id, "_id": {"$in": list(by_note)}}, {"original_filename": 1})}
+        now = time.time()
+        writes = [ReplaceOne({"_id": note_id}, {
+            "_id": note_id, "user_id": user_id, "model": model, "original_filename": names[note_id],
+            "vector": vector_bytes(np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)), "updated_at": now
+        }, upsert=True) for note_id, embeddings in by_note.items() if note_id in names] # Skip chunks of deleted notes
+        if writes:
+            store.vectors.bulk_write(writes, ordered=False)
+        store.vectors.delete_many({"user_id": user_id, "model": {"$ne": model}})
+        print(f"{user_id}: {store.rebuild(user_id, model)} notes")
+    print(f"Done in {time.time() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# backend/revision.py
+"""
+Quiz attempts and spaced-repetition scheduling of quiz questions.
+
+Every answered question gets a review state (SM-2: ease factor, repetition count, interval)
+in the `review_states` collection, one small document per (quiz, question). States are
+indexed by (user_id, due_at), so "what should I revise now" is a single index range scan
+however many questions a user has reviewed. Attempts are kept in `quiz_attempts` for
+accuracy statistics.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+
+DAY_SECONDS = 86400
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+CORRECT_QUALITY = 4 # SM-2 grade (0-5) of a correct answer when the client sends none
+INCORRECT_QUALITY = 1
+
+
+def review_state_id(quiz_id, question_index):
+    return f"{quiz_id}:{question_index}"
+
+
+def sm2(state, quality, now=None):
+    """
+    Applies one SM-2 review with grade quality (0-5) to a review state (None for a question
+    never reviewed). Returns the updated fields: ease, repetitions, interval_days, due_at,
+    lapses, reviews, correct.
+    """
+    now = time.time() if now is None else now
+    state = state or {}
+    ease = state.get("ease", INITIAL_EASE)
+    repetitions = state.get("repetitions", 0)
+    interval = state.get("interval_days", 0)
+    lapses = state.get("lapses", 0)
+    if quality < 3:
+        repetitions = 0
+        interval = 1
+        lapses += 1
+    else:
+        repetitions += 1
+        interval = 1 if repetitions == 1 else 6 if repetitions == 2 else round(interval * ease)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return {
+        "ease": round(ease, 3),
+        "repetitions": repetitions,
+        "interval_days": interval,
+        "due_at": now + interval * DAY_SECONDS,
+        "last_reviewed_at": now,
+        "lapses": lapses,
+        "reviews": state.get("reviews", 0) + 1,
+        "correct": state.get("correct", 0) + (1 if quality >= 3 else 0)
+    }
+
+
+def grade_answers(questions, answers):
+    """
+    Grades submitted answers ({question_index, selected_option, quality?}) against the quiz's
+    questions. Returns graded answers with `correct` and the SM-2 `quality`; answers to
+    unknown questions are dropped, and a later answer to the same question replaces an earlier one.
+    """
+    graded = {}
+    for answer in answers:
+        index = answer.get("question_index")
+        if not isinstance(index, int) or not 0 <= index < len(questions):
+            continue
+        correct = answer.get("selected_option") == questions[index].get("correct_answer")
+        quality = answer.get("quality")
+        if not isinstance(quality, int) or not 0 <= quality <= 5:
+            quality = CORRECT_QUALITY if correct else INCORRECT_QUALITY
+        elif correct != (quality >= 3):
+            quality = min(quality, 2) if not correct else max(quality, 3) # The grade cannot contradict the answer
+        graded[index] = {"question_index": index, "selected_option": answer.get("selected_option"),
+                         "correct": correct, "quality": quality}
+    return [graded[index] for index in sorted(graded)]
+
+
+class RevisionStore:
+    """Quiz attempts and review states of all users."""
+
+    def __init__(self, db):
+        self.attempts = db.quiz_attempts
+        self.states = db.review_states
+
+    def ensure_indexes(self):
+        self.states.create_index([("user_id", ASCENDING), ("due_at", ASCENDING)])
+        self.states.create_index([("note_id", ASCENDING)])
+        self.attempts.create_index([("user_id", ASCENDING), ("submitted_at", DESCENDING)])
+
+    def record_attempt(self, user_id, quiz, graded, duration_seconds=None, now=None):
+        """Stores an attempt and reschedules its questions. Returns (attempt, review states by question)."""
+        now = time.time() if now is None else now
+        quiz_id = str(quiz["_id"])
+        correct = sum(1 for answer in graded if answer["correct"])
+        attempt = {
+            "user_id": user_id,
+            "quiz_id": quiz["_id"],
+            "note_id": quiz.get("note_id"),
+            "submitted_at": now,
+            "answers": graded,
+            "correct": correct,
+            "total": len(graded),
+            "duration_seconds": duration_seconds
+        }
+        self.attempts.insert_one(attempt)
+
+        state_ids = [review_state_id(quiz_id, answer["question_index"]) for answer in graded]
+        previous = {state["_id"]: state for state in self.states.find({"_id": {"$in": state_ids}, "user_id": user_id})}
+        states, writes = {}, []
+        for state_id, answer in zip(state_ids, graded):
+            state = {
+                "_id": state_id,
+                "user_id": user_id,
+                "quiz_id": quiz["_id"],
+                "note_id": quiz.get("note_id"),
+                "question_index": answer["question_index"],
+                **sm2(previous.get(state_id), answer["quality"], now)
+            }
+            states[answer["question_index"]] = state
+            writes.append(ReplaceOne({"_id": state_id}, state, upsert=True))
+        if writes:
+            self.states.bulk_write(writes, ordered=False)
+        return attempt, states
+
+    def due(self, user_id, now=None, limit=20):
+        """Review states due by `now`, most overdue first (one index range scan)."""
+        now = time.time() if now is None else now
+        return list(self.states.find({"user_id": user_id, "due_at": {"$lte": now}}).sort("due_at", ASCENDING).limit(limit))
+
+    def due_count(self, user_id, now=None):
+        now = time.time() if now is None else now
+        return self.states.count_documents({"user_id": user_id, "due_at": {"$lte": now}})
+
+    def forget_note(self, user_id, note_id):
+        """Stops scheduling the questions of a deleted note (its attempts still count in the statistics)."""
+        return self.states.delete_many({"user_id": user_id, "note_id": note_id}).deleted_count
+
+    def accuracy_by_note(self, user_id, since=None):
+        """{note_id: (correct, total)} over the user's attempts (submitted since `since`, if given)."""
+        match = {"user_id": user_id, "note_id": {"$ne": None}}
+        if since is not None:
+            match["submitted_at"] = {"$gte": since}
+        return {group["_id"]: (group["correct"], group["total"]) for group in self.attempts.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$note_id", "correct": {"$sum": "$correct"}, "total": {"$sum": "$total"}}}
+        ])}
+
+    def stats(self, user_id, days=7, now=None):
+        """
+        Attempt totals (quizzes_solved, average_accuracy in %, study_time_hours), the current
+        streak of consecutive days with attempts, and per-day accuracy/time for the last `days` days.
+        """
+        now = time.time() if now is None else now
+        totals = next(self.attempts.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": None, "attempts": {"$sum": 1}, "correct": {"$sum": "$correct"},
+                        "total": {"$sum": "$total"}, "seconds": {"$sum": {"$ifNull": ["$duration_seconds", 0]}}}}
+        ]), None) or {"attempts": 0, "correct": 0, "total": 0, "seconds": 0}
+
+        today = datetime.fromtimestamp(now, timezone.utc).date()
+        by_day = {}
+        # Newest first, stopping once past both the chart window and the current streak
+        for attempt in self.attempts.find({"user_id": user_id}, {"submitted_at": 1, "correct": 1, "total": 1,
+                                                                 "duration_seconds": 1}).sort("submitted_at", DESCENDING):
+            day = datetime.fromtimestamp(attempt["submitted_at"], timezone.utc).date()
+            if (today - day).days >= days and (today - day).days > len(by_day) + 1:
+                break # Older than the chart and past the end of the streak
+            totals_of_day = by_day.setdefault(day, [0, 0, 0.0])
+            totals_of_day[0] += attempt.get("correct", 0)
+            totals_of_day[1] += attempt.get("total", 0)
+            totals_of_day[2] += attempt.get("duration_seconds") or 0
+
+        streak = 0
+        day = today if today in by_day else today - timedelta(days=1) # The streak holds until today is over
+        while day in by_day:
+            streak += 1
+            day -= timedelta(days=1)
+
+        weekly_progress = []
+        for offset in range(days - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            correct, total, seconds = by_day.get(day, (0, 0, 0.0))
+            weekly_progress.append({
+                "day": day.strftime("%a"),
+                "time_h": round(seconds / 3600.0, 2),
+                "accuracy": round(100.0 * correct / total, 1) if total else 0
+            })
+        return {
+            "quizzes_solved": totals["attempts"],
+            "average_accuracy": round(100.0 * totals["correct"] / totals["total"], 1) if totals["total"] else 0.0,
+            "study_time_hours": round(totals["seconds"] / 3600.0, 1),
+            "days_streak": streak,
+            "weekly_progress": weekly_progress
+        }
@@ -0,0 +1,163 @@
+# backend/storage.py
+"""
+Object storage for uploaded note files and their thumbnails.
+
+Objects are content-addressed: an original is stored under the SHA-256 of its bytes,
+sharded by the first hash characters (`originals/ab/cd/abcd...ef.pdf`), so identical
+uploads share one object and no directory grows beyond a few hundred entries.
+
+- LocalStorage keeps the objects under a directory (by default the upload folder).
+- S3Storage keeps them in an S3-compatible bucket (AWS S3, or MinIO and other stand-ins
+  through S3_ENDPOINT_URL).
+
+storage_from_env() picks the backend from STORAGE_BACKEND=local|s3.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from observability import get_logger
+
+logger = get_logger("storage")
+
+THUMBNAIL_MAX_SIDE = 320
+
+
+def original_key(sha256, extension):
+    """Storage key of an uploaded original."""
+    return f"originals/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension.lower()}"
+
+
+def thumbnail_key(sha256, max_side=THUMBNAIL_MAX_SIDE):
+    """Storage key of the JPEG thumbnail of an original."""
+    return f"thumbnails/{sha256[:2]}/{sha256[2:4]}/{sha256}_{max_side}.jpg"
+
+
+class LocalStorage:
+    """Content-addressed objects in a local directory tree."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put_file(self, source_path, key):
+        """Moves a local file into storage (the source is consumed)."""
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(source_path) # Same content already stored
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source_path, path)
+        except OSError: # Different filesystem
+            shutil.move(source_path, path)
+        return key
+
+    def put_bytes(self, data, key, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return key
+
+    def get_bytes(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    @contextmanager
+    def local_path(self, key):
+        """A filesystem path with the object's content, valid inside the `with` block."""
+        yield self._path(key)
+
+    def delete(self, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class S3Storage:
+    """Content-addressed objects in an S3-compatible bucket."""
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region_name=None, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_file(self, source_path, key):
+        """Uploads a local file (multipart for large files) and removes the local copy."""
+        if not self.exists(key):
+            self.client.upload_file(source_path, self.bucket, self._key(key))
+        os.remove(source_path)
+        return key
+
+    def put_bytes(self, data, key, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, **extra)
+        return key
+
+    def get_bytes(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    @contextmanager
+    def local_path(self, key):
+        """Downloads the object to a temporary file for the duration of the `with` block."""
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(key), temp_path)
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+def storage_from_env(default_root):
+    """
+    STORAGE_BACKEND=local (STORAGE_ROOT, default: default_root) or
+    STORAGE_BACKEND=s3 (S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION; credentials via the
+    usual AWS_* variables).
+    """
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET.")
+        storage = S3Storage(bucket, prefix=os.getenv("S3_PREFIX", ""), endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+                            region_name=os.getenv("S3_REGION"))
+        logger.info("Object storage: S3 bucket '%s' (endpoint %s).", bucket, os.getenv("S3_ENDPOINT_URL") or "AWS")
+        return storage
+    if backend != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'local' or 's3').")
+    root = os.getenv("STORAGE_ROOT", default_root)
+    logger.info("Object storage: local directory '%s'.", root)
+    return LocalStorage(root)
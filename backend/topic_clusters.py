@@ -0,0 +1,340 @@
+# backend/topic_clusters.py
+"""
+Incremental per-user topic clustering of notes.
+
+`topics` of a note are the KeyBERT keywords of that one note. This module groups each user's
+notes into a few broader topics using the note vectors (mean of the chunk vectors, see
+related_notes.py) with sequential mini-batch k-means:
+
+- a new note joins the topic whose centroid is most similar, and the centroid moves towards
+  it with a per-topic learning rate of 1/count (so a centroid is the running mean of its notes),
+- a note not similar enough to any topic (< new_topic_similarity) opens a new topic while the
+  user has fewer than max_topics,
+- every topic counts the keywords of its notes; the most frequent ones label it.
+
+An upload touches only the user's topic model (one small document in `topic_models`) and the
+new notes, never the user's history. Notes get a compact integer `topic_id`, indexed with the
+user id, so topic filters and per-topic statistics are index lookups.
+
+Removing a note decrements its topic's counts without moving the centroid, as mini-batch
+k-means never unlearns either. recluster() rebuilds a user's topics from all note vectors
+(a sequential pass refined with a few k-means iterations); run it after a re-index with
+another embedding model:
+
+    python related_notes.py   # Note vectors of the new collection
+    python topic_clusters.py [--user <uid>]
+"""
+import argparse
+import os
+import time
+from collections import Counter as KeywordCounts
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from observability import Histogram, get_logger, register
+
+logger = get_logger("topics")
+
+TOPIC_UPDATE_SECONDS = register(Histogram(
+    "noteverse_topic_update_seconds", "Time to update a user's topic model.", ["operation"]
+))
+
+MAX_TOPICS = 12
+NEW_TOPIC_SIMILARITY = 0.5 # Cosine similarity to the nearest centroid below which a note opens a new topic
+LABEL_KEYWORDS = 3
+KEPT_KEYWORDS = 30 # Keyword counts kept per topic
+RECLUSTER_ITERATIONS = 10
+SAVE_ATTEMPTS = 5 # Optimistic-concurrency retries when several processes update one user
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class TopicModel:
+    """One user's topics: centroids, note counts and keyword counts."""
+
+    def __init__(self, user_id, model, topics=None, next_id=0, version=0):
+        self.user_id = user_id
+        self.model = model
+        self.topics = topics or {} # topic_id -> {"centroid": array, "count": int, "keywords": KeywordCounts}
+        self.next_id = next_id
+        self.version = version
+
+    @classmethod
+    def from_document(cls, doc):
+        return cls(doc["_id"], doc["model"], {
+            topic["topic_id"]: {"centroid": np.frombuffer(topic["centroid"], dtype=np.float32).copy(),
+                                "count": topic["count"], "keywords": KeywordCounts(dict(topic["keywords"]))}
+            for topic in doc["topics"]
+        }, doc["next_id"], doc["version"])
+
+    def to_document(self, now):
+        return {
+            "_id": self.user_id,
+            "model": self.model,
+            "topics": [{
+                "topic_id": topic_id,
+                "label": self.label(topic_id),
+                "centroid": topic["centroid"].astype(np.float32).tobytes(),
+                "count": topic["count"],
+                "keywords": [[keyword, count] for keyword, count in topic["keywords"].most_common(KEPT_KEYWORDS)]
+            } for topic_id, topic in sorted(self.topics.items())],
+            "next_id": self.next_id,
+            "version": self.version + 1,
+            "updated_at": now
+        }
+
+    def label(self, topic_id):
+        keywords = [keyword for keyword, _ in self.topics[topic_id]["keywords"].most_common(LABEL_KEYWORDS)]
+        return " / ".join(keywords) if keywords else f"Topic {topic_id + 1}"
+
+    def nearest(self, unit_vector):
+        """(topic_id, cosine similarity) of the nearest centroid, or (None, -1.0) without topics."""
+        best, best_score = None, -1.0
+        for topic_id, topic in self.topics.items():
+            score = float(_unit(topic["centroid"]) @ unit_vector)
+            if score > best_score:
+                best, best_score = topic_id, score
+        return best, best_score
+
+    def assign(self, vector, keywords, max_topics=MAX_TOPICS, new_topic_similarity=NEW_TOPIC_SIMILARITY):
+        """Adds one note (mini-batch k-means step). Returns its topic id."""
+        unit_vector = _unit(vector)
+        topic_id, score = self.nearest(unit_vector)
+        if topic_id is None or (score < new_topic_similarity and len(self.topics) < max_topics):
+            topic_id = self.next_id
+            self.next_id += 1
+            self.topics[topic_id] = {"centroid": unit_vector.copy(), "count": 0, "keywords": KeywordCounts()}
+        topic = self.topics[topic_id]
+        topic["count"] += 1
+        topic["centroid"] += (unit_vector - topic["centroid"]) / topic["count"]
+        topic["keywords"].update(keywords or [])
+        return topic_id
+
+    def unassign(self, topic_id, keywords):
+        """Removes one note's counts from its topic; a topic left without notes is dropped."""
+        topic = self.topics.get(topic_id)
+        if topic is None:
+            return
+        topic["count"] -= 1
+        topic["keywords"].subtract(keywords or [])
+        topic["keywords"] = +topic["keywords"] # Drops keywords counted down to zero
+        if topic["count"] <= 0:
+            del self.topics[topic_id]
+
+
+class TopicStore:
+    """Per-user topic models and the topic_id of every note."""
+
+    def __init__(self, db, max_topics=MAX_TOPICS, new_topic_similarity=NEW_TOPIC_SIMILARITY):
+        self.notes = db.notes
+        self.models = db.topic_models
+        self.vectors = db.note_vectors
+        self.max_topics = max_topics
+        self.new_topic_similarity = new_topic_similarity
+
+    def ensure_indexes(self):
+        self.notes.create_index([("user_id", ASCENDING), ("topic_id", ASCENDING)])
+
+    def load(self, user_id, model):
+        """The user's topic model; a fresh one if there is none or it was built with another embedding model."""
+        doc = self.models.find_one({"_id": user_id})
+        if doc is None:
+            return TopicModel(user_id, model)
+        topic_model = TopicModel.from_document(doc)
+        if topic_model.model != model:
+            # Vectors of different models are not comparable; ids keep counting so old ones never collide
+            logger.warning("Topics of user %s were built with '%s'; starting over with '%s' (run topic_clusters.py "
+                           "to recluster all notes).", user_id, topic_model.model, model)
+            return TopicModel(user_id, model, next_id=topic_model.next_id, version=topic_model.version)
+        return topic_model
+
+    def _save(self, topic_model, now):
+        """Stores the model unless another process updated it since it was loaded. Returns True if stored."""
+        doc = topic_model.to_document(now)
+        if topic_model.version == 0:
+            # Creates the model; if another process created it first the upsert fails with a duplicate key
+            result = self.models.update_one({"_id": topic_model.user_id, "version": {"$exists": False}},
+                                            {"$set": {key: value for key, value in doc.items() if key != "_id"}},
+                                            upsert=True)
+            return result.upserted_id is not None or result.modified_count == 1
+        return self.models.replace_one({"_id": topic_model.user_id, "version": topic_model.version},
+                                       doc).modified_count == 1
+
+    def _update(self, user_id, model, change, operation):
+        """Loads, changes and saves a user's model, retrying if a concurrent update wins. Returns change()'s result."""
+        started = time.perf_counter()
+        for _ in range(SAVE_ATTEMPTS):
+            topic_model = self.load(user_id, model)
+            result = change(topic_model)
+            try:
+                saved = self._save(topic_model, time.time())
+            except DuplicateKeyError: # Lost the race to create the model
+                saved = False
+            if saved:
+                TOPIC_UPDATE_SECONDS.observe(time.perf_counter() - started, operation)
+                return result
+        raise RuntimeError(f"Topic model of user {user_id} kept changing concurrently; gave up.")
+
+    def assign(self, user_id, model, notes, previous=None):
+        """
+        Assigns notes, given as (note_id, vector, keywords) tuples, to topics. previous maps
+        the note ids of re-embedded notes to their former (topic_id, keywords).
+        """
+        def change(topic_model):
+            for note_id, (topic_id, keywords) in (previous or {}).items():
+                topic_model.unassign(topic_id, keywords)
+            return {note_id: topic_model.assign(vector, keywords, self.max_topics, self.new_topic_similarity)
+                    for note_id, vector, keywords in notes}
+
+        assigned = self._update(user_id, model, change, "assign")
+        if assigned:
+            self.notes.bulk_write([UpdateOne({"_id": note_id}, {"$set": {"topic_id": topic_id}})
+                                   for note_id, topic_id in assigned.items()], ordered=False)
+        logger.info("Assigned %d note(s) of user %s to topics %s.", len(assigned), user_id, sorted(set(assigned.values())))
+        return assigned
+
+    def remove(self, user_id, model, note_id, topic_id, keywords):
+        """Removes a deleted (or no longer indexed) note from its topic, and the topic_id from the note."""
+        if topic_id is not None:
+            self._update(user_id, model, lambda topic_model: topic_model.unassign(topic_id, keywords), "remove")
+            # Unless the note was assigned again meanwhile
+            self.notes.update_one({"_id": note_id, "topic_id": topic_id}, {"$unset": {"topic_id": ""}})
+
+    def recluster(self, user_id, model, iterations=RECLUSTER_ITERATIONS):
+        """
+        Rebuilds a user's topics from all their note vectors: a sequential pass in upload order
+        seeds the topics, then k-means iterations refine them. Returns the number of topics.
+        """
+        started = time.perf_counter()
+        vectors = {doc["_id"]: np.frombuffer(doc["vector"], dtype=np.float32)
+                   for doc in self.vectors.find({"user_id": user_id, "model": model}, {"vector": 1})}
+        notes = [note for note in self.notes.find({"user_id": user_id}, {"_id": 1, "topics": 1}).sort("upload_date", 1)
+                 if note["_id"] in vectors]
+        seed = TopicModel(user_id, model)
+        for note in notes:
+            seed.assign(vectors[note["_id"]], [], self.max_topics, self.new_topic_similarity)
+
+        labels = np.zeros(len(notes), dtype=np.int64)
+        if notes:
+            matrix = np.vstack([_unit(vectors[note["_id"]]) for note in notes])
+            centroids = np.vstack([seed.topics[topic_id]["centroid"] for topic_id in sorted(seed.topics)])
+            for _ in range(iterations):
+                labels = np.argmax(matrix @ (centroids / np.linalg.norm(centroids, axis=1, keepdims=True)).T, axis=1)
+                # A topic that lost every note keeps its centroid (it can win notes back next iteration)
+                updated = np.vstack([matrix[labels == t].mean(axis=0) if np.any(labels == t) else centroids[t]
+                                     for t in range(len(centroids))])
+                if np.allclose(updated, centroids, atol=1e-5):
+                    break
+                centroids = updated
+
+        previous = self.models.find_one({"_id": user_id}, {"next_id": 1, "version": 1})
+        first_id = previous["next_id"] if previous else 0 # New ids: filters on old ones match nothing
+        topic_model = TopicModel(user_id, model, next_id=first_id, version=previous["version"] if previous else 0)
+        note_topics = {}
+        for note, label in zip(notes, labels):
+            topic_id = first_id + int(label)
+            if topic_id not in topic_model.topics:
+                topic_model.topics[topic_id] = {"centroid": np.zeros(matrix.shape[1], dtype=np.float32), "count": 0,
+                                                "keywords": KeywordCounts()}
+            topic = topic_model.topics[topic_id]
+            topic["count"] += 1
+            topic["centroid"] += (matrix[len(note_topics)] - topic["centroid"]) / topic["count"]
+            topic["keywords"].update(note.get("topics") or [])
+            note_topics[note["_id"]] = topic_id
+        topic_model.next_id = first_id + len(seed.topics)
+
+        now = time.time()
+        self.models.replace_one({"_id": user_id}, topic_model.to_document(now), upsert=True)
+        if note_topics:
+            self.notes.bulk_write([UpdateOne({"_id": note_id}, {"$set": {"topic_id": topic_id}})
+                                   for note_id, topic_id in note_topics.items()], ordered=False)
+        self.notes.update_many({"user_id": user_id, "_id": {"$nin": list(note_topics)}, "topic_id": {"$exists": True}},
+                               {"$unset": {"topic_id": ""}})
+        TOPIC_UPDATE_SECONDS.observe(time.perf_counter() - started, "recluster")
+        return len(topic_model.topics)
+
+    def topics(self, user_id):
+        """The user's topics ({topic_id, label, keywords, note_count}), largest first."""
+        doc = self.models.find_one({"_id": user_id}, {"topics.centroid": 0})
+        if doc is None:
+            return []
+        return sorted(({"topic_id": topic["topic_id"], "label": topic["label"],
+                        "keywords": [keyword for keyword, _ in topic["keywords"][:10]], "note_count": topic["count"]}
+                       for topic in doc["topics"]), key=lambda topic: -topic["note_count"])
+
+    def mastery(self, user_id, accuracy_by_note, recent_accuracy_by_note, limit=8):
+        """
+        Quiz accuracy per topic ({topic, topic_id, percentage, change}), from the per-note
+        (correct, total) of all attempts and of recent ones; change is recent accuracy minus
+        the accuracy of earlier attempts. Topics without attempts are left out.
+        """
+        labels = {topic["topic_id"]: topic["label"] for topic in self.topics(user_id)}
+        note_topics = {note["_id"]: note["topic_id"] for note in self.notes.find(
+            {"user_id": user_id, "_id": {"$in": list(accuracy_by_note)}, "topic_id": {"$exists": True}},
+            {"topic_id": 1})}
+        totals = {}
+        for note_id, topic_id in note_topics.items():
+            if topic_id not in labels:
+                continue
+            entry = totals.setdefault(topic_id, [0, 0, 0, 0]) # correct, total, recent correct, recent total
+            correct, total = accuracy_by_note[note_id]
+            recent_correct, recent_total = recent_accuracy_by_note.get(note_id, (0, 0))
+            entry[0] += correct
+            entry[1] += total
+            entry[2] += recent_correct
+            entry[3] += recent_total
+
+        mastery = []
+        for topic_id, (correct, total, recent_correct, recent_total) in totals.items():
+            if not total:
+                continue
+            earlier_total = total - recent_total
+            change = 0.0
+            if recent_total and earlier_total:
+                change = 100.0 * recent_correct / recent_total - 100.0 * (correct - recent_correct) / earlier_total
+            mastery.append({"topic": labels[topic_id], "topic_id": topic_id, "percentage": round(100.0 * correct / total),
+                            "change": round(change), "questions": total})
+        mastery.sort(key=lambda entry: -entry["questions"])
+        return mastery[:limit]
+
+
+# --- Recluster ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recluster users' notes into topics from the stored note vectors.")
+    parser.add_argument("--user", default=None, help="Only this user id (default: every user with note vectors).")
+    parser.add_argument("--chroma-path", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"))
+    return parser.parse_args()
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from note_index import load_active_collection
+
+    args = parse_args()
+    load_dotenv()
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        raise SystemExit("Error: MONGO_URI is not set in .env.")
+    db = MongoClient(mongo_uri)[os.getenv("MONGO_DB_NAME", "NoteVerseDB")]
+    store = TopicStore(db, max_topics=int(os.getenv("TOPIC_MAX_PER_USER", MAX_TOPICS)),
+                       new_topic_similarity=float(os.getenv("TOPIC_NEW_SIMILARITY", NEW_TOPIC_SIMILARITY)))
+    store.ensure_indexes()
+    model = load_active_collection(args.chroma_path)["embedding_model_name"]
+    users = [args.user] if args.user else db.note_vectors.distinct("user_id", {"model": model})
+    print(f"Reclustering the notes of {len(users)} user(s) ({model}).")
+    started = time.time()
+    for user_id in users:
+        print(f"{user_id}: {store.recluster(user_id, model)} topics")
+    print(f"Done in {time.time() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# backend/uploads.py
+"""
+Streaming and resumable note uploads.
+
+- receive_stream() reads an upload in fixed-size chunks, checking the file signature once
+  its first bytes are in and hashing (SHA-256) and counting bytes as it goes. Small files
+  stay in memory and are processed from there; a file is only written to its path once it
+  outgrows the in-memory limit, so nothing is read back afterwards. A completed resumable
+  upload arrived over several requests, so a small one is read back from disk once on
+  completion instead.
+- ResumableUploads implements a tus-like protocol for large scans: a client creates an
+  upload with its total length, appends chunks with PATCH at the current offset (each
+  chunk is an ordinary request below MAX_CONTENT_LENGTH), can ask for the offset after a
+  dropped connection, and completes the upload once every byte has arrived. Partial files
+  and their metadata live in <upload folder>/.incoming/.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from observability import get_logger
+
+logger = get_logger("uploads")
+
+READ_CHUNK_BYTES = 1024 * 1024
+IN_MEMORY_LIMIT = 8 * 1024 * 1024 # Files below this size are also processed from memory
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024 # Total size of a (resumable) upload
+RESUMABLE_TTL_SECONDS = 24 * 3600
+
+FILE_SIGNATURES = {
+    '.pdf': (b'%PDF-',),
+    '.jpg': (b'\xff\xd8\xff',),
+    '.jpeg': (b'\xff\xd8\xff',),
+    '.png': (b'\x89PNG\r\n\x1a\n',),
+}
+SIGNATURE_BYTES = max(len(signature) for signatures in FILE_SIGNATURES.values() for signature in signatures)
+
+
+class UploadError(Exception):
+    """An upload was rejected; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def validate_signature(head, extension, partial=False):
+    """
+    Checks the first bytes of a file against its extension (a renamed file is rejected).
+    With partial=True, head is all that arrived so far and only has to be able to become a
+    valid signature.
+    """
+    signatures = FILE_SIGNATURES.get(extension)
+    if signatures is None:
+        raise UploadError(f"Unsupported file type: {extension}. Only JPG, PNG, and PDF are supported.", 400)
+    if not any(head.startswith(signature) or (partial and signature.startswith(head)) for signature in signatures):
+        raise UploadError(f"File content does not match its '{extension}' extension.", 400)
+
+
+def _extend_head(head, chunk, extension):
+    """The file's first bytes with chunk added, checked as far as they go."""
+    if len(head) < SIGNATURE_BYTES:
+        head += chunk[:SIGNATURE_BYTES - len(head)]
+        validate_signature(head, extension, partial=len(head) < SIGNATURE_BYTES)
+    return head
+
+
+def receive_stream(stream, file_path, extension, max_bytes=MAX_UPLOAD_BYTES, in_memory_limit=IN_MEMORY_LIMIT):
+    """
+    Receives an upload while validating and hashing it.
+    Returns {"path", "size", "sha256", "data"}. A file of up to in_memory_limit bytes is kept
+    in data and not written to disk; a larger one is streamed to file_path and data is None.
+    Nothing is left on disk if the upload is rejected.
+    """
+    temp_path = file_path + ".part"
+    hasher = hashlib.sha256()
+    size = 0
+    head = b""
+    kept = []
+    f = None
+    try:
+        while True:
+            chunk = stream.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            head = _extend_head(head, chunk, extension)
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadError(f"File exceeds the maximum upload size of {max_bytes // (1024 * 1024)} MB.", 413)
+            hasher.update(chunk)
+            if f is None and size > in_memory_limit:
+                # Too large to keep: spill what was kept and process from disk
+                f = open(temp_path, 'wb')
+                f.writelines(kept)
+                kept = None
+            if f is not None:
+                f.write(chunk)
+            else:
+                kept.append(chunk)
+        if size == 0:
+            raise UploadError("Uploaded file is empty.", 400)
+        validate_signature(head, extension)
+        if f is not None:
+            f.close()
+            os.replace(temp_path, file_path)
+    except BaseException:
+        if f is not None:
+            f.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    return {"path": file_path, "size": size, "sha256": hasher.hexdigest(),
+            "data": b"".join(kept) if kept is not None else None}
+
+
+class ResumableUploads:
+    """Resumable upload sessions stored next to their partial files."""
+
+    def __init__(self, upload_folder, max_bytes=MAX_UPLOAD_BYTES, ttl_seconds=RESUMABLE_TTL_SECONDS):
+        self.folder = os.path.join(upload_folder, ".incoming")
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.folder, exist_ok=True)
+        # Running hashes of uploads appended by this process, so completion does not re-read
+        # the file. Another process (or a restart) falls back to hashing the partial file.
+        self._hashers = {}
+        self._locks = {} # upload_id -> [lock, requests holding or waiting for it]
+        self._lock = threading.Lock()
+
+    def _paths(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError("Upload not found.", 404)
+        base = os.path.join(self.folder, upload_id)
+        return base + ".json", base + ".part"
+
+    @contextmanager
+    def _upload_lock(self, upload_id):
+        """Serializes requests on one upload. The lock is dropped once no request holds or waits for it."""
+        with self._lock:
+            entry = self._locks.setdefault(upload_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[upload_id]
+
+    def create(self, user_id, filename, length):
+        """Starts an upload of `length` bytes. Returns its session."""
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in FILE_SIGNATURES:
+            raise UploadError(f"Unsupported file type: {extension}. Only JPG, PNG, and PDF are supported.", 400)
+        if length <= 0:
+            raise UploadError("Upload-Length must be positive.", 400)
+        if length > self.max_bytes:
+            raise UploadError(f"File exceeds the maximum upload size of {self.max_bytes // (1024 * 1024)} MB.", 413)
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "filename": filename,
+            "length": length,
+            "created": time.time()
+        }
+        meta_path, part_path = self._paths(session["upload_id"])
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        return dict(session, offset=0)
+
+    def get(self, upload_id, user_id):
+        """The session with its current offset; 404 for unknown or other users' uploads."""
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError("Upload not found.", 404)
+        if session.get("user_id") != user_id:
+            raise UploadError("Upload not found.", 404)
+        return dict(session, offset=os.path.getsize(part_path) if os.path.exists(part_path) else 0)
+
+    def append(self, upload_id, user_id, offset, stream):
+        """Appends a chunk at `offset` (409 if it is not the current offset). Returns the new offset."""
+        with self._upload_lock(upload_id):
+            session = self.get(upload_id, user_id)
+            if offset != session["offset"]:
+                raise UploadError(f"Upload-Offset {offset} does not match the current offset {session['offset']}.", 409)
+            _, part_path = self._paths(upload_id)
+            hasher = self._hashers.get(upload_id)
+            if hasher is not None and hasher[0] != offset:
+                hasher = None
+            if hasher is None and offset == 0:
+                hasher = (0, hashlib.sha256())
+            extension = os.path.splitext(session["filename"])[1].lower()
+            written = offset
+            try:
+                head = None # Only checked while the first bytes arrive, which may take several requests
+                if offset < SIGNATURE_BYTES:
+                    with open(part_path, 'rb') as f:
+                        head = f.read(offset)
+                with open(part_path, 'ab') as f:
+                    while True:
+                        chunk = stream.read(READ_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        if head is not None:
+                            head = _extend_head(head, chunk, extension)
+                        if written + len(chunk) > session["length"]:
+                            raise UploadError("Chunk exceeds the declared Upload-Length.", 413)
+                        f.write(chunk)
+                        written += len(chunk)
+                        if hasher is not None:
+                            hasher[1].update(chunk)
+                if head is not None and written == session["length"]:
+                    validate_signature(head, extension) # Also a file shorter than the longest signature
+            except UploadError:
+                # Roll the partial file back to the last acknowledged offset
+                with open(part_path, 'ab') as f:
+                    f.truncate(offset)
+                self._hashers.pop(upload_id, None)
+                raise
+            if hasher is not None:
+                self._hashers[upload_id] = (written, hasher[1])
+            return written
+
+    def complete(self, upload_id, user_id, file_path, in_memory_limit=IN_MEMORY_LIMIT):
+        """
+        Moves a fully received upload to file_path. Returns the same dict as receive_stream()
+        plus the original filename; data is read back from file_path for uploads up to
+        in_memory_limit.
+        """
+        with self._upload_lock(upload_id):
+            session = self.get(upload_id, user_id)
+            if session["offset"] != session["length"]:
+                raise UploadError(f"Upload incomplete: {session['offset']} of {session['length']} bytes received.", 409)
+            meta_path, part_path = self._paths(upload_id)
+            hasher = self._hashers.pop(upload_id, None)
+            if hasher is not None and hasher[0] == session["length"]:
+                sha256 = hasher[1].hexdigest()
+            else:
+                sha256 = hash_file(part_path)
+            os.replace(part_path, file_path)
+            os.remove(meta_path)
+        data = None
+        if session["length"] <= in_memory_limit:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        return {"path": file_path, "size": session["length"], "sha256": sha256, "data": data,
+                "filename": session["filename"]}
+
+    def abort(self, upload_id, user_id):
+        with self._upload_lock(upload_id):
+            self.get(upload_id, user_id)
+            self._remove(upload_id)
+
+    def _remove(self, upload_id):
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+        self._hashers.pop(upload_id, None)
+
+    def expire_stale(self):
+        """Deletes uploads not completed within the TTL. Returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.folder):
+            upload_id, extension = os.path.splitext(name)
+            if extension != ".json":
+                continue
+            _, part_path = self._paths(upload_id)
+            last_activity = os.path.getmtime(part_path) if os.path.exists(part_path) else 0
+            if last_activity < cutoff:
+                self._remove(upload_id)
+                removed += 1
+        if removed:
+            logger.info("Expired %d stale resumable upload(s).", removed)
+        return removed
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
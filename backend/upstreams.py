@@ -0,0 +1,308 @@
+# backend/upstreams.py
+"""
+Outbound clients for the external APIs the backend calls: OpenAI and the YouTube Data API.
+
+Every call goes through an Upstream, which adds:
+- per-call timeouts and pooled keep-alive connections (set on the underlying HTTP clients),
+- retries of transient failures (timeouts, connection errors, 429 and 5xx) with full-jitter
+  exponential backoff,
+- a circuit breaker: after `failure_threshold` consecutive failures the upstream is
+  considered down for `reset_seconds`, and calls fail immediately with UpstreamUnavailable
+  instead of tying up request threads; then a single trial call decides whether it is back,
+- latency and error metrics per upstream.
+
+Calls with a cache key (YouTube searches) are answered from a TTL cache while fresh, and
+from a stale entry when the upstream fails or its breaker is open.
+
+OPENAI_BASE_URL and YOUTUBE_API_ENDPOINT point the clients at other servers, e.g. the fake
+upstreams in benchmarks/fake_upstreams.py.
+"""
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import httplib2
+import httpx
+import openai
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+
+from observability import Counter, Histogram, get_logger, register
+
+logger = get_logger("upstreams")
+
+UPSTREAM_SECONDS = register(Histogram(
+    "noteverse_upstream_request_duration_seconds", "Latency of calls to external APIs, per attempt.",
+    ["upstream", "outcome"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+))
+UPSTREAM_CALLS = register(Counter(
+    "noteverse_upstream_calls_total",
+    "Calls to external APIs by result (ok, error, retried, short_circuit, cache_hit, stale).",
+    ["upstream", "result"]
+))
+BREAKER_TRANSITIONS = register(Counter(
+    "noteverse_upstream_breaker_transitions_total", "Circuit breaker state changes.", ["upstream", "state"]
+))
+
+OPENAI_TIMEOUT = 60.0 # Vision transcription of a dense page can take most of this
+OPENAI_CONNECT_TIMEOUT = 5.0
+OPENAI_MAX_CONNECTIONS = 20
+YOUTUBE_TIMEOUT = 10.0
+YOUTUBE_CACHE_SECONDS = 6 * 3600 # Search results change slowly and cost quota
+YOUTUBE_STALE_SECONDS = 7 * 86400
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream's circuit breaker is open: the call was not attempted."""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} is temporarily unavailable; retry in {int(retry_after) + 1}s.")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 3 # Including the first call
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+
+    def delay(self, attempt):
+        """Full jitter: a random wait of up to base_delay * 2^attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open -> closed)."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            self.state = state
+            BREAKER_TRANSITIONS.inc(self.name, state)
+            log = logger.warning if state == self.OPEN else logger.info
+            log("Circuit breaker for %s is now %s.", self.name, state)
+
+    def before_call(self):
+        """Raises UpstreamUnavailable unless a call may go out now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_seconds - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True # This call is the trial
+                return
+            raise UpstreamUnavailable(self.name, max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries are fresh for `ttl` seconds and kept (stale) for `stale_ttl`."""
+
+    def __init__(self, maxsize=1024, ttl=YOUTUBE_CACHE_SECONDS, stale_ttl=YOUTUBE_STALE_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict() # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(value, fresh) for a cached key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            age = time.monotonic() - entry[0]
+            if age > self.stale_ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], age <= self.ttl
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class Upstream:
+    """
+    Retry, circuit breaking and metrics around the calls to one external API. is_transient
+    tells failures of the upstream (retried, counted by the breaker) from errors of the
+    request itself (raised at once, and proof that the upstream is up).
+    """
+
+    def __init__(self, name, is_transient, retry=None, breaker=None, cache=None):
+        self.name = name
+        self.is_transient = is_transient
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(name)
+        self.cache = cache
+
+    def call(self, function, *args, **kwargs):
+        for attempt in range(self.retry.attempts):
+            try:
+                self.breaker.before_call()
+            except UpstreamUnavailable:
+                UPSTREAM_CALLS.inc(self.name, "short_circuit")
+                raise
+            started = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                transient = self.is_transient(e)
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, self.name, "error" if transient else "rejected")
+                if not transient:
+                    self.breaker.record_success()
+                    UPSTREAM_CALLS.inc(self.name, "rejected")
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 >= self.retry.attempts:
+                    UPSTREAM_CALLS.inc(self.name, "error")
+                    raise
+                UPSTREAM_CALLS.inc(self.name, "retried")
+                delay = max(self.retry.delay(attempt), min(retry_after_seconds(e), self.retry.max_delay))
+                logger.warning("%s call failed (%s: %s); retry %d of %d in %.1fs.", self.name, type(e).__name__, e,
+                               attempt + 1, self.retry.attempts - 1, delay)
+                time.sleep(delay)
+            else:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, self.name, "ok")
+                UPSTREAM_CALLS.inc(self.name, "ok")
+                self.breaker.record_success()
+                return result
+
+    def cached_call(self, key, function, *args, **kwargs):
+        """
+        call() through the cache. Returns (result, source) with source "cache", "upstream" or
+        "stale" (a cached result served because the upstream failed or is unavailable).
+        """
+        cached = self.cache.get(key)
+        if cached is not None and cached[1]:
+            UPSTREAM_CALLS.inc(self.name, "cache_hit")
+            return cached[0], "cache"
+        try:
+            result = self.call(function, *args, **kwargs)
+        except Exception as e:
+            if cached is None or not (isinstance(e, UpstreamUnavailable) or self.is_transient(e)):
+                raise
+            UPSTREAM_CALLS.inc(self.name, "stale")
+            logger.warning("Serving a stale cached %s result: %s", self.name, e)
+            return cached[0], "stale"
+        self.cache.set(key, result)
+        return result, "upstream"
+
+
+def retry_after_seconds(error):
+    """The Retry-After of an HTTP error response, or 0."""
+    response = getattr(error, "response", None) or getattr(error, "resp", None)
+    headers = getattr(response, "headers", response) # httplib2 responses are dicts of headers
+    try:
+        return float(headers.get("retry-after", 0)) if headers else 0.0
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+
+
+# --- OpenAI ---
+
+def openai_transient(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class ResilientOpenAI:
+    """
+    Stands in for an OpenAI client where the app uses one (`client.chat.completions.create`),
+    sending every completion through an Upstream.
+    """
+
+    def __init__(self, client, upstream):
+        self.client = client
+        self.upstream = upstream
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+
+    def _create_chat_completion(self, **kwargs):
+        return self.upstream.call(self.client.chat.completions.create, **kwargs)
+
+
+def openai_client(api_key, base_url=None, timeout=OPENAI_TIMEOUT, connect_timeout=OPENAI_CONNECT_TIMEOUT,
+                  max_connections=OPENAI_MAX_CONNECTIONS, retry=None, breaker=None):
+    """A ResilientOpenAI over one pooled HTTP client (retries are done by the Upstream, not the SDK)."""
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    )
+    client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    return ResilientOpenAI(client, Upstream("openai", openai_transient, retry, breaker or CircuitBreaker("openai")))
+
+
+# --- YouTube Data API ---
+
+def youtube_transient(error):
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return isinstance(error, (socket.timeout, TimeoutError, ConnectionError, httplib2.HttpLib2Error))
+
+
+class YouTubeClient:
+    """Video search over the YouTube Data API, cached and behind an Upstream."""
+
+    def __init__(self, api_key, api_endpoint=None, timeout=YOUTUBE_TIMEOUT, retry=None, breaker=None, cache=None):
+        self.timeout = timeout
+        self._local = threading.local()
+        self.service = discovery.build(
+            'youtube', 'v3', developerKey=api_key, http=self._http(), cache_discovery=False,
+            client_options={"api_endpoint": api_endpoint} if api_endpoint else None
+        )
+        self.upstream = Upstream("youtube", youtube_transient, retry, breaker or CircuitBreaker("youtube"),
+                                 cache or TTLCache())
+
+    def _http(self):
+        # httplib2.Http is not thread-safe; one per thread keeps its connections alive between calls
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=self.timeout)
+        return http
+
+    def search_videos(self, query, max_results=5, language='en'):
+        """The search response for a query and its source ("upstream", "cache" or "stale")."""
+        request = self.service.search().list(
+            q=query,
+            part='snippet',  # Request snippet details (title, description, thumbnails)
+            type='video',    # Only search for videos
+            maxResults=max_results,
+            relevanceLanguage=language
+        )
+        return self.upstream.cached_call((query, max_results, language), lambda: request.execute(http=self._http()))
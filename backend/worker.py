@@ -0,0 +1,219 @@
+# backend/worker.py
+"""
+Ingestion worker: processes upload jobs queued by API servers running with INGEST_MODE=queue.
+
+Each worker process loads the models once and claims up to --batch-size jobs at a time, which
+run through the pipeline together (one embedding call and one keyword batch for all of them).
+Run as many processes (on as many nodes) as there is CPU for embeddings and keywords. All workers share the
+MongoDB queue and the object storage (use STORAGE_BACKEND=s3 when workers run on other
+machines than the API servers).
+
+Examples:
+    python worker.py
+    python worker.py --once            # Drain the queue and exit
+    python worker.py --batch-size 16   # Process up to 16 queued uploads as one batch
+    python worker.py --requeue <job_id> # Retry a dead-lettered job
+    python worker.py --purge-dead 14   # Delete jobs dead or failed for 14+ days and their uploads
+
+A job that failed for good keeps its stored upload, so it can be requeued once the cause is
+fixed; the upload is only released when the job is purged.
+"""
+import argparse
+import signal
+import sys
+import time
+from contextlib import ExitStack
+
+import app as api # Loads configuration, models, MongoDB, ChromaDB and object storage
+from jobs import DEAD, FAILED, DeferJob, LeaseKeeper, PermanentJobError, default_worker_id
+from observability import logger, new_trace_id, span
+from storage import thumbnail_key
+
+
+def handle_ingest_notes(jobs):
+    """
+    Runs ingest_notes() on the stored originals of a batch of upload jobs, one batch per user.
+    Returns, per job, the API response body or the exception the job failed with.
+    """
+    outcomes = [None] * len(jobs)
+    pending = []
+    for i, job in enumerate(jobs):
+        # The note id is the job id: a retry after a crash past the insert finds the note instead of
+        # creating a duplicate (ChromaDB chunk ids are deterministic as well)
+        if api.db.notes.find_one({"_id": job["_id"]}, {"_id": 1}):
+            outcomes[i] = {"message": "Note already processed.", "note_id": str(job["_id"])}
+        else:
+            pending.append(i)
+    by_user = {}
+    for i in pending:
+        by_user.setdefault(jobs[i]["user_id"], []).append(i)
+
+    for user_id, indexes in by_user.items():
+        with ExitStack() as stack:
+            uploads = []
+            for i in indexes:
+                payload = jobs[i]["payload"]
+                uploads.append({
+                    "filename": payload["filename"],
+                    "file_path": stack.enter_context(api.object_storage.local_path(payload["storage_key"])),
+                    "content_sha256": payload["content_sha256"],
+                    "file_size": payload.get("file_size"),
+                    "storage_key": payload["storage_key"],
+                    "note_id": jobs[i]["_id"]
+                })
+            results = api.ingest_notes(user_id, uploads)
+        for i, (body, status) in zip(indexes, results):
+            if status == 429: # The user's daily token budget is spent: wait for it to reset, not an attempt
+                outcomes[i] = DeferJob(body.get("message", "Token budget spent."), body.get("retry_after", 3600))
+            elif status >= 500:
+                outcomes[i] = RuntimeError(body.get("message", f"Ingestion failed with status {status}."))
+            elif status >= 400:
+                outcomes[i] = PermanentJobError(body.get("message", f"Ingestion rejected with status {status}."))
+            else:
+                outcomes[i] = body
+    return outcomes
+
+
+def discard_ingest_note(job):
+    """Releases the stored upload of a purged job (unless a note or another job still uses it)."""
+    payload = job["payload"]
+    api.release_stored_upload(payload["storage_key"], thumbnail_key(payload["content_sha256"]))
+
+
+def ingest_note_requeueable(job):
+    """A failed ingest job can only run again while its stored upload exists."""
+    return api.object_storage.exists(job["payload"]["storage_key"])
+
+
+# Job type -> (handler of a batch of jobs, cleanup of a purged job, check before a requeue)
+HANDLERS = {"ingest_note": (handle_ingest_notes, discard_ingest_note, ingest_note_requeueable)}
+
+
+class Worker:
+    def __init__(self, queue, worker_id=None, poll_interval=2.0, batch_size=1):
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.poll_interval = poll_interval
+        self.batch_size = max(1, batch_size)
+        self.stopping = False
+
+    def stop(self, *_):
+        logger.info("Worker %s stopping after the current batch.", self.worker_id)
+        self.stopping = True
+
+    def claim_batch(self):
+        """Claims up to batch_size jobs of the same type. Returns an empty list if there are none."""
+        job = self.queue.claim(self.worker_id, job_types=list(HANDLERS))
+        if job is None:
+            return []
+        jobs = [job]
+        while len(jobs) < self.batch_size:
+            job = self.queue.claim(self.worker_id, job_types=[jobs[0]["type"]])
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    def _settle(self, job, outcome, lease):
+        """Records the outcome of one job of a batch."""
+        if lease.lost:
+            logger.warning("Job %s finished after its lease was lost; result not recorded.", job["_id"])
+        elif isinstance(outcome, DeferJob):
+            self.queue.defer(job, self.worker_id, outcome.delay, str(outcome))
+        elif isinstance(outcome, PermanentJobError):
+            self.queue.fail(job, self.worker_id, str(outcome), permanent=True)
+        elif isinstance(outcome, Exception):
+            self.queue.fail(job, self.worker_id, str(outcome))
+        else:
+            self.queue.complete(job, self.worker_id, result=outcome)
+
+    def run_one(self):
+        """Claims and processes one batch of jobs. Returns False if the queue had nothing to claim."""
+        jobs = self.claim_batch()
+        if not jobs:
+            return False
+        job_type = jobs[0]["type"]
+        # Logs of a single job share the trace id of its upload request
+        new_trace_id(jobs[0].get("trace_id") if len(jobs) == 1 else None)
+        for job in jobs:
+            logger.info("Job %s (%s) claimed, attempt %d/%d, trace %s.", job["_id"], job_type, job["attempts"],
+                        job["max_attempts"], job.get("trace_id"))
+        handle = HANDLERS[job_type][0]
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            leases = [stack.enter_context(LeaseKeeper(self.queue, job, self.worker_id)) for job in jobs]
+            try:
+                with span(f"job_{job_type}"):
+                    outcomes = handle(jobs)
+            except Exception as e:
+                logger.exception("Batch of %d %s job(s) failed.", len(jobs), job_type)
+                outcomes = [e] * len(jobs)
+        for job, outcome, lease in zip(jobs, outcomes, leases):
+            self._settle(job, outcome, lease)
+        logger.info("Batch of %d %s job(s) done in %.1fs.", len(jobs), job_type, time.perf_counter() - started)
+        return True
+
+    def run(self, once=False):
+        logger.info("Worker %s started (batches of up to %d jobs).", self.worker_id, self.batch_size)
+        while not self.stopping:
+            if self.run_one():
+                continue
+            if once:
+                break
+            time.sleep(self.poll_interval)
+        logger.info("Worker %s stopped.", self.worker_id)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Process queued NoteVerse ingestion jobs.")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between polls of an empty queue.")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="Jobs claimed and processed together (one embedding/keyword batch).")
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--requeue", metavar="JOB_ID", default=None, help="Requeue a dead-lettered or failed job and exit.")
+    parser.add_argument("--purge-dead", metavar="DAYS", type=float, default=None,
+                        help="Delete jobs dead-lettered or failed more than DAYS ago, release their uploads and exit.")
+    return parser.parse_args()
+
+
+def requeue(queue, job_id):
+    job = queue.get(job_id)
+    if job is None or job["status"] not in (DEAD, FAILED):
+        return f"Job {job_id} is not dead-lettered or failed."
+    handler = HANDLERS.get(job["type"])
+    if handler is None or not handler[2](job):
+        return f"Job {job_id} cannot be requeued: its input is no longer stored."
+    if not queue.requeue_dead(job_id):
+        return f"Job {job_id} is not dead-lettered or failed."
+    return f"Job {job_id} requeued."
+
+
+def purge(queue, days):
+    def release(job):
+        handler = HANDLERS.get(job["type"])
+        if handler is not None:
+            handler[1](job)
+    purged = queue.purge(time.time() - days * 86400, on_purge=release)
+    return f"Purged {purged} job(s) dead-lettered or failed more than {days:g} day(s) ago."
+
+
+def main():
+    args = parse_args()
+    if api.ingest_jobs is None:
+        sys.exit("MongoDB is not available: the job queue cannot be used.")
+    if args.requeue:
+        print(requeue(api.ingest_jobs, args.requeue))
+        return
+    if args.purge_dead is not None:
+        print(purge(api.ingest_jobs, args.purge_dead))
+        return
+    worker = Worker(api.ingest_jobs, worker_id=args.worker_id, poll_interval=args.poll_interval,
+                    batch_size=args.batch_size)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
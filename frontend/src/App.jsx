@@ -271,6 +271,7 @@ function App() {
                     onBack={() => { setCurrentView('list'); setSelectedNoteId(null); }}
                     onError={(msg) => setError(msg)}
                     onQuizGenerated={(quizId) => { setCurrentView('quiz'); setCurrentQuizId(quizId); }}
+                    onSelectNote={(relatedNoteId) => setSelectedNoteId(relatedNoteId)}
                 />
             ) : currentView === 'quiz' && currentQuizId ? (
                 <QuizTaker
@@ -131,14 +131,20 @@ function Dashboard({ onError, userDisplayName }) {
               <Typography variant="h6" gutterBottom>
                 Topic Mastery
               </Typography>
-              <ResponsiveContainer width="100%" height={300}>
-                <BarChart data={stats.topic_mastery} margin={{ top: 20, right: 30, left: 20, bottom: 5 }}>
-                  <XAxis dataKey="topic" />
-                  <YAxis />
-                  <Tooltip />
-                  <Bar dataKey="percentage" fill="#82ca9d" name="Mastery (%)" />
-                </BarChart>
-              </ResponsiveContainer>
+              {stats.topic_mastery.length > 0 ? (
+                <ResponsiveContainer width="100%" height={300}>
+                  <BarChart data={stats.topic_mastery} margin={{ top: 20, right: 30, left: 20, bottom: 5 }}>
+                    <XAxis dataKey="topic" />
+                    <YAxis domain={[0, 100]} />
+                    <Tooltip />
+                    <Bar dataKey="percentage" fill="#82ca9d" name="Mastery (%)" />
+                  </BarChart>
+                </ResponsiveContainer>
+              ) : (
+                <Typography variant="body2" color="text.secondary">
+                  Take quizzes on your notes to see your mastery of each topic.
+                </Typography>
+              )}
             </Paper>
           </Grid>
         </Grid>
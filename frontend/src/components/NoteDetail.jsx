@@ -2,9 +2,10 @@
 import React, { useState, useEffect } from 'react';
 import { Box, Typography, Button, Card, CardContent, Grid, CircularProgress, Link, Paper } from '@mui/material';
 
-function NoteDetail({ noteId, onBack, onError, onQuizGenerated }) {
+function NoteDetail({ noteId, onBack, onError, onQuizGenerated, onSelectNote }) {
   const [note, setNote] = useState(null);
   const [resources, setResources] = useState([]);
+  const [relatedNotes, setRelatedNotes] = useState([]);
   const [loading, setLoading] = useState(true);
   const [apiError, setApiError] = useState(null);
   const [generatingQuiz, setGeneratingQuiz] = useState(false);
@@ -41,6 +42,17 @@ function NoteDetail({ noteId, onBack, onError, onQuizGenerated }) {
         const resourcesData = await resourcesResponse.json();
         setResources(resourcesData.videos || []);
 
+        // Precomputed on upload, so this is cheap; the note is still shown if it fails
+        const relatedResponse = await fetch(`http://localhost:5000/api/notes/${noteId}/related`, {
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (relatedResponse.ok) {
+          const relatedData = await relatedResponse.json();
+          setRelatedNotes(relatedData.related || []);
+        } else {
+          setRelatedNotes([]);
+        }
+
       } catch (error) {
         console.error("Error fetching note details or resources:", error);
         setApiError(`Failed to load details: ${error.message}`);
@@ -162,6 +174,28 @@ function NoteDetail({ noteId, onBack, onError, onQuizGenerated }) {
         </Typography>
       </Paper>
 
+      <Paper elevation={1} sx={{ p: 3, mb: 3, backgroundColor: 'background.default', border: '1px solid #dde1e2' }}>
+        <Typography variant="h5" component="h3" gutterBottom sx={{ color: 'text.primary', borderBottom: '1px solid', borderColor: 'divider', pb: 1, mb: 2 }}>
+          Related Notes
+        </Typography>
+        {relatedNotes.length > 0 ? (
+          <Box sx={{ display: 'flex', flexDirection: 'column', gap: 1 }}>
+            {relatedNotes.map(related => (
+              <Box key={related.id} sx={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center' }}>
+                <Link component="button" variant="body1" onClick={() => onSelectNote && onSelectNote(related.id)} sx={{ textAlign: 'left' }}>
+                  {related.filename}
+                </Link>
+                <Typography variant="body2" color="text.secondary">
+                  {Math.round(related.score * 100)}% similar
+                </Typography>
+              </Box>
+            ))}
+          </Box>
+        ) : (
+          <Typography variant="body1" color="text.secondary">No related notes yet.</Typography>
+        )}
+      </Paper>
+
       <Paper elevation={1} sx={{ p: 3, mb: 3, backgroundColor: 'background.default', border: '1px solid #ddd' }}>
         <Typography variant="h5" component="h3" gutterBottom sx={{ color: 'text.primary', borderBottom: '1px solid', borderColor: 'divider', pb: 1, mb: 2 }}>
           Related YouTube Resources
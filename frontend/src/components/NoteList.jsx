@@ -1,8 +1,63 @@
 import React, { useState, useEffect } from 'react';
-import { Box, Typography, Card, CardContent, Button, CircularProgress, Alert, TextField, InputAdornment, IconButton, Paper } from '@mui/material';
+import { Box, Typography, Card, CardContent, CardMedia, Button, CircularProgress, Alert, TextField, InputAdornment, IconButton, Paper } from '@mui/material';
 import { Search, Add, Clear } from '@mui/icons-material';
 import { getAuth } from 'firebase/auth';
 
+// Thumbnails need the Authorization header like every API route, so an <img> cannot load
+// them directly: they are fetched with the token and shown from a blob URL.
+function NoteThumbnail({ url, alt }) {
+    const [src, setSrc] = useState(null);
+
+    useEffect(() => {
+        if (!url) {
+            return undefined;
+        }
+        let cancelled = false;
+        let objectUrl = null;
+        const loadThumbnail = async () => {
+            try {
+                const user = getAuth().currentUser;
+                if (!user) {
+                    return;
+                }
+                const token = await user.getIdToken();
+                const response = await fetch(url, {
+                    headers: { 'Authorization': `Bearer ${token}` }
+                });
+                if (!response.ok) {
+                    return;
+                }
+                const blob = await response.blob();
+                if (!cancelled) {
+                    objectUrl = URL.createObjectURL(blob);
+                    setSrc(objectUrl);
+                }
+            } catch (error) {
+                console.error("Failed to load thumbnail:", error);
+            }
+        };
+        loadThumbnail();
+        return () => {
+            cancelled = true;
+            if (objectUrl) {
+                URL.revokeObjectURL(objectUrl);
+            }
+        };
+    }, [url]);
+
+    if (!src) {
+        return null;
+    }
+    return (
+        <CardMedia
+            component="img"
+            image={src}
+            alt={alt}
+            sx={{ height: 160, objectFit: 'cover', objectPosition: 'top' }}
+        />
+    );
+}
+
 function NoteList({ onSelectNote, onNavigateToUpload, onError }) {
     const [notes, setNotes] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -132,6 +187,7 @@ function NoteList({ onSelectNote, onNavigateToUpload, onError }) {
                             sx={{ cursor: 'pointer', transition: 'transform 0.2s', '&:hover': { transform: 'scale(1.03)' } }}
                             onClick={() => onSelectNote(note.id)}
                         >
+                            <NoteThumbnail url={note.thumbnail_url} alt={note.filename} />
                             <CardContent>
                                 <Typography variant="h6" component="div" noWrap>
                                     {note.filename || `Note from ${new Date(note.upload_date * 1000).toLocaleDateString()}`}
@@ -11,6 +11,8 @@ function QuizTaker({ quizId, onBack, onError }) {
   const [score, setScore] = useState(0);
   const [quizCompleted, setQuizCompleted] = useState(false);
   const [showCorrectAnswer, setShowCorrectAnswer] = useState(false);
+  const [answers, setAnswers] = useState([]);
+  const [startedAt, setStartedAt] = useState(Date.now());
 
   useEffect(() => {
     const fetchQuiz = async () => {
@@ -63,6 +65,33 @@ function QuizTaker({ quizId, onBack, onError }) {
     if (selectedOption === currentQuestion.correct_answer) {
       setScore(prevScore => prevScore + 1);
     }
+    setAnswers(prevAnswers => [...prevAnswers, { question_index: currentQuestionIndex, selected_option: selectedOption }]);
+  };
+
+  // Records the attempt so the questions are scheduled for revision and count in the dashboard
+  const submitAttempt = async (finalAnswers) => {
+    const token = localStorage.getItem('firebaseIdToken');
+    if (!token || finalAnswers.length === 0) return;
+    try {
+      const response = await fetch(`http://localhost:5000/api/quizzes/${quizId}/attempts`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
+        body: JSON.stringify({
+          answers: finalAnswers,
+          duration_seconds: Math.round((Date.now() - startedAt) / 1000)
+        }),
+      });
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.message || `HTTP error! status: ${response.status}`);
+      }
+    } catch (error) {
+      console.error("Error submitting quiz attempt:", error);
+      onError(`Failed to save quiz results: ${error.message}`);
+    }
   };
 
   const handleNextQuestion = () => {
@@ -72,6 +101,7 @@ function QuizTaker({ quizId, onBack, onError }) {
       setCurrentQuestionIndex(prevIndex => prevIndex + 1);
     } else {
       setQuizCompleted(true);
+      submitAttempt(answers);
     }
   };
 
@@ -81,6 +111,8 @@ function QuizTaker({ quizId, onBack, onError }) {
     setScore(0);
     setQuizCompleted(false);
     setShowCorrectAnswer(false);
+    setAnswers([]);
+    setStartedAt(Date.now());
   };
 
 
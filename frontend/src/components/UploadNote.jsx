@@ -13,13 +13,17 @@ function UploadNote({ onUploadSuccess, onError }) {
       onError("Please select an image or PDF file to upload.");
       return;
     }
-    const file = acceptedFiles[0];
-
     setIsUploading(true);
     setUploadProgress(0);
 
+    // Several files go to the batch endpoint in one request, processed as one batch
+    const isBatch = acceptedFiles.length > 1;
     const formData = new FormData();
-    formData.append('noteImage', file);
+    if (isBatch) {
+      acceptedFiles.forEach((file) => formData.append('noteImages', file));
+    } else {
+      formData.append('noteImage', acceptedFiles[0]);
+    }
 
     try {
       const token = localStorage.getItem('firebaseIdToken');
@@ -29,7 +33,8 @@ function UploadNote({ onUploadSuccess, onError }) {
         return;
       }
 
-      const response = await fetch('http://localhost:5000/api/upload-note', { // Full URL to Flask backend
+      const endpoint = isBatch ? 'upload-notes' : 'upload-note';
+      const response = await fetch(`http://localhost:5000/api/${endpoint}`, { // Full URL to Flask backend
         method: 'POST',
         headers: {
           'Authorization': `Bearer ${token}`
@@ -43,6 +48,10 @@ function UploadNote({ onUploadSuccess, onError }) {
       }
 
       const result = await response.json();
+      const failed = (result.results || []).filter((fileResult) => fileResult.status === 'failed');
+      if (failed.length > 0) {
+        onError(`Some files failed: ${failed.map((fileResult) => `${fileResult.filename} (${fileResult.message})`).join('; ')}`);
+      }
       onUploadSuccess(result.message);
 
     } catch (error) {
@@ -61,7 +70,7 @@ function UploadNote({ onUploadSuccess, onError }) {
       'image/png': ['.png'],
       'application/pdf': ['.pdf'],
     },
-    multiple: false,
+    multiple: true,
   });
 
   return (
@@ -103,10 +112,10 @@ function UploadNote({ onUploadSuccess, onError }) {
         <>
           <CloudUploadIcon sx={{ fontSize: 60, color: 'primary.main', mb: 2 }} />
           <Typography variant="h6" color="text.primary" sx={{ mb: 1 }}>
-            {isDragActive ? 'Drop the file here...' : 'Drag & drop your note here, or click to select'}
+            {isDragActive ? 'Drop the files here...' : 'Drag & drop your notes here, or click to select'}
           </Typography>
           <Typography variant="body2" color="text.secondary">
-            Supported formats: JPG, PNG, PDF. (Max 16MB)
+            Supported formats: JPG, PNG, PDF. (Max 16MB per file)
           </Typography>
           <Button variant="outlined" color="primary" sx={{ mt: 3, textTransform: 'none', borderRadius: '8px' }}>
             Browse Files